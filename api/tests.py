@@ -1,3 +1,85 @@
-from django.test import TestCase
+import datetime as dt
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from charts import screener
+from companies.models import Company
+from fundamentals import asof
+from fundamentals.services import MetricWriter
+
+
+class MetricsApiTests(TestCase):
+    def setUp(self):
+        # las versiones de datos se reinician con cada test: vaciar las cachés por proceso
+        cache.clear()
+        asof._cache.update(stamp=None)  # se rearma en la próxima lectura
+        screener._state.update(stamp=None, frame=None)
+        self.a = Company.objects.create(ticker="AAA", name="A", sector="Tech")
+        self.b = Company.objects.create(ticker="BBB", name="B", sector="Energy")
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", dt.date(2020, 3, 31), "TTM", 10.0)
+            w.add(self.a.id, "PE_TTM", dt.date(2020, 6, 30), "TTM", 12.0)
+            w.add(self.a.id, "MarketCap", dt.date(2020, 6, 30), "TTM", 5e9)
+            w.add(self.b.id, "PE_TTM", dt.date(2020, 6, 30), "TTM", 8.0)
+            w.add(self.b.id, "MarketCap", dt.date(2020, 6, 30), "TTM", 2e10)
+
+    def test_asof(self):
+        url = reverse("metrics-asof")
+        resp = self.client.get(url, {"date": "2020-05-01", "keys": "PE_TTM,MarketCap"})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["results"], [{"ticker": "AAA", "PE_TTM": 10.0, "PE_TTM_period_end": "2020-03-31"}])
+
+        data = self.client.get(url, {"date": "2020-07-01", "keys": "PE_TTM", "tickers": "bbb"}).json()
+        self.assertEqual([(r["ticker"], r["PE_TTM"]) for r in data["results"]], [("BBB", 8.0)])
+
+    def test_asof_bad_params(self):
+        url = reverse("metrics-asof")
+        self.assertEqual(self.client.get(url, {"keys": "PE_TTM"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"date": "2020-13-01", "keys": "PE_TTM"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"date": "2020-06-30"}).status_code, 400)
+        resp = self.client.get(url, {"date": "2020-06-30", "keys": "PE_TTM,NOPE"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("NOPE", resp.json()["detail"])
+        self.assertNotIn("NOPE", asof._cache["keys"])
+
+    def test_asof_unknown_tickers(self):
+        resp = self.client.get(reverse("metrics-asof"), {"date": "2020-06-30", "keys": "PE_TTM", "tickers": "NOPE"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["count"], 0)
+
+    def test_latest_by_ticker(self):
+        resp = self.client.get(reverse("metrics-latest-by-ticker", args=["aaa"]))
+        self.assertEqual(resp.status_code, 200)
+        m = resp.json()["metrics"]
+        self.assertEqual(m["PE_TTM"], {"value": 12.0, "period_end": "2020-06-30", "period_type": "TTM"})
+        self.assertEqual(self.client.get(reverse("metrics-latest-by-ticker", args=["NOPE"])).status_code, 404)
+
+    def test_pe_ranking_and_screener(self):
+        rows = self.client.get(reverse("pe-ranking")).json()["results"]
+        self.assertEqual([r["ticker"] for r in rows], ["BBB", "AAA"])
+        rows = self.client.get(reverse("pe-ranking"), {"sector": "tech"}).json()["results"]
+        self.assertEqual([r["ticker"] for r in rows], ["AAA"])
+
+        rows = self.client.get(reverse("screener-api"), {"order": "mcap_desc", "limit": "1"}).json()["results"]
+        self.assertEqual([(r["ticker"], r["marketcap"]) for r in rows], [("BBB", 2e10)])
+        rows = self.client.get(reverse("screener-api"), {"min_mcap": "1e10", "limit": "x"}).json()["results"]
+        self.assertEqual([r["ticker"] for r in rows], ["BBB"])
+
+    @override_settings(STORAGES={
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    })
+    def test_cached_response_follows_accept(self):
+        url = reverse("metrics-asof")
+        params = {"date": "2020-07-01", "keys": "PE_TTM"}
+        html = self.client.get(url, params, HTTP_ACCEPT="text/html")
+        self.assertTrue(html["Content-Type"].startswith("text/html"))
+        for accept in ("application/json", "*/*"):  # el HTML cacheado no se sirve a clientes JSON (ni al revés)
+            resp = self.client.get(url, params, HTTP_ACCEPT=accept)
+            self.assertEqual(resp["Content-Type"], "application/json")
+            self.assertEqual(resp.json()["count"], 2)
+        self.assertTrue(self.client.get(url, params, HTTP_ACCEPT="text/html")["Content-Type"].startswith("text/html"))
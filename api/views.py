@@ -1,8 +1,22 @@
 # api/views.py
+import datetime as dt
+import json
+
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
-from fundamentals.models import Metric
+from rest_framework import status, viewsets
+
+from api.serializers import RankingResultSerializer
+from charts.screener import SCREENER_ORDER, get_frame, top_k
+from charts.services import price_trend, revenue_trend
+from companies.models import Company
+from core.cache import company_id_for_ticker, versioned_cache_page
+from fundamentals.asof import known_keys, metrics_asof
+from fundamentals.models import LatestMetric, Metric
+from rankings.engine import SLUG
+from rankings.models import Ranking, RankingResult
 
 PERIOD_MAP = {"annual": "A", "a": "A", "A": "A", "quarter": "Q", "q": "Q", "Q": "Q"}
 
@@ -38,3 +52,148 @@ class MetricSeriesByTicker(APIView):
             "count": len(data),
             "series": data,
         })
+
+
+def _company_of(request, ticker: str):
+    return company_id_for_ticker(ticker)
+
+
+@method_decorator(versioned_cache_page(company=_company_of, prefix="api.metrics.latest", negotiate=True),
+                  name="dispatch")
+class MetricsLatestByTicker(APIView):
+    """
+    Último valor de cada métrica de un ticker (LatestMetric).
+    GET /api/metrics/<ticker>/latest/
+    """
+    def get(self, request, ticker: str):
+        c = get_object_or_404(Company, ticker=ticker.upper())
+        metrics = {
+            key: {"value": float(value), "period_end": pe, "period_type": pt}
+            for key, value, pe, pt in LatestMetric.objects.filter(company=c)
+            .order_by("key").values_list("key", "value", "period_end", "period_type")
+        }
+        return Response({"ticker": c.ticker, "count": len(metrics), "metrics": metrics})
+
+
+@method_decorator(versioned_cache_page(company=_company_of, prefix="api.charts.revenue", negotiate=True),
+                  name="dispatch")
+class CompanyRevenueChart(APIView):
+    """
+    Figura Plotly (JSON) de revenue trimestral.
+    GET /api/charts/<ticker>/revenue/
+    """
+    def get(self, request, ticker: str):
+        c = get_object_or_404(Company, ticker=ticker.upper())
+        return Response(json.loads(revenue_trend(c)))
+
+
+@method_decorator(versioned_cache_page(company=_company_of, prefix="api.charts.price", negotiate=True),
+                  name="dispatch")
+class CompanyPriceChart(APIView):
+    """
+    Figura Plotly (JSON) de cierres diarios.
+    GET /api/charts/<ticker>/price/
+    """
+    def get(self, request, ticker: str):
+        c = get_object_or_404(Company, ticker=ticker.upper())
+        return Response(json.loads(price_trend(c)))
+
+
+class LatestRankingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Resultados de la corrida vigente de un ranking (Ranking.current_run).
+    GET /api/rankings/latest/?slug=quality_value
+    """
+    serializer_class = RankingResultSerializer
+
+    def get_queryset(self):
+        slug = self.request.query_params.get("slug") or SLUG
+        run_id = Ranking.objects.filter(slug=slug).values_list("current_run_id", flat=True).first()
+        if not run_id:
+            return RankingResult.objects.none()
+        return RankingResult.objects.filter(run_id=run_id).select_related("company").order_by("rank")
+
+
+def _float_param(request, name):
+    try:
+        return float(request.GET.get(name) or "")
+    except ValueError:
+        return None
+
+
+def _limit_param(request, default):
+    try:
+        return max(1, min(int(request.GET.get("limit") or default), 1000))
+    except ValueError:
+        return default
+
+
+@method_decorator(versioned_cache_page(prefix="api.rankings.pe", negotiate=True), name="dispatch")
+class PERanking(APIView):
+    """
+    Ranking por P/E TTM (más bajo primero), misma matriz que /pe/.
+    GET /api/rankings/pe/?sector=Technology&min_mcap=1e10&limit=200
+    """
+    def get(self, request):
+        frame = get_frame()
+        idx = frame.select((request.GET.get("sector") or "").strip(), _float_param(request, "min_mcap"))
+        idx = idx[top_k(frame.column("pe_ttm", idx), _limit_param(request, 200))]
+        rows = frame.rows(idx, ["marketcap", "pe_ttm"])
+        return Response({"count": len(rows), "results": rows})
+
+
+@method_decorator(versioned_cache_page(prefix="api.screener", negotiate=True), name="dispatch")
+class Screener(APIView):
+    """
+    Screener en JSON, mismos filtros y órdenes que /screener/.
+    GET /api/screener/?sector=Technology&min_mcap=1e10&order=yoy_desc&limit=100
+    """
+    def get(self, request):
+        sort_key, reverse = SCREENER_ORDER.get((request.GET.get("order") or "pe_asc").strip(), ("pe_ttm", False))
+        frame = get_frame()
+        idx = frame.select((request.GET.get("sector") or "").strip(), _float_param(request, "min_mcap"))
+        idx = idx[top_k(frame.column(sort_key, idx), _limit_param(request, 100), descending=reverse)]
+        rows = frame.rows(idx, ["marketcap", "pe_ttm", "ev_sales", "ev_ebitda", "fcf_yield", "rev_yoy", "rsi14"])
+        return Response({"count": len(rows), "results": rows})
+
+
+@method_decorator(versioned_cache_page(prefix="api.metrics.asof", negotiate=True), name="dispatch")
+class MetricsAsOf(APIView):
+    """
+    Corte transversal de métricas a una fecha (último valor con period_end <= date).
+    GET /api/metrics/asof/?date=2020-06-30&keys=PE_TTM,EV_Sales,MarketCap[&tickers=AAPL,MSFT]
+    """
+    def get(self, request):
+        try:
+            when = dt.date.fromisoformat(request.GET.get("date") or "")
+        except ValueError:
+            return Response({"detail": "param 'date' (YYYY-MM-DD) is required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        keys = [k.strip() for k in (request.GET.get("keys") or "").split(",") if k.strip()]
+        if not keys:
+            return Response({"detail": "param 'keys' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        unknown = [k for k in keys if k not in known_keys()]
+        if unknown:
+            return Response({"detail": f"unknown metric keys: {', '.join(unknown)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        companies = Company.objects.all()
+        tickers = [t.strip().upper() for t in (request.GET.get("tickers") or "").split(",") if t.strip()]
+        if tickers:
+            companies = companies.filter(ticker__in=tickers)
+        tickers_by_id = dict(companies.values_list("id", "ticker"))
+
+        data = metrics_asof(when, keys, company_ids=tickers_by_id.keys(), with_dates=True)
+        rows = {}
+        for key, values in data.items():
+            for cid, (v, pe) in values.items():
+                row = rows.setdefault(cid, {"ticker": tickers_by_id[cid]})
+                row[key] = v
+                row[f"{key}_period_end"] = pe
+        results = sorted(rows.values(), key=lambda r: r["ticker"])
+        return Response({
+            "date": when,
+            "keys": keys,
+            "count": len(results),
+            "results": results,
+        })
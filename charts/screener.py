@@ -0,0 +1,179 @@
+# charts/screener.py
+"""
+Motor en memoria para screener / pe / pe+.
+
+Cada proceso guarda una matriz compañía × métrica (float64, NaN = sin dato)
+con el último valor de LatestMetric, más columnas de ticker/nombre/sector/
+moneda. Filtros, normalización min-max, score ponderado y top-K son
+operaciones NumPy sobre esa matriz: cambiar pesos u orden no toca la base.
+
+La matriz se recarga cuando cambia la versión global de datos
+(core.cache.data_version, la misma que usan las cachés de vistas).
+
+Orden: igual que el sort previo con key (v is None, v): ascendente deja los
+vacíos al final; descendente (reverse=True) los deja al principio. Empates
+en el orden original de las compañías (por id).
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from companies.models import Company
+from core.cache import data_version
+from fundamentals.services import latest_metric_maps
+
+# columna de la vista -> key de Metric
+COLUMNS = {
+    "marketcap": "MarketCap",
+    "pe_ttm": "PE_TTM",
+    "ev_sales": "EV_Sales",
+    "ev_ebitda": "EV_EBITDA",
+    "fcf_yield": "FCF_Yield",
+    "rev_yoy": "Revenue_YoY",
+    "net_margin_ttm": "NetMargin_TTM",
+    "rsi14": "RSI_14",
+}
+
+# ?order= del screener (HTML y API) -> (columna, descendente)
+SCREENER_ORDER = {
+    "pe_asc": ("pe_ttm", False),
+    "pe_desc": ("pe_ttm", True),
+    "evs_asc": ("ev_sales", False),
+    "evs_desc": ("ev_sales", True),
+    "yoy_desc": ("rev_yoy", True),
+    "yoy_asc": ("rev_yoy", False),
+    "rsi_asc": ("rsi14", False),
+    "rsi_desc": ("rsi14", True),
+    "mcap_desc": ("marketcap", True),
+    "mcap_asc": ("marketcap", False),
+}
+
+_lock = threading.Lock()
+_state = {"stamp": None, "frame": None}
+
+
+class ScreenerFrame:
+    def __init__(self, companies: List[dict], maps: Dict[str, Dict[int, float]], sectors: List, stamp=None):
+        self.stamp = stamp
+        self.ids = np.array([c["id"] for c in companies], dtype=np.int64)
+        self.tickers = [c["ticker"] for c in companies]
+        self.names = [c["name"] for c in companies]
+        self.sectors = [c["sector"] for c in companies]
+        self.currencies = [c["currency"] for c in companies]
+        self._sector_lc = np.array([(s or "").lower() for s in self.sectors], dtype=object)
+        self.sector_choices = sectors  # para el <select> de las plantillas
+        self.values = {}
+        for col, key in COLUMNS.items():
+            m = maps.get(key, {})
+            self.values[col] = np.array([m.get(cid, np.nan) for cid in self.ids.tolist()], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, sector: str = "", min_mcap: Optional[float] = None) -> np.ndarray:
+        """Índices de las compañías que pasan los filtros (sector case-insensitive, mcap mínimo)."""
+        mask = np.ones(len(self), dtype=bool)
+        if sector:
+            mask &= self._sector_lc == sector.lower()
+        if min_mcap is not None:
+            mcap = self.values["marketcap"]
+            mask &= ~np.isnan(mcap) & (mcap >= min_mcap)
+        return np.flatnonzero(mask)
+
+    def column(self, col: str, idx: np.ndarray) -> np.ndarray:
+        return self.values[col][idx]
+
+    def pe_plus_score(self, idx: np.ndarray, weights: Dict[str, float]) -> np.ndarray:
+        """
+        Score ponderado de pe_plus_view sobre las filas `idx` (min-max dentro de
+        la selección). NaN si la compañía no tiene ninguna componente.
+        """
+        comps = (
+            (_minmax(self.column("pe_ttm", idx), invert=True), weights["w_pe"]),
+            (_minmax(self.column("ev_sales", idx), invert=True), weights["w_evs"]),
+            (_minmax(self.column("rev_yoy", idx)), weights["w_yoy"]),
+            (_minmax(self.column("net_margin_ttm", idx)), weights["w_nm"]),
+            # RSI: cercanía a ~55 (uptrend ligero), en [0..1]
+            (np.maximum(0.0, 1.0 - np.abs(self.column("rsi14", idx) - 55.0) / 55.0), weights["w_rsi"]),
+        )
+        total = np.zeros(len(idx))
+        seen = np.zeros(len(idx), dtype=bool)
+        for v, w in comps:
+            ok = ~np.isnan(v)
+            total = np.where(ok, total + w * v, total)
+            seen |= ok
+        return np.where(seen, np.round(total, 6), np.nan)
+
+    def rows(self, idx: np.ndarray, cols: Iterable[str], extra: Optional[Dict[str, np.ndarray]] = None) -> List[dict]:
+        """Filas dict (NaN -> None) para las plantillas y el CSV."""
+        cols = list(cols)
+        extra = extra or {}
+        out = []
+        for i in idx.tolist():
+            r = {"ticker": self.tickers[i], "name": self.names[i],
+                 "sector": self.sectors[i], "currency": self.currencies[i]}
+            for col in cols:
+                r[col] = _none(self.values[col][i])
+            out.append(r)
+        for name, arr in extra.items():
+            for r, v in zip(out, arr.tolist()):
+                r[name] = _none(v)
+        return out
+
+
+def _none(v):
+    return None if v != v else float(v)
+
+
+def _minmax(v: np.ndarray, invert: bool = False) -> np.ndarray:
+    ok = ~np.isnan(v)
+    if not ok.any():
+        return np.full(len(v), np.nan)
+    lo, hi = v[ok].min(), v[ok].max()
+    s = (v - lo) / ((hi - lo) or 1.0)
+    return 1 - s if invert else s
+
+
+def top_k(values: np.ndarray, k: int, descending: bool = False) -> np.ndarray:
+    """
+    Posiciones de las k primeras filas según `values` (NaN = vacío), sin
+    ordenar todo el arreglo: argpartition elige candidatos y sólo esos se
+    ordenan (los empates en el borde se incluyen para que el corte sea estable).
+    """
+    n = len(values)
+    k = max(0, min(k, n))
+    if not k:
+        return np.empty(0, dtype=np.int64)
+    # clave ascendente equivalente a sorted(key=(v is None, v), reverse=descending)
+    key = np.where(np.isnan(values), np.inf, values)
+    if descending:
+        key = -key
+    if k < n:
+        kth = np.partition(key, k - 1)[k - 1]
+        cand = np.flatnonzero(key <= kth)
+    else:
+        cand = np.arange(n)
+    return cand[np.lexsort((cand, key[cand]))][:k]
+
+
+# -- carga / cache por proceso -----------------------------------------------------
+def load_frame(stamp=None) -> ScreenerFrame:
+    companies = list(Company.objects.order_by("id").values("id", "ticker", "name", "sector", "currency"))
+    maps = latest_metric_maps(list(COLUMNS.values()))
+    sectors = list(Company.objects.order_by("sector").values_list("sector", flat=True).distinct())
+    return ScreenerFrame(companies, maps, sectors, stamp)
+
+
+def get_frame() -> ScreenerFrame:
+    """Matriz vigente del proceso; se recarga si cambió la versión de datos."""
+    stamp = data_version()
+    if _state["frame"] is not None and _state["stamp"] == stamp:
+        return _state["frame"]
+    with _lock:
+        if _state["frame"] is None or _state["stamp"] != stamp:
+            _state["frame"] = load_frame(stamp)
+            _state["stamp"] = stamp
+        return _state["frame"]
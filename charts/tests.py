@@ -1,3 +1,29 @@
-from django.test import TestCase
+import numpy as np
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from charts.screener import top_k
+
+
+def _sorted_top(values, k, descending):
+    """Orden previo a la matriz: sorted con key (v is None, v) sobre las filas."""
+    v = [None if np.isnan(x) else float(x) for x in values]
+    return sorted(range(len(v)), key=lambda i: (v[i] is None, v[i]), reverse=descending)[:k]
+
+
+class TopKTests(SimpleTestCase):
+    def test_matches_previous_sort_with_ties_and_nan(self):
+        rng = np.random.default_rng(5)
+        for n in (1, 7, 50, 300):
+            values = rng.integers(0, 6, n).astype(np.float64)  # muchos empates
+            values[rng.random(n) < 0.3] = np.nan
+            for k in (0, 1, 3, n // 2, n, n + 5):
+                for descending in (False, True):
+                    with self.subTest(n=n, k=k, descending=descending):
+                        self.assertEqual(top_k(values, k, descending).tolist(),
+                                         _sorted_top(values, max(k, 0), descending))
+
+    def test_all_nan_and_empty(self):
+        values = np.full(4, np.nan)
+        self.assertEqual(top_k(values, 2).tolist(), [0, 1])
+        self.assertEqual(top_k(values, 2, descending=True).tolist(), [0, 1])
+        self.assertEqual(len(top_k(np.array([]), 3)), 0)
@@ -3,16 +3,16 @@ from __future__ import annotations
 
 import csv
 import json
-from typing import Dict, List
+from typing import List
 
 from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.views.decorators.cache import cache_page
 
+from charts.screener import SCREENER_ORDER, get_frame, top_k
 from companies.models import Company
-from fundamentals.models import Statement, Metric
-
-from math import isfinite
+from core.cache import company_id_for_ticker, versioned_cache_page
+from fundamentals.facts import canonical, fact_table
+from fundamentals.models import Metric
 
 # -----------------------------
 # Utilidades
@@ -24,26 +24,6 @@ def _safe_float(x):
         return None
 
 
-def _latest_metric_map(key: str) -> Dict[int, float]:
-    """
-    Devuelve {company_id: ultimo_valor} para la métrica 'key'
-    tomando el registro más reciente por compañía.
-    """
-    qs = (
-        Metric.objects.filter(key=key)
-        .order_by("company_id", "-period_end", "-id")
-        .values("company_id", "value")
-    )
-    out, seen = {}, set()
-    for row in qs:
-        cid = row["company_id"]
-        if cid in seen:
-            continue
-        out[cid] = _safe_float(row["value"])
-        seen.add(cid)
-    return out
-
-
 def _csv_response(filename: str, rows: List[dict], headers: List[str], keys: List[str]) -> HttpResponse:
     resp = HttpResponse(content_type="text/csv; charset=utf-8")
     resp["Content-Disposition"] = f'attachment; filename="{filename}"'
@@ -57,80 +37,28 @@ def _csv_response(filename: str, rows: List[dict], headers: List[str], keys: Lis
 # -----------------------------
 # Screener
 # -----------------------------
-@cache_page(60)  # 1 minuto de caché (ajusta o elimina durante desarrollo)
+SCREENER_DEFAULTS = {"order": "pe_asc", "limit": 100}
+PE_PLUS_DEFAULTS = {"order": "score_desc", "limit": 200,
+                    "w_pe": 0.35, "w_evs": 0.20, "w_yoy": 0.20, "w_nm": 0.15, "w_rsi": 0.10}
+
+
+# se invalida al cambiar la versión de datos (core/cache.py); los defaults no cambian la clave
+@versioned_cache_page(defaults=SCREENER_DEFAULTS)
 def screener_view(request):
     sector_q = (request.GET.get("sector") or "").strip()
     min_mcap_q = _safe_float((request.GET.get("min_mcap") or "").strip())
-    order_q = (request.GET.get("order") or "pe_asc").strip()
-    limit_q = int(request.GET.get("limit") or 100)
+    order_q = (request.GET.get("order") or SCREENER_DEFAULTS["order"]).strip()
+    limit_q = int(request.GET.get("limit") or SCREENER_DEFAULTS["limit"])
     fmt_q = (request.GET.get("format") or "").lower()
 
-    # Trae mapas de métricas "último valor por compañía"
-    maps = {
-        "PE_TTM": _latest_metric_map("PE_TTM"),
-        "EV_EBITDA": _latest_metric_map("EV_EBITDA"),
-        "EV_Sales": _latest_metric_map("EV_Sales"),
-        "FCF_Yield": _latest_metric_map("FCF_Yield"),
-        "NetMargin_TTM": _latest_metric_map("NetMargin_TTM"),
-        "MarketCap": _latest_metric_map("MarketCap"),
-        "RSI_14": _latest_metric_map("RSI_14"),
-        "Revenue_YoY": _latest_metric_map("Revenue_YoY"),
-    }
-
-    # Compañías base (opcionalmente filtradas por sector)
-    companies = Company.objects.only("id", "ticker", "name", "sector", "currency")
-    if sector_q:
-        companies = companies.filter(sector__iexact=sector_q)
-
-    rows = []
-    for c in companies:
-        mcap = maps["MarketCap"].get(c.id)
-
-        # Filtro de market cap mínimo
-        if min_mcap_q is not None and (mcap is None or mcap < min_mcap_q):
-            continue
-
-        rows.append(
-            {
-                "ticker": c.ticker,
-                "name": c.name,
-                "sector": c.sector,
-                "currency": c.currency,
-                "marketcap": mcap,
-                "pe_ttm": maps["PE_TTM"].get(c.id),
-                "ev_sales": maps["EV_Sales"].get(c.id),
-                "ev_ebitda": maps["EV_EBITDA"].get(c.id),
-                "fcf_yield": maps["FCF_Yield"].get(c.id),
-                "rev_yoy": maps["Revenue_YoY"].get(c.id),
-                "rsi14": maps["RSI_14"].get(c.id),
-            }
-        )
-
-    # Ordenamiento
-    # order= pe_asc | pe_desc | evs_asc | evs_desc | yoy_desc | yoy_asc | rsi_asc | rsi_desc | mcap_desc | mcap_asc
-    order_map = {
-        "pe_asc": ("pe_ttm", False),
-        "pe_desc": ("pe_ttm", True),
-        "evs_asc": ("ev_sales", False),
-        "evs_desc": ("ev_sales", True),
-        "yoy_desc": ("rev_yoy", True),
-        "yoy_asc": ("rev_yoy", False),
-        "rsi_asc": ("rsi14", False),
-        "rsi_desc": ("rsi14", True),
-        "mcap_desc": ("marketcap", True),
-        "mcap_asc": ("marketcap", False),
-    }
-    sort_key, reverse = order_map.get(order_q, ("pe_ttm", False))
-
-    def _key(r):
-        v = r.get(sort_key)
-        # Forzamos que None quede al final
-        return (v is None, v)
-
-    rows.sort(key=_key, reverse=reverse)
+    # Ordenamiento (charts/screener.py: SCREENER_ORDER)
+    sort_key, reverse = SCREENER_ORDER.get(order_q, ("pe_ttm", False))
 
-    # Límite
-    rows = rows[: max(1, min(limit_q, 1000))]
+    # Filtro + top-K sobre la matriz en memoria (charts/screener.py)
+    frame = get_frame()
+    idx = frame.select(sector_q, min_mcap_q)
+    idx = idx[top_k(frame.column(sort_key, idx), max(1, min(limit_q, 1000)), descending=reverse)]
+    rows = frame.rows(idx, ["marketcap", "pe_ttm", "ev_sales", "ev_ebitda", "fcf_yield", "rev_yoy", "rsi14"])
 
     # CSV si se pide ?format=csv
     if fmt_q == "csv":
@@ -155,9 +83,7 @@ def screener_view(request):
         "min_mcap": "" if min_mcap_q is None else min_mcap_q,
         "order": order_q,
         "limit": limit_q,
-        "sectors": Company.objects.order_by("sector")
-        .values_list("sector", flat=True)
-        .distinct(),
+        "sectors": frame.sector_choices,
     }
     return render(request, "screener.html", context)
 
@@ -165,39 +91,16 @@ def screener_view(request):
 # -----------------------------
 # Ranking P/E
 # -----------------------------
-@cache_page(60 * 5)  # 5 minutos
+@versioned_cache_page()
 def pe_view(request):
     """Ranking por P/E (más bajo primero)."""
     sector_q = (request.GET.get("sector") or "").strip()
     min_mcap_q = _safe_float((request.GET.get("min_mcap") or "").strip())
 
-    pe_map = _latest_metric_map("PE_TTM")
-    mcap_map = _latest_metric_map("MarketCap")
-
-    companies = Company.objects.only("id", "ticker", "name", "sector")
-    if sector_q:
-        companies = companies.filter(sector__iexact=sector_q)
-
-    rows = []
-    for c in companies:
-        pe = pe_map.get(c.id)
-        mcap = mcap_map.get(c.id)
-
-        if min_mcap_q is not None and (mcap is None or mcap < min_mcap_q):
-            continue
-
-        rows.append(
-            {
-                "ticker": c.ticker,
-                "name": c.name,
-                "sector": c.sector,
-                "marketcap": mcap,
-                "pe_ttm": pe,
-            }
-        )
-
-    rows.sort(key=lambda r: (r["pe_ttm"] is None, r["pe_ttm"] if r["pe_ttm"] is not None else float("inf")))
-    rows = rows[:200]
+    frame = get_frame()
+    idx = frame.select(sector_q, min_mcap_q)
+    idx = idx[top_k(frame.column("pe_ttm", idx), 200)]
+    rows = frame.rows(idx, ["marketcap", "pe_ttm"])
 
     return render(
         request,
@@ -206,30 +109,12 @@ def pe_view(request):
             "rows": rows,
             "selected_sector": sector_q,
             "min_mcap": "" if min_mcap_q is None else min_mcap_q,
-            "sectors": Company.objects.order_by("sector")
-            .values_list("sector", flat=True)
-            .distinct(),
+            "sectors": frame.sector_choices,
         },
     )
-    
-# charts/views.py  (añadir debajo de pe_view)
-
-def _minmax(series, invert=False):
-    vals = [v for v in series if v is not None and isfinite(v)]
-    if not vals:
-        return {}
-    lo, hi = min(vals), max(vals)
-    span = (hi - lo) or 1.0
-    out = {}
-    for idx, v in enumerate(series):
-        if v is None or not isfinite(v):
-            out[idx] = None
-        else:
-            s = (v - lo) / span
-            out[idx] = 1 - s if invert else s
-    return out
 
-@cache_page(60 * 5)
+
+@versioned_cache_page(defaults=PE_PLUS_DEFAULTS)
 def pe_plus_view(request):
     """
     Ranking multi-factor con columnas extra y score ponderado.
@@ -243,76 +128,16 @@ def pe_plus_view(request):
     q = request.GET
     sector_q  = (q.get("sector") or "").strip()
     min_mcap  = _safe_float(q.get("min_mcap"))
-    limit_q   = int(q.get("limit") or 200)
+    limit_q   = int(q.get("limit") or PE_PLUS_DEFAULTS["limit"])
     fmt_q     = (q.get("format") or "").lower()
-    order_q   = (q.get("order") or "score_desc").lower()
+    order_q   = (q.get("order") or PE_PLUS_DEFAULTS["order"]).lower()
 
     # pesos
-    w_pe  = _safe_float(q.get("w_pe"))  or 0.35
-    w_evs = _safe_float(q.get("w_evs")) or 0.20
-    w_yoy = _safe_float(q.get("w_yoy")) or 0.20
-    w_nm  = _safe_float(q.get("w_nm"))  or 0.15
-    w_rsi = _safe_float(q.get("w_rsi")) or 0.10
-
-    # mapas “último valor por compañía”
-    maps = {
-        "PE_TTM":        _latest_metric_map("PE_TTM"),
-        "EV_Sales":      _latest_metric_map("EV_Sales"),
-        "EV_EBITDA":     _latest_metric_map("EV_EBITDA"),
-        "Revenue_YoY":   _latest_metric_map("Revenue_YoY"),
-        "NetMargin_TTM": _latest_metric_map("NetMargin_TTM"),
-        "RSI_14":        _latest_metric_map("RSI_14"),
-        "MarketCap":     _latest_metric_map("MarketCap"),
-    }
-
-    companies = Company.objects.only("id","ticker","name","sector")
-    if sector_q:
-        companies = companies.filter(sector__iexact=sector_q)
-
-    rows = []
-    for c in companies:
-        pe   = maps["PE_TTM"].get(c.id)
-        evs  = maps["EV_Sales"].get(c.id)
-        eveb = maps["EV_EBITDA"].get(c.id)
-        yoy  = maps["Revenue_YoY"].get(c.id)
-        nm   = maps["NetMargin_TTM"].get(c.id)
-        rsi  = maps["RSI_14"].get(c.id)
-        mcap = maps["MarketCap"].get(c.id)
-
-        if min_mcap is not None and (mcap is None or mcap < min_mcap):
-            continue
-
-        rows.append({
-            "ticker": c.ticker, "name": c.name, "sector": c.sector,
-            "marketcap": mcap, "pe_ttm": pe, "ev_sales": evs, "ev_ebitda": eveb,
-            "rev_yoy": yoy, "net_margin_ttm": nm, "rsi14": rsi,
-        })
-
-    # normalizaciones (min-max) para score
-    series_pe   = [r["pe_ttm"] for r in rows]
-    series_evs  = [r["ev_sales"] for r in rows]
-    series_yoy  = [r["rev_yoy"] for r in rows]
-    series_nm   = [r["net_margin_ttm"] for r in rows]
-    series_rsi  = [r["rsi14"] for r in rows]
-
-    n_pe  = _minmax(series_pe,  invert=True)   # más bajo es mejor
-    n_evs = _minmax(series_evs, invert=True)   # más bajo es mejor
-    n_yoy = _minmax(series_yoy)                # más alto es mejor
-    n_nm  = _minmax(series_nm)                 # más alto es mejor
-    # RSI: puntuamos cercanía a ~55 (uptrend ligero). Convertimos a [0..1] por distancia.
-    target = 55.0
-    vals = []
-    for v in series_rsi:
-        if v is None or not isfinite(v): vals.append(None)
-        else: vals.append(max(0.0, 1.0 - abs(v - target)/55.0))
-    n_rsi = {i: vals[i] for i in range(len(vals))}
-
-    for i, r in enumerate(rows):
-        parts = []
-        for comp, w in ((n_pe, w_pe), (n_evs, w_evs), (n_yoy, w_yoy), (n_nm, w_nm), (n_rsi, w_rsi)):
-            v = comp.get(i)
-            if v is not None: parts.append(w * v)
-        r["score"] = round(sum(parts), 6) if parts else None
+    w_pe  = _safe_float(q.get("w_pe"))  or PE_PLUS_DEFAULTS["w_pe"]
+    w_evs = _safe_float(q.get("w_evs")) or PE_PLUS_DEFAULTS["w_evs"]
+    w_yoy = _safe_float(q.get("w_yoy")) or PE_PLUS_DEFAULTS["w_yoy"]
+    w_nm  = _safe_float(q.get("w_nm"))  or PE_PLUS_DEFAULTS["w_nm"]
+    w_rsi = _safe_float(q.get("w_rsi")) or PE_PLUS_DEFAULTS["w_rsi"]
 
     # orden
     order_map = {
@@ -325,13 +150,14 @@ def pe_plus_view(request):
         "mcap_desc": ("marketcap", True), "mcap_asc": ("marketcap", False),
     }
     key, rev = order_map.get(order_q, ("score", True))
-    def _k(r): 
-        v = r.get(key)
-        return (v is None, v)
-    rows.sort(key=_k, reverse=rev)
 
-    # rank + limit
-    rows = rows[: max(1, min(limit_q, 1000))]
+    # filtros, score (min-max sobre la selección) y top-K en la matriz en memoria
+    frame = get_frame()
+    idx = frame.select(sector_q, min_mcap)
+    score = frame.pe_plus_score(idx, {"w_pe": w_pe, "w_evs": w_evs, "w_yoy": w_yoy, "w_nm": w_nm, "w_rsi": w_rsi})
+    top = top_k(score if key == "score" else frame.column(key, idx), max(1, min(limit_q, 1000)), descending=rev)
+    rows = frame.rows(idx[top], ["marketcap", "pe_ttm", "ev_sales", "ev_ebitda", "rev_yoy", "net_margin_ttm", "rsi14"],
+                      extra={"score": score[top]})
     for i, r in enumerate(rows, 1):
         r["rank"] = i
 
@@ -351,24 +177,13 @@ def pe_plus_view(request):
     })
 
 def _series_from_statement(company, field, fallbacks=None):
-    fallbacks = fallbacks or []
-    qs = (Statement.objects
-          .filter(company=company, statement_type="IS", period_type="Q")
-          .only("period_end", "json_payload")
-          .order_by("period_end"))
+    # StatementFact: aliases already resolved at ingest; fallbacks keep their priority
+    fields = list(dict.fromkeys(canonical(f) for f in [field, *(fallbacks or [])]))
     out = []
-    for s in qs:
-        v = s.json_payload.get(field)
-        if v is None:
-            for alt in fallbacks:
-                v = s.json_payload.get(alt)
-                if v is not None:
-                    break
-        try:
-            if v is not None:
-                out.append((s.period_end, float(v)))
-        except (TypeError, ValueError):
-            pass
+    for pe, vals in fact_table(company.id, "IS", "Q", fields=fields).items():
+        v = next((vals[f] for f in fields if f in vals), None)
+        if v is not None:
+            out.append((pe, v))
     return out
 
 def _series_from_metric(company, key_candidates):
@@ -393,7 +208,7 @@ def _pairs_json_safe(series):
     """[(date, val)] -> [[YYYY-MM-DD, val], ...]"""
     return [[d.isoformat(), v] for d, v in series if d and v is not None]
 
-@cache_page(60 * 10)
+@versioned_cache_page(company=lambda request, ticker: company_id_for_ticker(ticker))
 def company_dashboard(request, ticker: str):
     c = get_object_or_404(Company, ticker=ticker.upper())
 
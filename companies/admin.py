@@ -1,3 +1,4 @@
 from django.contrib import admin
-from .models import Company
+from .models import Company, TickerCik
 admin.site.register(Company)
+admin.site.register(TickerCik)
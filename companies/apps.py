@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CompaniesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'companies'
+
+    def ready(self):
+        from companies import signals  # noqa: F401
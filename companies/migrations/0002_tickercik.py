@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerCik',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20, unique=True)),
+                ('cik', models.CharField(max_length=10)),
+                ('title', models.CharField(blank=True, default='', max_length=200)),
+                ('refreshed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -9,3 +9,13 @@ class Company(models.Model):
 
     def __str__(self):
         return f"{self.ticker} - {self.name}"
+
+class TickerCik(models.Model):
+    """Índice local ticker -> CIK (copia de company_tickers.json de la SEC)."""
+    ticker = models.CharField(max_length=20, unique=True)
+    cik = models.CharField(max_length=10)  # 10 dígitos, con ceros a la izquierda
+    title = models.CharField(max_length=200, blank=True, default="")
+    refreshed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.ticker} -> {self.cik}"
@@ -0,0 +1,88 @@
+# companies/services.py
+"""
+Índice persistente ticker -> CIK.
+
+company_tickers.json (SEC) se descarga sólo cuando el índice local está vencido
+(settings.SEC_CIK_INDEX_TTL_DAYS) y se reemplaza en bloque; las resoluciones se
+hacen contra un dict cargado en una sola consulta y los CIK se escriben de
+vuelta en Company con un único bulk_update.
+"""
+import datetime as dt
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils.timezone import now
+
+from companies.models import Company, TickerCik
+from core.cache import bump_data_version
+
+
+def to_sec_symbol(t: str) -> str:
+    return t.replace("-", ".").upper()
+
+
+def cik_index_is_stale() -> bool:
+    last = TickerCik.objects.aggregate(m=Max("refreshed_at"))["m"]
+    ttl = dt.timedelta(days=getattr(settings, "SEC_CIK_INDEX_TTL_DAYS", 7))
+    return last is None or now() - last > ttl
+
+
+def refresh_cik_index(force: bool = False, client=None) -> int:
+    """Descarga company_tickers.json y reemplaza el índice si está vencido (o force)."""
+    if not force and not cik_index_is_stale():
+        return 0
+    from core.archive import PayloadArchive
+    from core.fetch import VendorClient
+    from filings.sec import SEC_TICKERMAP_URL, _ua
+
+    client = client or VendorClient("sec", headers=_ua())
+    r = client.get(SEC_TICKERMAP_URL, timeout=30)
+    r.raise_for_status()
+    PayloadArchive().put("sec", "_all", "company_tickers", r.content)
+
+    # estructura: {"0":{"cik_str":320193,"ticker":"AAPL","title":"Apple Inc."}, ...}
+    stamp = now()
+    rows = {}
+    for obj in r.json().values():
+        t = str(obj.get("ticker") or "").upper()
+        if t and t not in rows:
+            rows[t] = TickerCik(ticker=t, cik=str(obj["cik_str"]).zfill(10),
+                                title=(obj.get("title") or "")[:200], refreshed_at=stamp)
+    with transaction.atomic():
+        TickerCik.objects.all().delete()
+        TickerCik.objects.bulk_create(rows.values(), batch_size=2000)
+    return len(rows)
+
+
+def cik_map() -> dict:
+    """{ticker: cik10} en una sola consulta."""
+    return dict(TickerCik.objects.values_list("ticker", "cik"))
+
+
+def lookup_cik(index: dict, ticker: str):
+    return index.get(to_sec_symbol(ticker)) or index.get(ticker.upper())
+
+
+def backfill_ciks(companies=None, refresh: bool = True, client=None) -> int:
+    """
+    Completa Company.cik para las compañías sin CIK (todas, o el queryset dado)
+    usando el índice local; refresca el índice antes si está vencido.
+    """
+    qs = companies if companies is not None else Company.objects.all()
+    missing = list(qs.filter(cik__isnull=True) | qs.filter(cik=""))
+    if not missing:
+        return 0
+    if refresh:
+        refresh_cik_index(client=client)
+    index = cik_map()
+    updated = []
+    for c in missing:
+        cik = lookup_cik(index, c.ticker)
+        if cik:
+            c.cik = cik
+            updated.append(c)
+    Company.objects.bulk_update(updated, ["cik"], batch_size=1000)
+    if updated:  # bulk_update no emite post_save (companies.signals)
+        bump_data_version(c.id for c in updated)
+    return len(updated)
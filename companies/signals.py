@@ -0,0 +1,19 @@
+# companies/signals.py
+"""
+Altas, ediciones y bajas de Company (admin, shell, loaders) suben la versión de
+datos: ticker, nombre y sector aparecen en el screener, rankings y páginas
+cacheadas (core.cache).
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from companies.models import Company
+from core.cache import bump_data_version
+
+
+@receiver(post_save, sender=Company, dispatch_uid="companies.bump_on_save")
+@receiver(post_delete, sender=Company, dispatch_uid="companies.bump_on_delete")
+def _bump_company_version(sender, instance, raw=False, **kwargs):
+    if raw:  # loaddata: las fixtures no pasan por la caché
+        return
+    bump_data_version([instance.pk])
@@ -1,3 +1,72 @@
-from django.test import TestCase
+import datetime as dt
+import json
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from charts import screener
+from charts.screener import get_frame
+from companies.models import Company, TickerCik
+from companies.services import backfill_ciks, cik_map, lookup_cik, refresh_cik_index
+from core.cache import data_version
+
+
+class CompanyDataVersionTests(TestCase):
+    def setUp(self):
+        # las versiones de datos se reinician con cada test: vaciar las cachés por proceso
+        cache.clear()
+        screener._state.update(stamp=None, frame=None)
+
+    def test_create_edit_delete_refresh_frame(self):
+        a = Company.objects.create(ticker="AAA", name="A")
+        self.assertEqual(get_frame().tickers, ["AAA"])
+        v = data_version(a.id)
+
+        a.ticker, a.sector = "AAB", "Tech"
+        a.save()
+        self.assertGreater(data_version(a.id), v)
+        frame = get_frame()
+        self.assertEqual((frame.tickers, frame.sectors), (["AAB"], ["Tech"]))
+
+        Company.objects.create(ticker="BBB", name="B")
+        self.assertEqual(get_frame().tickers, ["AAB", "BBB"])
+        a.delete()
+        self.assertEqual(get_frame().tickers, ["BBB"])
+
+    def test_cik_backfill_bumps_version(self):
+        a = Company.objects.create(ticker="AAA", name="A")
+        TickerCik.objects.create(ticker="AAA", cik="0000000001", refreshed_at="2024-01-01T00:00Z")
+        v = data_version(a.id)
+        self.assertEqual(backfill_ciks(refresh=False), 1)
+        self.assertGreater(data_version(a.id), v)
+
+
+@override_settings(RAW_ARCHIVE_DIR=tempfile.mkdtemp(), SEC_CIK_INDEX_TTL_DAYS=7)
+class CikIndexTests(TestCase):
+    def setUp(self):
+        payload = {"0": {"cik_str": 320193, "ticker": "AAPL", "title": "Apple Inc."},
+                   "1": {"cik_str": "1067983", "ticker": "BRK.B", "title": "Berkshire"},
+                   "2": {"cik_str": 999, "ticker": "AAPL", "title": "duplicado: gana el primero"}}
+        self.sec = mock.Mock()
+        self.sec.get.return_value.content = json.dumps(payload).encode("utf-8")
+        self.sec.get.return_value.json.return_value = payload
+
+    def test_ciks_are_padded(self):
+        self.assertEqual(refresh_cik_index(client=self.sec), 2)
+        index = cik_map()
+        self.assertEqual(index, {"AAPL": "0000320193", "BRK.B": "0001067983"})
+        self.assertEqual(lookup_cik(index, "brk-b"), "0001067983")
+
+    def test_ttl_guard_skips_network_while_fresh(self):
+        refresh_cik_index(client=self.sec)
+        self.assertEqual(refresh_cik_index(client=self.sec), 0)
+        self.assertEqual(self.sec.get.call_count, 1)
+
+        TickerCik.objects.update(refreshed_at=now() - dt.timedelta(days=8))  # vencido
+        self.assertEqual(refresh_cik_index(client=self.sec), 2)
+        self.assertEqual(refresh_cik_index(force=True, client=self.sec), 2)
+        self.assertEqual(self.sec.get.call_count, 3)
 
-# Create your tests here.
@@ -1,3 +1,4 @@
 from django.contrib import admin
-
-# Register your models here.
+from .models import DataVersion, Watermark
+admin.site.register(Watermark)
+admin.site.register(DataVersion)
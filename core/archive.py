@@ -0,0 +1,111 @@
+# core/archive.py
+"""
+Archivo local de respuestas crudas de proveedores (EODHD, FMP, SEC).
+
+Cada respuesta se guarda comprimida (gzip) y direccionada por contenido:
+
+    <RAW_ARCHIVE_DIR>/objects/ab/abcd...ef.gz         (sha256 del cuerpo crudo)
+    <RAW_ARCHIVE_DIR>/refs/<vendor>/<symbol>/<endpoint>/<YYYY-MM-DD>.<ns>-<sha12>   -> sha256
+
+Descargas idénticas comparten el mismo objeto. Hay una ref por descarga (no
+por día): un `--full` y un incremental del mismo día conservan ambos cuerpos.
+Las refs permiten volver a ingerir (`--replay`) sin red ni cuota: la más
+reciente en o antes de una fecha, o todas en orden (para fuentes incrementales
+como los precios diarios). Las refs antiguas `<YYYY-MM-DD>` (sin sufijo) se
+siguen leyendo como la primera descarga de su día.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import gzip
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.fsutil import atomic_write
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _safe(part: str) -> str:
+    return _UNSAFE.sub("_", str(part).strip()) or "_"
+
+
+class PayloadArchive:
+    def __init__(self, root=None):
+        self.root = Path(root or getattr(settings, "RAW_ARCHIVE_DIR", settings.BASE_DIR / "var" / "raw"))
+
+    def _object_path(self, sha: str) -> Path:
+        return self.root / "objects" / sha[:2] / f"{sha}.gz"
+
+    def _ref_dir(self, vendor: str, symbol: str, endpoint: str) -> Path:
+        return self.root / "refs" / _safe(vendor) / _safe(symbol) / _safe(endpoint)
+
+    def _refs(self, vendor: str, symbol: str, endpoint: str) -> List[Tuple[dt.date, str, Path]]:
+        """Refs en orden cronológico: (fecha, sufijo, ruta); la ref sin sufijo va primero en su día."""
+        d = self._ref_dir(vendor, symbol, endpoint)
+        if not d.is_dir():
+            return []
+        out = []
+        for p in d.iterdir():
+            day, _, suffix = p.name.partition(".")
+            try:
+                out.append((dt.date.fromisoformat(day), suffix, p))
+            except ValueError:
+                continue
+        return sorted(out, key=lambda r: r[:2])
+
+    def _load(self, ref: Path) -> bytes:
+        sha = ref.read_text("ascii").strip()
+        return gzip.decompress(self._object_path(sha).read_bytes())
+
+    # -- escritura -------------------------------------------------------------
+    def put(self, vendor: str, symbol: str, endpoint: str, content: bytes,
+            on: Optional[dt.date] = None) -> str:
+        """Guarda `content` y agrega una ref (vendor, symbol, endpoint, fecha, descarga) a él."""
+        sha = hashlib.sha256(content).hexdigest()
+        obj = self._object_path(sha)
+        if not obj.exists():
+            atomic_write(obj, gzip.compress(content))
+        day = (on or dt.date.today())
+        same_day = [r for r in self._refs(vendor, symbol, endpoint) if r[0] == day]
+        if same_day and same_day[-1][2].read_text("ascii").strip() == sha:
+            return sha  # misma respuesta que la última del día: nada nuevo que reproducir
+        # time_ns con ancho fijo: el orden lexicográfico es el de las descargas
+        name = f"{day.isoformat()}.{time.time_ns():020d}-{sha[:12]}"
+        atomic_write(self._ref_dir(vendor, symbol, endpoint) / name, sha.encode("ascii"))
+        return sha
+
+    # -- lectura ---------------------------------------------------------------
+    def dates(self, vendor: str, symbol: str, endpoint: str) -> List[dt.date]:
+        return sorted({d for d, _, _ in self._refs(vendor, symbol, endpoint)})
+
+    def read(self, vendor: str, symbol: str, endpoint: str, on: dt.date) -> bytes:
+        """Cuerpo de la última descarga del día `on`."""
+        refs = [p for d, _, p in self._refs(vendor, symbol, endpoint) if d == on]
+        if not refs:
+            raise FileNotFoundError(f"sin ref {vendor}/{symbol}/{endpoint} {on.isoformat()}")
+        return self._load(refs[-1])
+
+    def latest(self, vendor: str, symbol: str, endpoint: str,
+               until: Optional[dt.date] = None) -> Optional[bytes]:
+        """Cuerpo de la respuesta más reciente con fecha <= until (o None)."""
+        refs = [p for d, _, p in self._refs(vendor, symbol, endpoint) if until is None or d <= until]
+        return self._load(refs[-1]) if refs else None
+
+    def latest_json(self, vendor: str, symbol: str, endpoint: str, until: Optional[dt.date] = None):
+        raw = self.latest(vendor, symbol, endpoint, until)
+        return None if raw is None else json.loads(raw)
+
+    def iter_json(self, vendor: str, symbol: str, endpoint: str,
+                  until: Optional[dt.date] = None) -> Iterator:
+        """Todas las respuestas archivadas (cada descarga, también varias por día) en orden cronológico (<= until)."""
+        for d, _, p in self._refs(vendor, symbol, endpoint):
+            if until is not None and d > until:
+                break
+            yield json.loads(self._load(p))
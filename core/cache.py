@@ -0,0 +1,218 @@
+# core/cache.py
+"""
+Cachés de vistas invalidadas por versión de datos, no por TTL fijo.
+
+- DataVersion guarda un contador "global" y uno por compañía
+  ("company:<id>"). bump_data_version(ids) sube el global y los de esas
+  compañías; lo llaman las ingestas (core.watermarks.mark_dirty) y los
+  recálculos (MetricWriter, al escribir cambios).
+- versioned_cache_page guarda la respuesta con la versión en la clave y un
+  TTL largo (VERSIONED_CACHE_TTL): entre corridas nocturnas todo es hit y
+  tras un bump la siguiente request ya usa una clave nueva. Las claves viejas
+  expiran solas. La query string entra en la clave canónica (_canonical_path:
+  params ordenados, sin vacíos ni defaults de la vista), así el GET de un
+  formulario y la URL que precalienta core/warm.py comparten entrada.
+- La versión se lee de la caché (dv:<scope>) y se relee de la base cada
+  DATA_VERSION_TTL seg. Con Redis el bump borra esas claves y el cambio es
+  inmediato; con LocMemCache los demás procesos lo ven en <= DATA_VERSION_TTL.
+
+Single-flight (single_flight): ante un miss sólo un worker recalcula una
+clave (core.locks.try_cache_lock, liberado con compare-and-delete); los demás sirven el último valor de esa
+página (aunque sea de la versión anterior) o esperan hasta WAIT_SECONDS a que
+aparezca. versioned_cache_page lo usa siempre, así un bump bajo carga no
+dispara N recálculos idénticos contra la base.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from functools import wraps
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from companies.models import Company
+from core.locks import release_cache_lock, try_cache_lock
+from core.models import DataVersion
+
+GLOBAL = "global"
+BUMP_BATCH = 500
+
+LOCK_TTL = 30          # seg máx. que un worker retiene el recálculo de una clave
+WAIT_SECONDS = 5.0     # espera de los demás si no hay valor previo que servir
+POLL_SECONDS = 0.05
+
+
+def _scope(company_id: Optional[int] = None) -> str:
+    return GLOBAL if company_id is None else f"company:{company_id}"
+
+
+def _page_ttl() -> int:
+    return getattr(settings, "VERSIONED_CACHE_TTL", 7 * 24 * 3600)
+
+
+def data_version(company_id: Optional[int] = None) -> int:
+    """Versión vigente del scope global (o de una compañía)."""
+    scope = _scope(company_id)
+    key = f"dv:{scope}"
+    v = cache.get(key)
+    if v is None:
+        v = DataVersion.objects.filter(scope=scope).values_list("version", flat=True).first() or 0
+        cache.set(key, v, timeout=getattr(settings, "DATA_VERSION_TTL", 5))
+    return v
+
+
+def bump_data_version(company_ids: Iterable[int] = ()):
+    """Sube la versión global y la de cada compañía indicada."""
+    scopes = [GLOBAL] + [_scope(cid) for cid in sorted(set(company_ids))]
+    now = timezone.now()
+    with transaction.atomic():
+        DataVersion.objects.bulk_create([DataVersion(scope=s) for s in scopes],
+                                        batch_size=BUMP_BATCH, ignore_conflicts=True)
+        for i in range(0, len(scopes), BUMP_BATCH):
+            DataVersion.objects.filter(scope__in=scopes[i:i + BUMP_BATCH]).update(
+                version=F("version") + 1, updated_at=now)
+    cache.delete_many([f"dv:{s}" for s in scopes])
+
+
+def company_id_for_ticker(ticker: str) -> Optional[int]:
+    """id de la compañía (cacheado); None si no existe."""
+    ticker = (ticker or "").upper()
+    key = f"dv:ticker:{ticker}"
+    cid = cache.get(key)
+    if cid is None:
+        cid = Company.objects.filter(ticker=ticker).values_list("id", flat=True).first()
+        if cid is None:
+            return None
+        cache.set(key, cid, timeout=_page_ttl())
+    return cid
+
+
+def single_flight(key: str, compute: Callable[[], object], timeout: int, stale_key: Optional[str] = None,
+                  cacheable: Callable[[object], bool] = lambda v: True):
+    """
+    cache[key] o compute(), con un solo recálculo concurrente por clave. El
+    ganador del lock calcula y guarda (también en stale_key, si se da); los
+    demás devuelven cache[stale_key] si existe o esperan al ganador hasta
+    WAIT_SECONDS y, pasado ese plazo, calculan por su cuenta.
+    """
+    lock_key = f"sf:{key}"
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        value = cache.get(key)
+        if value is not None:
+            return value
+        token = try_cache_lock(cache, lock_key, timeout=LOCK_TTL)
+        if token is not None:
+            try:
+                value = compute()
+                if cacheable(value):
+                    cache.set(key, value, timeout=timeout)
+                    if stale_key:
+                        cache.set(stale_key, value, timeout=timeout)
+                return value
+            finally:
+                # si el lock expiró y otro worker lo tomó, no es nuestro: no se borra
+                release_cache_lock(cache, lock_key, token)
+        if stale_key:
+            value = cache.get(stale_key)
+            if value is not None:
+                return value
+        if time.monotonic() >= deadline:
+            return compute()
+        time.sleep(POLL_SECONDS)
+
+
+def _media_variant(request) -> str:
+    """
+    Media type que elegiría la negociación de DRF (renderers por defecto) para
+    esta request: Accept/?format= deciden entre JSON y el HTML del browsable API.
+    Normalizado, así */*, application/json y sin Accept comparten clave.
+    """
+    renderers = [r() for r in api_settings.DEFAULT_RENDERER_CLASSES]
+    try:
+        renderer, _ = DefaultContentNegotiation().select_renderer(Request(request), renderers)
+    except NotAcceptable:
+        return "-"
+    return renderer.media_type
+
+
+def _is_default(value: str, default) -> bool:
+    if default is None:
+        return False
+    if value == str(default):
+        return True
+    try:
+        return float(value) == float(default)
+    except (TypeError, ValueError):
+        return False
+
+
+def _canonical_path(request, defaults: Optional[dict] = None) -> str:
+    """
+    path + query ordenada por nombre, sin params vacíos ni con el valor por
+    defecto de la vista: "?sector=&order=pe_asc" y "" son la misma página.
+    """
+    defaults = defaults or {}
+    params = [(k, v.strip()) for k in sorted(request.GET) for v in request.GET.getlist(k)]
+    params = [(k, v) for k, v in params if v and not _is_default(v, defaults.get(k))]
+    return f"{request.path}?{urlencode(params)}" if params else request.path
+
+
+def _cacheable_response(resp) -> bool:
+    # Vary por algo distinto de Accept (ya en la clave vía _media_variant): no se cachea
+    vary = {h.strip().lower() for h in resp.get("Vary", "").split(",") if h.strip()}
+    return resp.status_code == 200 and not resp.streaming and not resp.cookies and vary <= {"accept"}
+
+
+def versioned_cache_page(company: Optional[Callable[..., Optional[int]]] = None, prefix: str = "",
+                         negotiate: bool = False, defaults: Optional[dict] = None):
+    """
+    Como cache_page, pero la clave incluye la versión de datos. Sin `company`
+    depende de la versión global; con `company(request, *args, **kwargs)` ->
+    company_id, de la versión de esa compañía (p.ej. el dashboard por ticker).
+    Con negotiate=True (vistas de DRF) la clave incluye el media type negociado
+    (JSON vs HTML del browsable API, el Vary: Accept que respetaba cache_page).
+    No se cachean respuestas que varíen por otras cabeceras. `defaults`
+    ({param: valor}) son los valores que la vista asume si el param falta;
+    se quitan de la clave (ver _canonical_path). Sólo cachea
+    GET/HEAD con 200 y sin cookies. El recálculo pasa por single_flight;
+    mientras tanto se sirve la última versión de la página.
+    Para APIView de DRF, decorar `dispatch` (method_decorator, negotiate=True)
+    para cachear la respuesta ya renderizada.
+    """
+    def decorator(view):
+        name = prefix or f"{view.__module__}.{view.__name__}"
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            cid = company(request, *args, **kwargs) if company else None
+            variant = _canonical_path(request, defaults)
+            if negotiate:
+                variant += f"\n{_media_variant(request)}"
+            path = hashlib.md5(variant.encode("utf-8")).hexdigest()
+            base = f"page:{name}:{_scope(cid)}"
+
+            def compute():
+                resp = view(request, *args, **kwargs)
+                if callable(getattr(resp, "render", None)) and not getattr(resp, "is_rendered", True):
+                    resp = resp.render()
+                return resp
+
+            return single_flight(f"{base}:{data_version(cid)}:{path}", compute, _page_ttl(),
+                                 stale_key=f"{base}:last:{path}", cacheable=_cacheable_response)
+
+        return wrapper
+
+    return decorator
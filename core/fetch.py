@@ -0,0 +1,90 @@
+# core/fetch.py
+"""
+Capa de descarga compartida por los comandos de ingesta (EODHD, FMP, SEC).
+
+- VendorClient: una requests.Session con pool de conexiones y reintentos
+  (5xx / errores de conexión), limitada a N requests concurrentes por proveedor
+  y regulada por el token bucket compartido de core.ratelimit (429 + Retry-After).
+- fetch_concurrently: reparte las descargas en un pool de hilos acotado y
+  entrega los resultados en el hilo que llama, de modo que las escrituras a la
+  base de datos sigan ocurriendo en un único escritor (SQLite y Postgres).
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.ratelimit import RateLimiter, parse_retry_after
+
+# Requests simultáneos permitidos por proveedor (todas las hebras del proceso).
+VENDOR_CONCURRENCY = {
+    "eodhd": 8,
+    "fmp": 4,
+    "sec": 4,
+}
+
+
+class VendorClient:
+    """Cliente HTTP por proveedor, seguro para usar desde varios hilos."""
+
+    def __init__(self, vendor: str, concurrency: int | None = None, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 60, headers: dict | None = None,
+                 rate: float | None = None, throttle_retries: int = 5):
+        self.vendor = vendor
+        self.timeout = timeout
+        self.limiter = RateLimiter(vendor, rate=rate)
+        self.throttle_retries = throttle_retries
+        self.concurrency = max(1, int(concurrency or VENDOR_CONCURRENCY.get(vendor, 4)))
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def get(self, url: str, params: dict | None = None, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        with self._slots:
+            for _ in range(self.throttle_retries + 1):
+                self.limiter.acquire()
+                r = self.session.get(url, params=params, **kwargs)
+                if r.status_code != 429:
+                    self.limiter.on_success()
+                    return r
+                self.limiter.on_throttle(parse_retry_after(r.headers.get("Retry-After")))
+            return r
+
+    def close(self):
+        self.session.close()
+
+
+def fetch_concurrently(items: Iterable, fn: Callable, workers: int = 8) -> Iterator[Tuple[object, object, Exception | None]]:
+    """
+    Ejecuta fn(item) en un pool de `workers` hilos y rinde (item, resultado, error)
+    en el hilo llamador a medida que terminan. `fn` no debe tocar la base de datos.
+    """
+    items = list(items)
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        futures = {pool.submit(fn, it): it for it in items}
+        for fut in as_completed(futures):
+            item = futures[fut]
+            try:
+                yield item, fut.result(), None
+            except Exception as e:
+                yield item, None, e
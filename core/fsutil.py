@@ -0,0 +1,27 @@
+# core/fsutil.py
+"""
+Utilidades de archivos compartidas (archivo crudo, rate limiter, panel de precios).
+
+- atomic_write(path, data): escribe a un temporal en el mismo directorio y lo
+  renombra (os.replace). Un lector ve el contenido anterior o el nuevo, nunca
+  uno a medias, aunque el proceso muera a mitad de la escritura.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write(path: Path, data: bytes):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
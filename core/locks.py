@@ -0,0 +1,78 @@
+# core/locks.py
+"""
+Locks entre procesos.
+
+- file_lock(path): flock exclusivo sobre un archivo; vale entre procesos del
+  mismo host sin depender de la caché (p.ej. con LocMemCache, que es por
+  proceso). En plataformas sin fcntl sólo serializa hilos del proceso.
+- cache_lock(cache, key): lock corto en la caché de Django (cache.add). Se
+  libera con compare-and-delete: atómico (script Lua) si la caché es Redis;
+  en otros backends, get + delete. try_cache_lock es la variante sin espera
+  (devuelve el token o None), para quien tiene algo mejor que hacer que esperar.
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_thread_locks: dict = {}
+_thread_locks_guard = threading.Lock()
+
+_RELEASE_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+@contextmanager
+def file_lock(path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(str(path), threading.Lock())
+        with lock:
+            yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # cerrar el descriptor libera el flock
+
+
+def release_cache_lock(cache, key: str, token: int) -> bool:
+    """Borra `key` sólo si todavía guarda `token` (no el lock de otro tras expirar el nuestro)."""
+    client = getattr(getattr(cache, "_cache", None), "get_client", None)
+    if client is not None and hasattr(cache, "make_and_validate_key"):
+        # RedisCache guarda los int sin serializar: se comparan tal cual en el script
+        full_key = cache.make_and_validate_key(key)
+        return bool(client(full_key, write=True).eval(_RELEASE_LUA, 1, full_key, token))
+    if cache.get(key) == token:
+        cache.delete(key)
+        return True
+    return False
+
+
+def try_cache_lock(cache, key: str, timeout: int = 5) -> Optional[int]:
+    """Toma el lock si está libre: token para release_cache_lock, o None."""
+    token = random.getrandbits(62)  # int: comparable del lado de Redis
+    return token if cache.add(key, token, timeout=timeout) else None
+
+
+@contextmanager
+def cache_lock(cache, key: str, timeout: int = 5, poll: float = 0.005):
+    while (token := try_cache_lock(cache, key, timeout)) is None:
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        release_cache_lock(cache, key, token)
@@ -0,0 +1,46 @@
+# core/management/commands/warm_cache.py
+"""
+Precalienta la caché de páginas y payloads de API tras el pipeline nocturno
+(ver core/warm.py). Reporta tiempos por endpoint.
+
+  python manage.py warm_cache --workers 8
+  python manage.py warm_cache --tickers AAPL MSFT --no-sectors
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.warm import format_stats, warm_cache, warm_targets
+
+
+class Command(BaseCommand):
+    help = "Precalienta la caché de screener/pe/pe+, dashboards y charts por ticker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tickers", nargs="*", help="Limitar dashboards/charts a ciertos tickers")
+        parser.add_argument("--workers", type=int, default=4, help="Hilos en paralelo (default 4)")
+        parser.add_argument("--no-companies", action="store_true",
+                            help="Sólo páginas de screener/pe/pe+ (sin dashboards ni charts por ticker)")
+        parser.add_argument("--no-sectors", action="store_true", help="No calentar los filtros por sector")
+
+    def handle(self, *args, **opts):
+        backend = settings.CACHES["default"]["BACKEND"]
+        if backend.endswith("LocMemCache"):
+            self.stderr.write("Aviso: LocMemCache no se comparte con los workers web; "
+                              "el precalentado sólo sirve con una caché compartida (REDIS_URL).")
+
+        targets = warm_targets(opts.get("tickers"), companies=not opts["no_companies"],
+                               sectors=not opts["no_sectors"])
+        self.stdout.write(self.style.NOTICE(f"{len(targets)} páginas a calentar con {opts['workers']} hilos"))
+
+        def progress(done, total):
+            if done % 500 == 0:
+                self.stdout.write(f"  {done}/{total}")
+
+        stats = warm_cache(targets, workers=opts["workers"], progress=progress)
+        for line in format_stats(stats):
+            self.stdout.write(line)
+        for st in stats.values():
+            for err in st["errors"][:10]:
+                self.stderr.write(f"  {err}")
+        n_err = sum(len(st["errors"]) for st in stats.values())
+        self.stdout.write(self.style.SUCCESS(f"Caché precalentada: {len(targets)} páginas, {n_err} errores"))
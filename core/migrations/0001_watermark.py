@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(choices=[('metrics', 'recompute_metrics'), ('technicals', 'compute_technicals')], max_length=20)),
+                ('dirty', models.BooleanField(default=True)),
+                ('dirty_at', models.DateTimeField(blank=True, null=True)),
+                ('prices_through', models.DateField(blank=True, null=True)),
+                ('statements_through', models.DateField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watermarks', to='companies.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stage', 'dirty'], name='core_waterm_stage_dcced5_idx')],
+                'unique_together': {('company', 'stage')},
+            },
+        ),
+    ]
@@ -1,3 +1,39 @@
 from django.db import models
 
-# Create your models here.
+
+class Watermark(models.Model):
+    """
+    Marca de agua por compañía y etapa de recálculo (ver core/watermarks.py).
+    Las ingestas marcan `dirty`; la etapa procesa sólo compañías sucias (o sin
+    fila) y al terminar guarda hasta qué fechas de precios/estados llegó.
+    """
+    STAGES = [("metrics", "recompute_metrics"), ("technicals", "compute_technicals")]
+
+    company = models.ForeignKey("companies.Company", on_delete=models.CASCADE, related_name="watermarks")
+    stage = models.CharField(max_length=20, choices=STAGES)
+    dirty = models.BooleanField(default=True)
+    dirty_at = models.DateTimeField(null=True, blank=True)
+    prices_through = models.DateField(null=True, blank=True)      # último cierre leído por la etapa
+    statements_through = models.DateField(null=True, blank=True)  # max(Statement.period_end) procesado
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [("company", "stage")]
+        indexes = [models.Index(fields=["stage", "dirty"])]
+
+    def __str__(self):
+        return f"{self.company_id}/{self.stage} ({'dirty' if self.dirty else 'clean'})"
+
+
+class DataVersion(models.Model):
+    """
+    Contador de versión de los datos (ver core/cache.py). scope = "global" o
+    "company:<id>". Ingestas y recálculos lo incrementan; las cachés de vistas
+    usan la versión en la clave, así que invalidar es subir el contador.
+    """
+    scope = models.CharField(max_length=40, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
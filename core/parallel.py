@@ -0,0 +1,117 @@
+# core/parallel.py
+"""
+Ejecución por compañía en paralelo para los comandos pesados
+(recompute_metrics, compute_technicals, compute_metrics).
+
+- --workers N: reparte lotes de company_id en un pool de N procesos. Antes de
+  crear el pool se cierran las conexiones del padre; cada worker abre la suya
+  (y llama django.setup() si el pool arranca con "spawn").
+- --shard i/N: cada nodo procesa sólo las compañías con id % N == i, así varios
+  nodos se reparten el universo de forma determinista (i en 0..N-1).
+
+La función de trabajo recibe una lista de ids y devuelve un dict de totales:
+los números se suman, las listas (p.ej. "errors") se concatenan. El progreso y
+los errores se reportan en el proceso padre a medida que terminan los lotes.
+
+Con SQLite las escrituras concurrentes se serializan (y pueden dar "database is
+locked"); el modo con varios workers está pensado para Postgres.
+"""
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from django import db
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """'i/N' -> (i, N) con 0 <= i < N."""
+    try:
+        i, n = (int(x) for x in str(value).split("/", 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"--shard espera i/N (ej. 0/4), no {value!r}")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"--shard fuera de rango: {value!r} (0 <= i < N)")
+    return i, n
+
+
+def add_parallel_arguments(parser, shard: bool = True):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos en paralelo (default 1 = en el mismo proceso)")
+    if shard:
+        parser.add_argument("--shard", type=parse_shard, default=None,
+                            help="Procesar sólo el shard i/N del universo (id %% N == i)")
+
+
+def shard_ids(ids: Iterable[int], shard: Optional[Tuple[int, int]]) -> List[int]:
+    ids = list(ids)
+    if not shard:
+        return ids
+    i, n = shard
+    return [cid for cid in ids if cid % n == i]
+
+
+def _merge(total: dict, part: dict):
+    for k, v in (part or {}).items():
+        if isinstance(v, list):
+            total.setdefault(k, []).extend(v)
+        elif isinstance(v, (int, float)):
+            total[k] = total.get(k, 0) + v
+        else:
+            total[k] = v
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    db.connections.close_all()
+
+
+def run_chunks(fn: Callable[..., dict], ids: List[int], workers: int = 1, chunk_size: int = 50,
+               progress: Optional[Callable[[int, int, dict], None]] = None, **kwargs) -> dict:
+    """
+    Ejecuta fn(ids_lote, **kwargs) sobre `ids` en lotes de `chunk_size`, en el
+    proceso actual (workers <= 1) o en un pool de procesos. `fn` debe ser una
+    función de módulo (picklable). progress(hechas, total, parcial) se llama en
+    el padre tras cada lote. Devuelve los totales combinados; en ambos modos un
+    lote que lanza una excepción queda como entrada de "errors".
+    """
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), max(1, chunk_size))]
+    total, done = {}, 0
+
+    def _report(chunk, part):
+        nonlocal done
+        done += len(chunk)
+        _merge(total, part)
+        if progress:
+            progress(done, len(ids), part or {})
+
+    def _failed(chunk, e):
+        return {"errors": [f"lote {chunk[0]}..{chunk[-1]}: {e}"]}
+
+    if workers <= 1 or len(chunks) <= 1:
+        # mismo contrato que el pool: un lote que falla se reporta y la corrida sigue
+        for chunk in chunks:
+            try:
+                part = fn(chunk, **kwargs)
+            except Exception as e:
+                part = _failed(chunk, e)
+            _report(chunk, part)
+        return total
+
+    # no heredar conexiones abiertas del padre en los procesos hijos
+    db.connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(fn, chunk, **kwargs): chunk for chunk in chunks}
+        for fut in as_completed(futures):
+            chunk = futures[fut]
+            try:
+                part = fut.result()
+            except Exception as e:
+                part = _failed(chunk, e)
+            _report(chunk, part)
+    return total
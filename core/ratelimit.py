@@ -0,0 +1,162 @@
+# core/ratelimit.py
+"""
+Token bucket por proveedor (EODHD, FMP, SEC) compartido entre procesos.
+
+El estado del bucket vive en la caché de Django (Redis en producción), así que
+todos los workers de ingesta que compartan caché consumen la misma cuota. Si
+la caché no se comparte entre procesos (LocMemCache, DummyCache) el estado va
+a un archivo JSON por proveedor en RATE_LIMIT_DIR protegido con flock
+(core.locks): las ingestas en paralelo (--workers) de un mismo host siguen
+repartiéndose una sola cuota.
+
+El ritmo es adaptativo (AIMD): cada 429 lo reduce a la mitad y bloquea el
+bucket durante el Retry-After indicado; cada respuesta correcta lo recupera
+de a poco hasta el máximo configurado en settings.VENDOR_RATE_LIMITS.
+"""
+from __future__ import annotations
+
+import json
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from core.fsutil import atomic_write
+from core.locks import cache_lock, fcntl, file_lock
+
+DEFAULT_RATE = 5.0        # req/s si el proveedor no está configurado
+STATE_TTL = 60 * 60       # el ritmo aprendido "olvida" tras 1h sin uso
+DEFAULT_BACKOFF = 5.0     # seg de bloqueo ante un 429 sin Retry-After
+
+
+def parse_retry_after(value) -> float | None:
+    """Retry-After en segundos (acepta número o fecha HTTP)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _CacheState:
+    """Estado en la caché compartida; lock con cache.add + compare-and-delete."""
+
+    def __init__(self, cache, vendor: str):
+        self.cache = cache
+        self.key = f"ratelimit:{vendor}"
+        self.lock_key = f"ratelimit:{vendor}:lock"
+
+    def locked(self):
+        return cache_lock(self.cache, self.lock_key)
+
+    def get(self):
+        return self.cache.get(self.key)
+
+    def set(self, st: dict):
+        self.cache.set(self.key, st, timeout=STATE_TTL)
+
+
+class _FileState:
+    """Estado en <RATE_LIMIT_DIR>/<vendor>.json, lock con flock en <vendor>.lock."""
+
+    def __init__(self, root: Path, vendor: str):
+        self.path = root / f"{vendor}.json"
+        self.lock_path = root / f"{vendor}.lock"
+
+    def locked(self):
+        return file_lock(self.lock_path)
+
+    def get(self):
+        try:
+            st = json.loads(self.path.read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+        return st if time.time() - st.get("ts", 0.0) <= STATE_TTL else None
+
+    def set(self, st: dict):
+        atomic_write(self.path, json.dumps(st).encode("utf-8"))
+
+
+def _state_store(vendor: str, cache_alias: str):
+    cache = caches[cache_alias]
+    if isinstance(cache, (LocMemCache, DummyCache)) and fcntl is not None:
+        root = Path(getattr(settings, "RATE_LIMIT_DIR", settings.BASE_DIR / "var" / "ratelimit"))
+        return _FileState(root, vendor)
+    return _CacheState(cache, vendor)
+
+
+class RateLimiter:
+    def __init__(self, vendor: str, rate: float | None = None, burst: float | None = None,
+                 cache_alias: str = "default"):
+        self.vendor = vendor
+        limits = getattr(settings, "VENDOR_RATE_LIMITS", {})
+        self.max_rate = float(rate or limits.get(vendor) or DEFAULT_RATE)
+        self.min_rate = self.max_rate / 20
+        self.burst = float(burst or max(1.0, self.max_rate))
+        self.store = _state_store(vendor, cache_alias)
+
+    # -- estado compartido -------------------------------------------------
+    def _locked(self):
+        return self.store.locked()
+
+    def _load(self, now: float) -> dict:
+        st = self.store.get() or {
+            "tokens": self.burst, "ts": now, "rate": self.max_rate, "blocked_until": 0.0,
+        }
+        # el máximo pudo cambiar (p.ej. --rate) desde que se guardó el estado
+        st["rate"] = min(st["rate"], self.max_rate)
+        st["tokens"] = min(self.burst, st["tokens"] + (now - st["ts"]) * st["rate"])
+        st["ts"] = now
+        return st
+
+    def _save(self, st: dict):
+        self.store.set(st)
+
+    # -- API -----------------------------------------------------------------
+    def acquire(self):
+        """Bloquea hasta obtener un token."""
+        while True:
+            with self._locked():
+                now = time.time()
+                st = self._load(now)
+                if now < st["blocked_until"]:
+                    wait = st["blocked_until"] - now
+                elif st["tokens"] >= 1.0:
+                    st["tokens"] -= 1.0
+                    self._save(st)
+                    return
+                else:
+                    wait = (1.0 - st["tokens"]) / st["rate"]
+                self._save(st)
+            time.sleep(wait)
+
+    def on_success(self):
+        """Incremento aditivo del ritmo tras una respuesta correcta."""
+        st = self.store.get()
+        if not st or st["rate"] >= self.max_rate:
+            return  # camino rápido: sin lock mientras no haya penalización
+        with self._locked():
+            st = self._load(time.time())
+            if st["rate"] < self.max_rate:
+                st["rate"] = min(self.max_rate, st["rate"] + self.max_rate * 0.05)
+                self._save(st)
+
+    def on_throttle(self, retry_after: float | None = None):
+        """429: recorta el ritmo a la mitad y pausa el bucket para todos."""
+        with self._locked():
+            now = time.time()
+            st = self._load(now)
+            st["rate"] = max(self.min_rate, st["rate"] / 2)
+            st["tokens"] = 0.0
+            pause = retry_after if retry_after is not None else DEFAULT_BACKOFF
+            st["blocked_until"] = max(st["blocked_until"], now + pause)
+            self._save(st)
@@ -1,3 +1,294 @@
-from django.test import TestCase
+import argparse
+import datetime as dt
+import json
+import multiprocessing
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from charts import screener
+from charts import views as chart_views
+from companies.models import Company
+from core import cache as page_cache
+from core.archive import PayloadArchive
+from core.fsutil import atomic_write
+from core.locks import release_cache_lock
+from core.models import Watermark
+from core.parallel import _merge, add_parallel_arguments, parse_shard, run_chunks, shard_ids
+from core.ratelimit import RateLimiter, _FileState
+from core.warm import warm_cache, warm_targets
+from core.watermarks import dirty_ids, mark_clean
+from marketdata.models import PriceBar, TechnicalState
+
+
+def _sum_chunk(ids, fail_on=None):
+    """Función de lote para run_chunks (de módulo: picklable para el pool)."""
+    if fail_on in ids:
+        raise ValueError(f"boom {fail_on}")
+    return {"n": len(ids), "sum": float(sum(ids)), "ids": list(ids), "last": ids[-1]}
+
+
+def _bars(company, start, n, close=100.0):
+    PriceBar.objects.bulk_create([PriceBar(company=company, date=start + dt.timedelta(days=i), close=close + i)
+                                  for i in range(n)])
+
+
+class WatermarkTests(TestCase):
+    def setUp(self):
+        panel_dir = override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp())  # panel propio por test
+        panel_dir.enable()
+        self.addCleanup(panel_dir.disable)
+        self.c = Company.objects.create(ticker="AAA", name="A")
+        self.start = dt.date(2024, 1, 1)
+        _bars(self.c, self.start, 30)
+
+    def _mark(self, stage="technicals"):
+        return Watermark.objects.get(company=self.c, stage=stage)
+
+    def test_mark_clean_uses_dates_read(self):
+        read = self.start + dt.timedelta(days=20)  # la etapa vio menos que PriceBar
+        mark_clean("technicals", [self.c.id], timezone.now(), prices_through={self.c.id: read})
+        self.assertEqual(self._mark().prices_through, read)
+        self.assertEqual(dirty_ids("technicals", [self.c.id]), [self.c.id])
+
+        mark_clean("technicals", [self.c.id], timezone.now())
+        self.assertEqual(self._mark().prices_through, self.start + dt.timedelta(days=29))
+        self.assertEqual(dirty_ids("technicals", [self.c.id]), [])
+
+    def test_build_price_panel_marks_changed_companies(self):
+        other = Company.objects.create(ticker="BBB", name="B")
+        _bars(other, self.start, 10)
+        call_command("build_price_panel", stdout=open("/dev/null", "w"))
+        self.assertTrue(self._mark().dirty)
+        mark_clean("technicals", [self.c.id, other.id], timezone.now())
+
+        # cierres cargados por otra vía: sólo esa compañía cambia en el panel
+        _bars(self.c, self.start + dt.timedelta(days=30), 1)
+        call_command("build_price_panel", tickers=["AAA"], stdout=open("/dev/null", "w"))
+        self.assertTrue(self._mark().dirty)
+        self.assertFalse(Watermark.objects.get(company=other, stage="technicals").dirty)
+
+    def test_technicals_watermark_matches_closes_read(self):
+        call_command("build_price_panel", stdout=open("/dev/null", "w"))
+        call_command("compute_technicals", stdout=open("/dev/null", "w"))
+        self.assertEqual(self._mark().prices_through, TechnicalState.objects.get(company=self.c).last_date)
+
+        _bars(self.c, self.start + dt.timedelta(days=30), 2)  # sin reconstruir el panel
+        call_command("compute_technicals", stdout=open("/dev/null", "w"))
+        state = TechnicalState.objects.get(company=self.c)
+        self.assertEqual(self._mark().prices_through, state.last_date)
+        self.assertEqual(dirty_ids("technicals", [self.c.id]) == [], state.last_date == self.start + dt.timedelta(days=31))
+
+
+def _acquire_many(n, rate):
+    limiter = RateLimiter("test", rate=rate, burst=1)
+    for _ in range(n):
+        limiter.acquire()
+
+
+@override_settings(RATE_LIMIT_DIR=tempfile.mkdtemp())
+class RateLimiterTests(SimpleTestCase):
+    def test_locmem_uses_file_state(self):
+        self.assertIsInstance(RateLimiter("test").store, _FileState)
+
+    def test_quota_shared_between_processes(self):
+        rate, n, procs = 40.0, 8, 3
+        ctx = multiprocessing.get_context("fork")
+        t0 = time.monotonic()
+        workers = [ctx.Process(target=_acquire_many, args=(n, rate)) for _ in range(procs)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        # una sola cuota: ~(procs * n - burst) / rate seg; por proceso serían ~(n - 1) / rate
+        self.assertGreaterEqual(time.monotonic() - t0, (procs * n - 1) / rate * 0.9)
+
+    def test_cache_lock_release_is_compare_and_delete(self):
+        cache = caches["default"]
+        cache.set("lock-test", 111)
+        self.assertFalse(release_cache_lock(cache, "lock-test", 222))  # lock ajeno
+        self.assertEqual(cache.get("lock-test"), 111)
+        self.assertTrue(release_cache_lock(cache, "lock-test", 111))
+        self.assertIsNone(cache.get("lock-test"))
+
+
+class AtomicWriteTests(SimpleTestCase):
+    def test_replaces_content_and_cleans_up_on_failure(self):
+        path = Path(tempfile.mkdtemp()) / "sub" / "state.json"
+        atomic_write(path, b"uno")
+        atomic_write(path, b"dos")
+        self.assertEqual(path.read_bytes(), b"dos")
+        with mock.patch("core.fsutil.os.replace", side_effect=OSError("disco lleno")):
+            with self.assertRaises(OSError):
+                atomic_write(path, b"tres")
+        self.assertEqual(path.read_bytes(), b"dos")
+        self.assertEqual([p.name for p in path.parent.iterdir()], ["state.json"])  # sin .tmp-*
+
+class PayloadArchiveTests(SimpleTestCase):
+    def setUp(self):
+        self.archive = PayloadArchive(tempfile.mkdtemp())
+        self.day = dt.date(2024, 3, 1)
+
+    def _put(self, rows, on):
+        self.archive.put("eodhd", "AAA.US", "eod", json.dumps(rows).encode(), on=on)
+
+    def test_same_day_fetches_are_all_replayed(self):
+        full = [{"date": "2024-02-28", "close": 1}, {"date": "2024-02-29", "close": 2}]
+        self._put(full, self.day)
+        self._put([{"date": "2024-02-29", "close": 3}], self.day)  # incremental del mismo día
+        self._put([{"date": "2024-02-29", "close": 3}], self.day)  # repetida: no agrega ref
+        self._put([{"date": "2024-03-01", "close": 4}], self.day + dt.timedelta(days=1))
+
+        replay = list(self.archive.iter_json("eodhd", "AAA.US", "eod", until=self.day))
+        self.assertEqual(replay, [full, [{"date": "2024-02-29", "close": 3}]])
+        self.assertEqual(len(list(self.archive.iter_json("eodhd", "AAA.US", "eod"))), 3)
+        self.assertEqual(self.archive.dates("eodhd", "AAA.US", "eod"), [self.day, self.day + dt.timedelta(days=1)])
+        self.assertEqual(self.archive.latest_json("eodhd", "AAA.US", "eod", until=self.day),
+                         [{"date": "2024-02-29", "close": 3}])
+
+    def test_reads_legacy_day_refs(self):
+        self._put([{"close": 2}], self.day)
+        legacy = [{"close": 1}]
+        sha = self.archive.put("eodhd", "AAA.US", "eod", json.dumps(legacy).encode(), on=self.day)
+        ref_dir = self.archive._ref_dir("eodhd", "AAA.US", "eod")
+        for p in ref_dir.iterdir():
+            if p.name.endswith(sha[:12]):
+                p.rename(ref_dir / self.day.isoformat())  # formato anterior: una ref por día
+        self.assertEqual(list(self.archive.iter_json("eodhd", "AAA.US", "eod")), [legacy, [{"close": 2}]])
+        self.assertEqual(json.loads(self.archive.read("eodhd", "AAA.US", "eod", self.day)), [{"close": 2}])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _compute(self, value="fresh", delay=0.1):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_concurrent_misses_compute_once(self):
+        results = []
+        compute = self._compute()
+
+        def hit():
+            results.append(page_cache.single_flight("k", compute, 60))
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ["fresh"] * 8)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(cache.get("sf:k"))  # lock liberado
+
+    def test_serves_stale_while_another_worker_recomputes(self):
+        cache.set("k:last", "stale")
+        cache.add("sf:k:v2", 123)  # otro worker tiene el recálculo
+        got = page_cache.single_flight("k:v2", self._compute(), 60, stale_key="k:last")
+        self.assertEqual((got, self.calls), ("stale", 0))
+
+        cache.delete("sf:k:v2")
+        self.assertEqual(page_cache.single_flight("k:v2", self._compute(delay=0), 60, stale_key="k:last"), "fresh")
+        self.assertEqual(cache.get("k:last"), "fresh")
+
+    def test_expired_lock_taken_by_another_worker_is_kept(self):
+        def slow():
+            cache.set("sf:k", 456)  # nuestro lock expiró y otro worker lo tomó
+            return "fresh"
+
+        page_cache.single_flight("k", slow, 60)
+        self.assertEqual(cache.get("sf:k"), 456)
+
+
+class ParallelTests(SimpleTestCase):
+    def test_shards_partition_ids(self):
+        ids = list(range(1, 101))
+        parts = [shard_ids(ids, (i, 4)) for i in range(4)]
+        self.assertEqual(sorted(sum(parts, [])), ids)
+        self.assertEqual(parts[1][:3], [1, 5, 9])
+        self.assertEqual(shard_ids(iter(ids), None), ids)
+        self.assertEqual(shard_ids(ids, (0, 1)), ids)
+
+    def test_shard_argument(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for bad in ("x", "1", "4/4", "-1/3", "1/0", "a/b"):
+            with self.subTest(shard=bad), self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(bad)
+        parser = argparse.ArgumentParser()
+        add_parallel_arguments(parser)
+        self.assertEqual(parser.parse_args(["--shard", "1/3", "--workers", "2"]).shard, (1, 3))
+        with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+            parser.parse_args(["--shard", "3/3"])
+
+    def test_merge_totals(self):
+        total = {}
+        _merge(total, {"n": 2, "x": 0.5, "errors": ["a"], "last": "p"})
+        _merge(total, {"n": 3, "x": 1.0, "errors": ["b"], "last": "q"})
+        _merge(total, None)
+        self.assertEqual(total, {"n": 5, "x": 1.5, "errors": ["a", "b"], "last": "q"})
+
+    def test_failed_chunk_is_reported_in_both_modes(self):
+        ids = list(range(1, 11))
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                seen = []
+                t = run_chunks(_sum_chunk, ids, workers=workers, chunk_size=3, fail_on=5,
+                               progress=lambda done, total, part: seen.append(done))
+                self.assertEqual(t["n"], 7)
+                self.assertEqual(sorted(t["ids"]), [1, 2, 3, 7, 8, 9, 10])
+                self.assertEqual(t["errors"], ["lote 4..6: boom 5"])
+                self.assertEqual(sorted(seen)[-1], 10)
+        # un solo lote (corre en el proceso aunque haya workers): tampoco aborta
+        self.assertEqual(run_chunks(_sum_chunk, [5], workers=4, fail_on=5)["errors"], ["lote 5..5: boom 5"])
+
+
+class CanonicalPathTests(SimpleTestCase):
+    def _key(self, url, defaults=None):
+        return page_cache._canonical_path(RequestFactory().get(url), defaults)
+
+    def test_sorted_without_empty_or_default_params(self):
+        defaults = {"order": "pe_asc", "limit": 100, "w_evs": 0.20}
+        self.assertEqual(self._key("/screener/?sector=&min_mcap=&order=pe_asc&limit=100&w_evs=0.2", defaults),
+                         "/screener/")
+        self.assertEqual(self._key("/screener/?order=yoy_desc&sector=Tech", defaults),
+                         self._key("/screener/?sector=Tech&min_mcap=&order=yoy_desc", defaults))
+        self.assertEqual(self._key("/screener/?order=yoy_desc&sector=Tech", defaults),
+                         "/screener/?order=yoy_desc&sector=Tech")
+        self.assertNotEqual(self._key("/screener/?limit=50", defaults), self._key("/screener/", defaults))
+
+
+class WarmCacheTests(TransactionTestCase):
+    """Lo que calienta core/warm.py es lo que luego piden los formularios (GET)."""
+
+    def setUp(self):
+        cache.clear()
+        screener._state.update(stamp=None, frame=None)
+        Company.objects.create(ticker="AAA", name="A", sector="Tech")
+
+    def test_warmed_form_urls_are_hits(self):
+        stats = warm_cache(warm_targets(companies=False), workers=2)
+        self.assertFalse([e for st in stats.values() for e in st["errors"]])
+        form_urls = [
+            "/screener/?sector=&min_mcap=",
+            "/screener/?sector=Tech&min_mcap=",
+            "/pe/?sector=&min_mcap=",
+            "/pe+/?sector=&min_mcap=&order=score_desc&w_pe=0.35&w_evs=0.2&w_yoy=0.2&w_nm=0.15&w_rsi=0.1",
+            "/pe+/?sector=&min_mcap=&order=yoy_desc&w_pe=0.35&w_evs=0.2&w_yoy=0.2&w_nm=0.15&w_rsi=0.1",
+        ]
+        with mock.patch.object(chart_views, "get_frame", side_effect=AssertionError("cache miss")):
+            for url in form_urls:
+                with self.subTest(url=url):
+                    self.assertEqual(self.client.get(url).status_code, 200)
 
-# Create your tests here.
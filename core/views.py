@@ -1,6 +1,7 @@
 # core/views.py
 from __future__ import annotations
 
+from django.conf import settings
 from django.views.generic import TemplateView
 from django.urls import reverse_lazy
 from django.utils.timezone import now
@@ -9,6 +10,7 @@ from django.template.loader import get_template
 from django.template import TemplateDoesNotExist
 
 from companies.models import Company
+from core.cache import data_version
 from fundamentals.models import Metric
 from marketdata.models import PriceBar
 
@@ -21,7 +23,9 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
 
-        quick = cache.get("core:quick_stats")
+        # clave por versión de datos: se recalcula sólo tras una ingesta/recálculo
+        quick_key = f"core:quick_stats:{data_version()}"
+        quick = cache.get(quick_key)
         if not quick:
             last_bar = PriceBar.objects.order_by("-date").first()
             quick = {
@@ -30,7 +34,7 @@ class HomeView(TemplateView):
                 "last_price_date": getattr(last_bar, "date", None),
                 "now": now(),
             }
-            cache.set("core:quick_stats", quick, timeout=300)  # 5 min
+            cache.set(quick_key, quick, timeout=settings.VERSIONED_CACHE_TTL)
         ctx["quick_stats"] = quick
 
         # (resto igual: ctx["sections"] = [...])
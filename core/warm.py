@@ -0,0 +1,111 @@
+# core/warm.py
+"""
+Precalentado de cachés después del pipeline (ingesta + recálculos).
+
+Renderiza las páginas y payloads más pedidos llamando directamente a las
+vistas (RequestFactory, mismas rutas que usan los usuarios) en un pool de
+hilos. versioned_cache_page canoniza la query (core.cache._canonical_path), así
+"/screener/?order=yoy_desc" es la misma clave que el GET del formulario con
+sector/min_mcap vacíos y el resto en sus defaults:
+
+  /screener/, /pe/, /pe+/   defaults, órdenes frecuentes y un filtro por sector
+  /stock/<ticker>/          dashboard de cada compañía
+  /api/charts/<ticker>/price/ y /revenue/
+
+Sólo tiene sentido con una caché compartida (Redis): con LocMemCache lo
+calentado vive en la memoria del proceso que corre el comando.
+"""
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from django import db
+from django.test import RequestFactory
+
+from companies.models import Company
+
+SCREENER_ORDERS = ["mcap_desc", "yoy_desc", "evs_asc", "rsi_asc"]
+PE_PLUS_ORDERS = ["pe_asc", "yoy_desc", "mcap_desc"]
+
+Target = Tuple[str, Callable, str, dict]  # (endpoint, vista, path con query, kwargs de la url)
+
+
+def _path(base: str, params: Optional[dict] = None) -> str:
+    return f"{base}?{urlencode(params)}" if params else base
+
+
+def warm_targets(tickers: Optional[Iterable[str]] = None, companies: bool = True,
+                 sectors: bool = True) -> List[Target]:
+    from api.views import CompanyPriceChart, CompanyRevenueChart
+    from charts.views import company_dashboard, pe_plus_view, pe_view, screener_view
+
+    out: List[Target] = []
+    pages = (("screener", screener_view, "/screener/", SCREENER_ORDERS),
+             ("pe", pe_view, "/pe/", []),
+             ("pe_plus", pe_plus_view, "/pe+/", PE_PLUS_ORDERS))
+    sector_list = []
+    if sectors:
+        sector_list = [s for s in Company.objects.order_by("sector").values_list("sector", flat=True).distinct() if s]
+    for name, view, base, orders in pages:
+        out.append((name, view, _path(base), {}))
+        out += [(name, view, _path(base, {"order": o}), {}) for o in orders]
+        out += [(name, view, _path(base, {"sector": s}), {}) for s in sector_list]
+
+    if companies:
+        qs = Company.objects.order_by("ticker")
+        if tickers:
+            qs = qs.filter(ticker__in=[t.upper() for t in tickers])
+        price, revenue = CompanyPriceChart.as_view(), CompanyRevenueChart.as_view()
+        for t in qs.values_list("ticker", flat=True):
+            out.append(("dashboard", company_dashboard, f"/stock/{t}/", {"ticker": t}))
+            out.append(("price_chart", price, f"/api/charts/{t}/price/", {"ticker": t}))
+            out.append(("revenue_chart", revenue, f"/api/charts/{t}/revenue/", {"ticker": t}))
+    return out
+
+
+def _render(target: Target) -> Tuple[str, float, Optional[str]]:
+    name, view, path, kwargs = target
+    t0 = time.perf_counter()
+    err = None
+    try:
+        resp = view(RequestFactory().get(path), **kwargs)
+        if resp.status_code >= 400:
+            err = f"{path}: HTTP {resp.status_code}"
+    except Exception as e:
+        err = f"{path}: {e}"
+    finally:
+        db.connections.close_all()  # conexiones por hilo
+    return name, time.perf_counter() - t0, err
+
+
+def warm_cache(targets: List[Target], workers: int = 4,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, dict]:
+    """
+    Renderiza `targets` en `workers` hilos. Devuelve por endpoint:
+    {"n", "errors", "total", "max"} (segundos) y la lista de errores.
+    """
+    stats: Dict[str, dict] = defaultdict(lambda: {"n": 0, "total": 0.0, "max": 0.0, "errors": []})
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for done, (name, secs, err) in enumerate(pool.map(_render, targets), 1):
+            st = stats[name]
+            st["n"] += 1
+            st["total"] += secs
+            st["max"] = max(st["max"], secs)
+            if err:
+                st["errors"].append(err)
+            if progress:
+                progress(done, len(targets))
+    return dict(stats)
+
+
+def format_stats(stats: Dict[str, dict]) -> List[str]:
+    lines = [f"{'endpoint':<14} {'n':>6} {'err':>5} {'total s':>9} {'avg ms':>8} {'max ms':>8}"]
+    for name, st in stats.items():
+        avg = st["total"] / st["n"] * 1000 if st["n"] else 0.0
+        lines.append(f"{name:<14} {st['n']:>6} {len(st['errors']):>5} {st['total']:>9.2f} "
+                     f"{avg:>8.1f} {st['max'] * 1000:>8.1f}")
+    return lines
@@ -0,0 +1,111 @@
+# core/watermarks.py
+"""
+Dirty-tracking por compañía para las etapas de recálculo.
+
+- Las ingestas llaman mark_dirty(ids, "prices" | "statements"): se marcan
+  sucias las etapas que dependen de esa fuente (STAGE_SOURCES).
+- Cada etapa pide dirty_ids(stage, ids): compañías marcadas, sin fila todavía
+  o con datos más nuevos que su marca (p.ej. cargados por otra vía).
+- Al terminar, mark_clean(stage, ids, started_at) guarda hasta qué fechas llegó
+  (para precios, la del último cierre que la etapa leyó, si la pasa).
+  Si una ingesta volvió a marcar la compañía después de `started_at`, sigue sucia.
+
+mark_dirty también sube la versión de datos (core.cache) de esas compañías.
+"""
+from __future__ import annotations
+
+import datetime as dt
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import Max
+from django.utils import timezone
+
+from core.cache import bump_data_version
+from core.models import Watermark
+from fundamentals.models import Statement
+from marketdata.models import PriceBar
+
+# etapa -> fuentes de las que depende
+STAGE_SOURCES = {
+    "metrics": ("statements", "prices"),
+    "technicals": ("prices",),
+}
+
+
+def _max_dates(company_ids, source):
+    if source == "prices":
+        qs, field = PriceBar.objects, "date"
+    else:
+        qs, field = Statement.objects, "period_end"
+    rows = (qs.filter(company_id__in=list(company_ids)).values("company_id")
+            .annotate(last=Max(field)).values_list("company_id", "last"))
+    return dict(rows)
+
+
+def mark_dirty(company_ids: Iterable[int], source: str):
+    """Marca sucias todas las etapas que dependen de `source` para estas compañías."""
+    ids = sorted(set(company_ids))
+    stages = [s for s, sources in STAGE_SOURCES.items() if source in sources]
+    if not ids or not stages:
+        return
+    now = timezone.now()
+    Watermark.objects.bulk_create(
+        [Watermark(company_id=cid, stage=st, dirty=True, dirty_at=now) for cid in ids for st in stages],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["company", "stage"],
+        update_fields=["dirty", "dirty_at"],
+    )
+    bump_data_version(ids)
+
+
+def dirty_ids(stage: str, company_ids: Iterable[int]) -> List[int]:
+    """Subconjunto (ordenado) de company_ids que la etapa debe reprocesar."""
+    ids = list(company_ids)
+    marks = {w.company_id: w for w in Watermark.objects.filter(stage=stage, company_id__in=ids)}
+    maxes = {src: _max_dates(ids, src) for src in STAGE_SOURCES[stage]}
+    out = []
+    for cid in ids:
+        w = marks.get(cid)
+        if w is None or w.dirty:
+            out.append(cid)
+            continue
+        newer_prices = "prices" in maxes and _after(maxes["prices"].get(cid), w.prices_through)
+        newer_stmts = "statements" in maxes and _after(maxes["statements"].get(cid), w.statements_through)
+        if newer_prices or newer_stmts:
+            out.append(cid)
+    return sorted(out)
+
+
+def _after(current: Optional[dt.date], through: Optional[dt.date]) -> bool:
+    return current is not None and (through is None or current > through)
+
+
+def mark_clean(stage: str, company_ids: Iterable[int], started_at: dt.datetime,
+               prices_through: Optional[Dict[int, Optional[dt.date]]] = None):
+    """
+    Guarda la marca de agua de compañías procesadas sin error desde `started_at`.
+    prices_through: último cierre que la etapa realmente leyó por compañía (el
+    panel mmap puede ir detrás de PriceBar); las que no estén usan Max(PriceBar.date).
+    """
+    ids = list(company_ids)
+    if not ids:
+        return
+    # re-marcadas por una ingesta durante la corrida: quedan sucias
+    redirtied = set(Watermark.objects.filter(stage=stage, company_id__in=ids, dirty_at__gt=started_at)
+                    .values_list("company_id", flat=True))
+    ids = [cid for cid in ids if cid not in redirtied]
+    sources = STAGE_SOURCES[stage]
+    prices = _max_dates(ids, "prices") if "prices" in sources else {}
+    if prices_through is not None and "prices" in sources:
+        prices.update(prices_through)
+    stmts = _max_dates(ids, "statements") if "statements" in sources else {}
+    now = timezone.now()
+    Watermark.objects.bulk_create(
+        [Watermark(company_id=cid, stage=stage, dirty=False, prices_through=prices.get(cid),
+                   statements_through=stmts.get(cid), processed_at=now) for cid in ids],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["company", "stage"],
+        update_fields=["dirty", "prices_through", "statements_through", "processed_at"],
+    )
@@ -1,35 +1,22 @@
-import os, requests, time
 from django.core.management.base import BaseCommand
 from companies.models import Company
-
-def to_sec_symbol(t: str) -> str:
-    return t.replace("-", ".").upper()
+from companies.services import backfill_ciks, refresh_cik_index
 
 class Command(BaseCommand):
-    help = "Fill missing Company.cik using SEC ticker map."
+    help = "Fill missing Company.cik using the local SEC ticker/CIK index (refreshed when stale)."
 
     def add_arguments(self, parser):
         parser.add_argument("--tickers", nargs="*", help="Limit to specific tickers")
-        parser.add_argument("--sleep", type=float, default=0.0, help="Pause between updates (sec)")
+        parser.add_argument("--refresh", action="store_true", help="Force a refresh of the ticker/CIK index")
 
     def handle(self, *args, **opts):
-        ua = os.getenv("SEC_USER_AGENT") or "Finboard/1.0 (Contact: you@example.com)"
-        r = requests.get("https://www.sec.gov/files/company_tickers.json",
-                         headers={"User-Agent": ua}, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        sec_map = {str(v["ticker"]).upper(): str(v["cik_str"]).zfill(10) for v in data.values()}
+        if opts.get("refresh"):
+            n = refresh_cik_index(force=True)
+            self.stdout.write(f"Ticker/CIK index refreshed ({n} tickers).")
 
-        qs = Company.objects.filter(cik__isnull=True)
+        qs = Company.objects.all()
         if opts.get("tickers"):
             qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
 
-        updated = 0
-        for c in qs:
-            cik = sec_map.get(to_sec_symbol(c.ticker)) or sec_map.get(c.ticker.upper())
-            if cik:
-                c.cik = cik
-                c.save(update_fields=["cik"])
-                updated += 1
-                if opts["sleep"]: time.sleep(opts["sleep"])
+        updated = backfill_ciks(qs)
         self.stdout.write(self.style.SUCCESS(f"Updated {updated} companies with CIKs."))
@@ -1,282 +1,71 @@
 # filings/management/commands/ingest_sec.py
-import os
 import time
 import json
-import math
 import datetime as dt
 from collections import defaultdict
 
-import requests
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
 from django.utils.timezone import make_aware
 
 from companies.models import Company
-from fundamentals.models import Statement
+from core.archive import PayloadArchive
+from core.fetch import VendorClient
+from core.watermarks import mark_dirty
+from companies.services import backfill_ciks, cik_map, lookup_cik, refresh_cik_index
+from filings.sec import SEC_FACTS_URL_TMPL, _ua, _pad_cik, pack_facts
+from fundamentals.services import upsert_statements
 
 # --------------------------------------------------------------------------------------
-# CONFIG
-# --------------------------------------------------------------------------------------
-SEC_TICKERMAP_URL = "https://www.sec.gov/files/company_tickers.json"
-SEC_FACTS_URL_TMPL = "https://data.sec.gov/api/xbrl/companyfacts/CIK{cik10}.json"
-
-# tags que intentaremos para cada campo de nuestro payload
-USGAAP = "us-gaap"
-TAGS = {
-    # Income Statement (durations)
-    "Revenue": [
-        "RevenueFromContractWithCustomerExcludingAssessedTax",
-        "SalesRevenueNet",
-        "Revenue",
-        "Revenues",
-        "SalesRevenueGoodsNet",
-    ],
-    "NetIncome": [
-        "NetIncomeLoss",
-        "ProfitLoss",
-    ],
-    "EPS": [
-        "EarningsPerShareDiluted",
-        "EarningsPerShareBasicAndDiluted",
-        "EarningsPerShareBasic",
-    ],
-    "EBITDA": [
-        "EarningsBeforeInterestTaxesDepreciationAndAmortization",
-        # Si no existe, podríamos aproximar en otra versión sumando OperatingIncome + D&A
-    ],
-
-    # Balance Sheet (instants)
-    "CashAndCashEquivalents": [
-        "CashAndCashEquivalentsAtCarryingValue",
-        "CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents",
-    ],
-    "ShortTermDebt": [
-        "DebtCurrent",
-        "ShortTermBorrowings",
-    ],
-    "LongTermDebt": [
-        "LongTermDebtNoncurrent",
-        "LongTermBorrowings",
-        "LongTermDebt",
-    ],
-    "CommonStockSharesOutstanding": [
-        "CommonStockSharesOutstanding",
-    ],
-
-    # Shares promedio (durations) — útil para métricas
-    "WeightedAverageShsOutDil": [
-        "WeightedAverageNumberOfDilutedSharesOutstanding",
-        "WeightedAverageNumberOfSharesOutstandingDiluted",
-    ],
-    # Income Statement (durations) – para derivar EBITDA si falta
-"OperatingIncome": [
-    "OperatingIncomeLoss",
-],
-"DepreciationAndAmortization": [
-    "DepreciationAndAmortization",
-    "DepreciationDepletionAndAmortization",
-    "DepreciationAmortizationAndAccretionNet",
-],
-}
-
-# unidades preferidas por campo
-PREFERRED_UNITS = {
-    "Revenue": {"USD"},
-    "NetIncome": {"USD"},
-    "EPS": {"USD/shares"},
-    "EBITDA": {"USD"},
-    "CashAndCashEquivalents": {"USD"},
-    "ShortTermDebt": {"USD"},
-    "LongTermDebt": {"USD"},
-    "CommonStockSharesOutstanding": {"shares"},
-    "WeightedAverageShsOutDil": {"shares"},
-}
-
-# --------------------------------------------------------------------------------------
-# Helpers
+# Core ingest
 # --------------------------------------------------------------------------------------
-def _ua():
-    ua = os.getenv("SEC_USER_AGENT")
-    if not ua:
-        raise CommandError(
-            "Define la variable de entorno SEC_USER_AGENT (ej: "
-            "'Finboard/1.0 (Contact: tu_email@example.com)')"
-        )
-    return {"User-Agent": ua}
-
-def _pad_cik(cik: str) -> str:
-    cik = (cik or "").strip()
-    return cik.zfill(10) if cik else ""
-
-def _to_date(s):
-    # SEC usa 'end' como 'YYYY-MM-DD'
-    try:
-        y, m, d = map(int, s.split("-"))
-        return dt.date(y, m, d)
-    except Exception:
-        return None
-
-def _is_quarter_point(p):
-    # Preferimos puntos de trimestre (10-Q) o Q4 (a veces en 10-K)
-    form = (p.get("form") or "").upper()
-    fp = (p.get("fp") or "").upper()  # Q1/Q2/Q3/Q4/FY
-    if form in {"10-Q"}:
-        return True
-    if form in {"10-K"} and fp in {"Q4", "FY"}:
-        return True
-    # Si no viene el form, usar pista por 'fp'
-    return fp in {"Q1", "Q2", "Q3", "Q4"}
-
-def _best_unit(units_dict, preferred: set[str]):
-    """Devuelve el nombre de unidad preferida si existe, sino la primera disponible."""
-    if not isinstance(units_dict, dict):
-        return None
-    if preferred:
-        for u in preferred:
-            if u in units_dict:
-                return u
-    # fallback: primera clave
-    return next(iter(units_dict.keys()), None)
-
-def _select_points(units_dict, preferred_units):
-    """Filtra a quarterly points y devuelve lista [(end_date, value), ...]"""
-    unit_name = _best_unit(units_dict, preferred_units)
-    if not unit_name:
-        return []
-    out = []
-    for p in units_dict[unit_name]:
-        if not _is_quarter_point(p):
-            continue
-        end = _to_date(p.get("end") or "")
-        if not end:
-            continue
-        v = p.get("val")
-        try:
-            fv = float(v)
-        except Exception:
-            continue
-        # descarte NaN/inf
-        if fv is None or math.isnan(fv) or math.isinf(fv):
-            continue
-        out.append((end, fv))
-    # dedupe por end date (nos quedamos con el último por si se repite)
-    dd = {}
-    for d, v in out:
-        dd[d] = v
-    return sorted(dd.items(), key=lambda t: t[0])
+def _get_json(client, url, symbol, endpoint, archive, replay=False, replay_date=None, timeout=60):
+    """GET + archivo de la respuesta cruda; con replay lee del archivo sin red."""
+    if replay:
+        js = archive.latest_json("sec", symbol, endpoint, until=replay_date)
+        if js is None:
+            raise CommandError(f"Sin respuesta archivada para sec/{symbol}/{endpoint}")
+        return js
+    r = client.get(url, timeout=timeout)
+    r.raise_for_status()
+    archive.put("sec", symbol, endpoint, r.content)
+    return r.json()
 
-def _pull_tag_points(facts, tag_name, preferred_units):
-    """Extrae puntos de un tag us-gaap:tag_name"""
-    try:
-        tag_obj = facts[USGAAP][tag_name]
-    except Exception:
-        return []
-    units = tag_obj.get("units") or {}
-    return _select_points(units, preferred_units)
 
-def _attach(packed, end_date, key, value):
-    d = packed.setdefault(end_date, {})
-    d[key] = value
+def ingest_company(company: Company, years: int = 10, sleep: float = 0.0, logger=print, client=None,
+                   archive=None, replay=False, replay_date=None, cik_index=None):
+    # Todas las llamadas pasan por el rate limiter compartido del proveedor "sec"
+    if not replay:
+        client = client or VendorClient("sec", headers=_ua())
+    archive = archive or PayloadArchive()
 
-# --------------------------------------------------------------------------------------
-# Core ingest
-# --------------------------------------------------------------------------------------
-def ingest_company(company: Company, years: int = 10, sleep: float = 0.25, logger=print):
-    # 1) Resolver CIK (lo persistimos si falta)
+    # 1) Resolver CIK contra el índice local ticker/CIK (lo persistimos si falta)
     cik = (company.cik or "").strip()
     if not cik:
-        r = requests.get(SEC_TICKERMAP_URL, headers=_ua(), timeout=30)
-        r.raise_for_status()
-        mp = r.json()
-        # estructura: {"0":{"cik_str":320193,"ticker":"AAPL","title":"Apple Inc."}, ...}
-        target = None
-        for obj in mp.values():
-            if (obj.get("ticker") or "").upper() == company.ticker.upper():
-                target = obj
-                break
-        if not target:
+        if not replay:
+            refresh_cik_index(client=client)
+        cik = lookup_cik(cik_index if cik_index is not None else cik_map(), company.ticker)
+        if not cik:
             raise CommandError(f"No encontré CIK para {company.ticker}")
-        cik = str(target["cik_str"])
         company.cik = cik
         company.save(update_fields=["cik"])
         logger(f"  CIK guardado: {cik}")
-        time.sleep(sleep)
 
     cik10 = _pad_cik(cik)
     url = SEC_FACTS_URL_TMPL.format(cik10=cik10)
-    r = requests.get(url, headers=_ua(), timeout=60)
-    r.raise_for_status()
-    facts = r.json().get("facts") or {}
+    facts = _get_json(client, url, cik10, "companyfacts", archive, replay, replay_date).get("facts") or {}
 
     cutoff = dt.date.today() - dt.timedelta(days=int(years) * 365)
 
-    # Packed por fecha de fin: para IS y BS
-    packed_is = {}  # end_date -> payload dict
-    packed_bs = {}
+    packed_is, packed_bs = pack_facts(facts, cutoff)
 
-    for mykey, tag_list in TAGS.items():
-        preferred = PREFERRED_UNITS.get(mykey, set())
-        points = []
-        # buscamos el primer tag que tenga datos
-        for tag in tag_list:
-            pts = _pull_tag_points(facts, tag, preferred)
-            if pts:
-                points = pts
-                break
-        if not points:
-            continue
-
-        for end, val in points:
-            if end < cutoff:
-                continue
-            # decidir si es IS (duration) o BS (instant)
-            # Heurística: acciones y deudas son típicamente instantes (BS),
-            # EPS/Revenue/NetIncome/EBITDA durations (IS)
-            if mykey in {"CashAndCashEquivalents", "ShortTermDebt", "LongTermDebt", "CommonStockSharesOutstanding"}:
-                _attach(packed_bs, end, mykey, val)
-            else:
-                _attach(packed_is, end, mykey, val)
-
-    created, updated = 0, 0
-    # Guardar IS trimestral
-    with transaction.atomic():
-        for end, payload in packed_is.items():
-            obj, was_created = Statement.objects.update_or_create(
-                company=company,
-                statement_type="IS",
-                period_type="Q",
-                period_end=end,
-                defaults={"json_payload": payload},
-            )
-            if not was_created:
-                # merge: conservar campos previos si existen y agregar nuevos
-                data = obj.json_payload or {}
-                data.update(payload)
-                obj.json_payload = data
-                obj.save(update_fields=["json_payload"])
-                updated += 1
-            else:
-                created += 1
-
-        # Guardar BS trimestral (instant)
-        for end, payload in packed_bs.items():
-            obj, was_created = Statement.objects.update_or_create(
-                company=company,
-                statement_type="BS",
-                period_type="Q",
-                period_end=end,
-                defaults={"json_payload": payload},
-            )
-            if not was_created:
-                data = obj.json_payload or {}
-                data.update(payload)
-                obj.json_payload = data
-                obj.save(update_fields=["json_payload"])
-                updated += 1
-            else:
-                created += 1
+    # Guardar IS/BS trimestral (merge con lo existente + StatementFact)
+    rows = [(company.id, "IS", "Q", end, payload) for end, payload in packed_is.items()]
+    rows += [(company.id, "BS", "Q", end, payload) for end, payload in packed_bs.items()]
+    created, updated = upsert_statements(rows)
 
     logger(f"  IS/BS guardados — nuevos: {created}, actualizados: {updated}")
+    if created or updated:
+        mark_dirty([company.id], "statements")
 
 
 # --------------------------------------------------------------------------------------
@@ -288,12 +77,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--tickers", nargs="*", help="Limitar a ciertos tickers (AAPL MSFT ...)")
         parser.add_argument("--years", type=int, default=10, help="Años hacia atrás (default 10)")
-        parser.add_argument("--sleep", type=float, default=0.25, help="Pausa entre requests (seg)")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Pausa extra entre compañías (seg)")
+        parser.add_argument("--rate", type=float, default=None,
+                            help="Máximo de requests/seg (default settings.VENDOR_RATE_LIMITS['sec'] / SEC_RATE_LIMIT)")
+        parser.add_argument("--replay", action="store_true",
+                            help="Re-ingesta desde el archivo local de respuestas crudas (sin red)")
+        parser.add_argument("--replay-date", type=dt.date.fromisoformat, default=None,
+                            help="Con --replay: usar la descarga más reciente hasta esta fecha (YYYY-MM-DD)")
 
     def handle(self, *args, **opts):
         tickers = [t.upper() for t in (opts.get("tickers") or [])]
         years = int(opts.get("years") or 10)
-        sleep = float(opts.get("sleep") or 0.25)
+        sleep = float(opts.get("sleep") or 0)
 
         qs = Company.objects.all()
         if tickers:
@@ -302,12 +97,23 @@ class Command(BaseCommand):
         if not qs.exists():
             raise CommandError("No hay compañías que procesar. Crea Company o usa --tickers.")
 
+        replay = bool(opts.get("replay"))
+        client = None if replay else VendorClient("sec", headers=_ua(), rate=opts.get("rate"))
+        archive = PayloadArchive()
+
+        # CIKs faltantes: una resolución en bloque contra el índice local
+        n = backfill_ciks(qs, refresh=not replay, client=client)
+        if n:
+            self.stdout.write(f"CIK resueltos desde el índice local: {n}")
+
         self.stdout.write(self.style.NOTICE(f"Procesando {qs.count()} compañías (últimos {years} años)"))
         for c in qs:
             self.stdout.write(f"[{c.ticker}]")
             try:
-                ingest_company(c, years=years, sleep=sleep, logger=self.stdout.write)
+                ingest_company(c, years=years, sleep=sleep, logger=self.stdout.write, client=client,
+                               archive=archive, replay=replay, replay_date=opts.get("replay_date"))
             except Exception as e:
                 self.stderr.write(f"  error: {e}")
-            time.sleep(sleep)  # cortesía
+            if sleep and not replay:
+                time.sleep(sleep)  # cortesía
         self.stdout.write(self.style.SUCCESS("Ingesta completada."))
@@ -1,13 +1,35 @@
 from django.core.management.base import BaseCommand
 from companies.models import Company
-from fundamentals.services import compute_metrics_for_company
+from core.parallel import add_parallel_arguments, run_chunks, shard_ids
+from fundamentals.services import MetricWriter, compute_metrics_for_company
+
+
+def _compute_chunk(company_ids):
+    errors = []
+    with MetricWriter() as writer:
+        for c in Company.objects.filter(id__in=company_ids).order_by("id"):
+            try:
+                compute_metrics_for_company(c, writer)
+            except Exception as e:
+                errors.append(f"{c.ticker}: {e}")
+    return {"inserted": writer.inserted, "updated": writer.updated, "skipped": writer.skipped,
+            "errors": errors}
+
 
 class Command(BaseCommand):
     help = "Compute QoQ, YoY, and TTM metrics for all companies."
 
-    def handle(self, *args, **kwargs):
-        n = 0
-        for c in Company.objects.all():
-            compute_metrics_for_company(c)
-            n += 1
-        self.stdout.write(self.style.SUCCESS(f"Metrics computed for {n} companies"))
+    def add_arguments(self, parser):
+        add_parallel_arguments(parser)
+
+    def handle(self, *args, **opts):
+        ids = shard_ids(Company.objects.order_by("id").values_list("id", flat=True), opts.get("shard"))
+
+        def progress(done, total, part):
+            for err in part.get("errors", []):
+                self.stderr.write(f"  {err}")
+
+        t = run_chunks(_compute_chunk, ids, workers=opts["workers"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Metrics computed for {len(ids)} companies (inserted: {t.get('inserted', 0)}, "
+            f"updated: {t.get('updated', 0)}, unchanged: {t.get('skipped', 0)})"))
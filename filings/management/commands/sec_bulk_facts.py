@@ -0,0 +1,160 @@
+# filings/management/commands/sec_bulk_facts.py
+"""
+Carga masiva de estados IS/BS trimestrales desde el archivo nocturno de la SEC
+`companyfacts.zip` (https://www.sec.gov/Archives/edgar/daily-index/xbrl/companyfacts.zip)
+ya descargado en disco.
+
+- Recorre el zip miembro a miembro (CIK##########.json) sin extraerlo: en
+  memoria sólo vive el JSON de una compañía por proceso. El zip se abre una
+  vez (por worker) y nunca hay más de workers*IN_FLIGHT parseos pendientes.
+- Sólo parsea los miembros de compañías con CIK en nuestra tabla Company.
+- Aplica el mismo mapeo TAGS/PREFERRED_UNITS que ingest_sec (filings/sec.py).
+- Escribe en Statement con upserts por lotes (fundamentals.services.upsert_statements).
+
+Ejemplo:
+  python manage.py sec_bulk_facts /data/companyfacts.zip --years 10 --workers 4
+"""
+import datetime as dt
+import json
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from companies.services import backfill_ciks
+from core.watermarks import mark_dirty
+from filings.sec import _pad_cik, pack_facts
+from fundamentals.services import upsert_statements
+
+MEMBER_RE = re.compile(r"CIK(\d{10})\.json$")
+IN_FLIGHT = 4  # parseos pendientes por worker (acota memoria y resultados sin leer)
+
+# zip abierto por _init_worker: leer el directorio central (~18k entradas)
+# una vez por proceso, no una vez por miembro
+_worker_zip = {}
+
+
+def _init_worker(path):
+    _worker_zip["zf"] = zipfile.ZipFile(path)
+
+
+def _parse_member(zf, name, cutoff):
+    """Parsea un miembro del zip abierto -> (packed_is, packed_bs)."""
+    with zf.open(name) as fh:
+        facts = (json.load(fh) or {}).get("facts") or {}
+    return pack_facts(facts, cutoff)
+
+
+def _parse_in_worker(name, cutoff):
+    return _parse_member(_worker_zip["zf"], name, cutoff)
+
+
+def _iter_parsed(path, members, cutoff, workers=1):
+    """
+    (compañía, (packed_is, packed_bs) | Exception) en el orden de `members`.
+    En paralelo, como mucho workers*IN_FLIGHT miembros enviados sin consumir.
+    """
+    if workers <= 1:
+        with zipfile.ZipFile(path) as zf:
+            for name, c in members:
+                try:
+                    yield c, _parse_member(zf, name, cutoff)
+                except Exception as e:
+                    yield c, e
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,))
+    try:
+        todo = iter(members)
+        pending = deque((c, pool.submit(_parse_in_worker, name, cutoff))
+                        for name, c in islice(todo, workers * IN_FLIGHT))
+        while pending:
+            c, fut = pending.popleft()
+            for name, nxt in islice(todo, 1):
+                pending.append((nxt, pool.submit(_parse_in_worker, name, cutoff)))
+            try:
+                yield c, fut.result()
+            except Exception as e:
+                yield c, e
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+class Command(BaseCommand):
+    help = "Carga masiva de IS/BS trimestrales desde companyfacts.zip (SEC) a Statement."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Ruta local a companyfacts.zip")
+        parser.add_argument("--tickers", nargs="*", help="Limitar a ciertos tickers")
+        parser.add_argument("--years", type=int, default=10, help="Años hacia atrás (default 10)")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Procesos para parsear JSON en paralelo (default 1)")
+        parser.add_argument("--batch-size", type=int, default=200,
+                            help="Compañías por lote de escritura (default 200)")
+
+    def handle(self, *args, **opts):
+        path = opts["path"]
+        if not zipfile.is_zipfile(path):
+            raise CommandError(f"No es un zip válido: {path}")
+
+        qs = Company.objects.all()
+        if opts.get("tickers"):
+            qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
+        # Resolver CIKs faltantes con el índice local (sin red: esta carga es offline)
+        backfill_ciks(qs, refresh=False)
+        qs = qs.exclude(cik__isnull=True).exclude(cik="")
+        by_cik = {_pad_cik(c.cik): c for c in qs.only("id", "ticker", "cik")}
+        if not by_cik:
+            raise CommandError("No hay compañías con CIK. Corre backfill_cik primero.")
+
+        cutoff = dt.date.today() - dt.timedelta(days=int(opts["years"]) * 365)
+        batch_size = max(1, int(opts["batch_size"]))
+        workers = max(1, int(opts["workers"]))
+
+        with zipfile.ZipFile(path) as zf:
+            members = []
+            for name in zf.namelist():
+                m = MEMBER_RE.search(name)
+                if m and m.group(1) in by_cik:
+                    members.append((name, by_cik[m.group(1)]))
+        self.stdout.write(self.style.NOTICE(
+            f"{len(members)} de {len(by_cik)} compañías presentes en {path}"))
+
+        created = updated = done = 0
+        rows = []
+
+        def flush():
+            nonlocal created, updated
+            c, u = upsert_statements(rows)
+            created += c
+            updated += u
+            mark_dirty({r[0] for r in rows}, "statements")
+            rows.clear()
+
+        def collect(company, packed):
+            packed_is, packed_bs = packed
+            for st, packed_st in (("IS", packed_is), ("BS", packed_bs)):
+                for end, payload in packed_st.items():
+                    rows.append((company.id, st, "Q", end, payload))
+
+        parsed = _iter_parsed(path, members, cutoff, workers)
+        try:
+            for c, packed in parsed:
+                if isinstance(packed, Exception):
+                    self.stderr.write(f"  {c.ticker}: error parseando ({packed})")
+                    continue
+                collect(c, packed)
+                done += 1
+                if done % batch_size == 0:
+                    flush()
+                    self.stdout.write(f"  {done}/{len(members)} compañías")
+            flush()
+        finally:
+            parsed.close()  # cierra el zip / apaga el pool si cortamos antes
+
+        self.stdout.write(self.style.SUCCESS(
+            f"companyfacts: {done} compañías — nuevos: {created}, actualizados: {updated}"))
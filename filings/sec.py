@@ -0,0 +1,214 @@
+# filings/sec.py
+"""
+Mapeo SEC XBRL CompanyFacts -> payloads de Statement (IS/BS trimestrales).
+
+Compartido por el ingest por compañía (API CompanyFacts) y por la carga masiva
+desde companyfacts.zip (`sec_bulk_facts`). Sin dependencias de modelos, para
+poder usarse en procesos worker.
+"""
+import os
+import math
+import datetime as dt
+
+from django.core.management.base import CommandError
+
+# --------------------------------------------------------------------------------------
+# CONFIG
+# --------------------------------------------------------------------------------------
+SEC_TICKERMAP_URL = "https://www.sec.gov/files/company_tickers.json"
+SEC_FACTS_URL_TMPL = "https://data.sec.gov/api/xbrl/companyfacts/CIK{cik10}.json"
+
+# tags que intentaremos para cada campo de nuestro payload
+USGAAP = "us-gaap"
+TAGS = {
+    # Income Statement (durations)
+    "Revenue": [
+        "RevenueFromContractWithCustomerExcludingAssessedTax",
+        "SalesRevenueNet",
+        "Revenue",
+        "Revenues",
+        "SalesRevenueGoodsNet",
+    ],
+    "NetIncome": [
+        "NetIncomeLoss",
+        "ProfitLoss",
+    ],
+    "EPS": [
+        "EarningsPerShareDiluted",
+        "EarningsPerShareBasicAndDiluted",
+        "EarningsPerShareBasic",
+    ],
+    "EBITDA": [
+        "EarningsBeforeInterestTaxesDepreciationAndAmortization",
+        # Si no existe, podríamos aproximar en otra versión sumando OperatingIncome + D&A
+    ],
+
+    # Balance Sheet (instants)
+    "CashAndCashEquivalents": [
+        "CashAndCashEquivalentsAtCarryingValue",
+        "CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents",
+    ],
+    "ShortTermDebt": [
+        "DebtCurrent",
+        "ShortTermBorrowings",
+    ],
+    "LongTermDebt": [
+        "LongTermDebtNoncurrent",
+        "LongTermBorrowings",
+        "LongTermDebt",
+    ],
+    "CommonStockSharesOutstanding": [
+        "CommonStockSharesOutstanding",
+    ],
+
+    # Shares promedio (durations) — útil para métricas
+    "WeightedAverageShsOutDil": [
+        "WeightedAverageNumberOfDilutedSharesOutstanding",
+        "WeightedAverageNumberOfSharesOutstandingDiluted",
+    ],
+        # Income Statement (durations) – para derivar EBITDA si falta
+    "OperatingIncome": [
+        "OperatingIncomeLoss",
+    ],
+    "DepreciationAndAmortization": [
+        "DepreciationAndAmortization",
+        "DepreciationDepletionAndAmortization",
+        "DepreciationAmortizationAndAccretionNet",
+    ],
+}
+
+# campos que son instantes (van a BS); el resto son durations (IS)
+BS_KEYS = {"CashAndCashEquivalents", "ShortTermDebt", "LongTermDebt", "CommonStockSharesOutstanding"}
+
+# unidades preferidas por campo
+PREFERRED_UNITS = {
+    "Revenue": {"USD"},
+    "NetIncome": {"USD"},
+    "EPS": {"USD/shares"},
+    "EBITDA": {"USD"},
+    "CashAndCashEquivalents": {"USD"},
+    "ShortTermDebt": {"USD"},
+    "LongTermDebt": {"USD"},
+    "CommonStockSharesOutstanding": {"shares"},
+    "WeightedAverageShsOutDil": {"shares"},
+}
+
+# --------------------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------------------
+def _ua():
+    ua = os.getenv("SEC_USER_AGENT")
+    if not ua:
+        raise CommandError(
+            "Define la variable de entorno SEC_USER_AGENT (ej: "
+            "'Finboard/1.0 (Contact: tu_email@example.com)')"
+        )
+    return {"User-Agent": ua}
+
+def _pad_cik(cik: str) -> str:
+    cik = (cik or "").strip()
+    return cik.zfill(10) if cik else ""
+
+def _to_date(s):
+    # SEC usa 'end' como 'YYYY-MM-DD'
+    try:
+        y, m, d = map(int, s.split("-"))
+        return dt.date(y, m, d)
+    except Exception:
+        return None
+
+def _is_quarter_point(p):
+    # Preferimos puntos de trimestre (10-Q) o Q4 (a veces en 10-K)
+    form = (p.get("form") or "").upper()
+    fp = (p.get("fp") or "").upper()  # Q1/Q2/Q3/Q4/FY
+    if form in {"10-Q"}:
+        return True
+    if form in {"10-K"} and fp in {"Q4", "FY"}:
+        return True
+    # Si no viene el form, usar pista por 'fp'
+    return fp in {"Q1", "Q2", "Q3", "Q4"}
+
+def _best_unit(units_dict, preferred: set[str]):
+    """Devuelve el nombre de unidad preferida si existe, sino la primera disponible."""
+    if not isinstance(units_dict, dict):
+        return None
+    if preferred:
+        for u in preferred:
+            if u in units_dict:
+                return u
+    # fallback: primera clave
+    return next(iter(units_dict.keys()), None)
+
+def _select_points(units_dict, preferred_units):
+    """Filtra a quarterly points y devuelve lista [(end_date, value), ...]"""
+    unit_name = _best_unit(units_dict, preferred_units)
+    if not unit_name:
+        return []
+    out = []
+    for p in units_dict[unit_name]:
+        if not _is_quarter_point(p):
+            continue
+        end = _to_date(p.get("end") or "")
+        if not end:
+            continue
+        v = p.get("val")
+        try:
+            fv = float(v)
+        except Exception:
+            continue
+        # descarte NaN/inf
+        if fv is None or math.isnan(fv) or math.isinf(fv):
+            continue
+        out.append((end, fv))
+    # dedupe por end date (nos quedamos con el último por si se repite)
+    dd = {}
+    for d, v in out:
+        dd[d] = v
+    return sorted(dd.items(), key=lambda t: t[0])
+
+def _pull_tag_points(facts, tag_name, preferred_units):
+    """Extrae puntos de un tag us-gaap:tag_name"""
+    try:
+        tag_obj = facts[USGAAP][tag_name]
+    except Exception:
+        return []
+    units = tag_obj.get("units") or {}
+    return _select_points(units, preferred_units)
+
+def _attach(packed, end_date, key, value):
+    d = packed.setdefault(end_date, {})
+    d[key] = value
+
+
+def pack_facts(facts, cutoff=None):
+    """
+    facts (dict 'facts' de CompanyFacts) -> (packed_is, packed_bs),
+    cada uno {end_date: {campo: valor}}. Ignora puntos anteriores a cutoff.
+    """
+    # Packed por fecha de fin: para IS y BS
+    packed_is = {}  # end_date -> payload dict
+    packed_bs = {}
+
+    for mykey, tag_list in TAGS.items():
+        preferred = PREFERRED_UNITS.get(mykey, set())
+        points = []
+        # buscamos el primer tag que tenga datos
+        for tag in tag_list:
+            pts = _pull_tag_points(facts, tag, preferred)
+            if pts:
+                points = pts
+                break
+        if not points:
+            continue
+
+        for end, val in points:
+            if cutoff and end < cutoff:
+                continue
+            # decidir si es IS (duration) o BS (instant)
+            # Heurística: acciones y deudas son típicamente instantes (BS),
+            # EPS/Revenue/NetIncome/EBITDA durations (IS)
+            if mykey in BS_KEYS:
+                _attach(packed_bs, end, mykey, val)
+            else:
+                _attach(packed_is, end, mykey, val)
+    return packed_is, packed_bs
@@ -1,3 +1,64 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from companies.models import Company
+from filings.management.commands import sec_bulk_facts
+from filings.sec import pack_facts
+from fundamentals.models import Statement
+
+
+def _facts(revenue):
+    points = [{"end": f"2024-{m:02d}-{d}", "val": revenue * m, "form": "10-Q", "fp": f"Q{m // 3}"}
+              for m, d in ((3, 31), (6, 30), (9, 30))]
+    return {"us-gaap": {"Revenues": {"units": {"USD": points}}}}
+
+
+def _write_zip(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, body in members.items():
+            zf.writestr(name, body if isinstance(body, str) else json.dumps({"facts": body}))
+
+
+class IterParsedTests(SimpleTestCase):
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp()) / "companyfacts.zip"
+        self.facts = {f"CIK{i:010d}.json": _facts(100.0 * i) for i in range(1, 13)}
+        _write_zip(self.path, {**self.facts, "CIK0000000099.json": "{roto"})
+        self.members = [(name, name) for name in [*self.facts, "CIK0000000099.json"]]
+
+    def _check(self, got):
+        self.assertEqual([c for c, _ in got], [c for _, c in self.members])  # orden de entrada
+        for name, packed in got[:-1]:
+            self.assertEqual(packed, pack_facts(self.facts[name]))
+        self.assertIsInstance(got[-1][1], Exception)
+
+    def test_serial_opens_archive_once(self):
+        with mock.patch.object(sec_bulk_facts.zipfile, "ZipFile", wraps=zipfile.ZipFile) as opened:
+            got = list(sec_bulk_facts._iter_parsed(self.path, self.members, None))
+        self.assertEqual(opened.call_count, 1)
+        self._check(got)
+
+    def test_parallel_matches_serial(self):
+        with mock.patch.object(sec_bulk_facts, "IN_FLIGHT", 1):  # más miembros que huecos en vuelo
+            self._check(list(sec_bulk_facts._iter_parsed(self.path, self.members, None, workers=2)))
+
+
+class SecBulkFactsCommandTests(TestCase):
+    def test_loads_statements_for_known_ciks(self):
+        a = Company.objects.create(ticker="AAA", name="A", cik="1")
+        b = Company.objects.create(ticker="BBB", name="B", cik="0000000002")
+        path = Path(tempfile.mkdtemp()) / "companyfacts.zip"
+        _write_zip(path, {"CIK0000000001.json": _facts(10.0), "CIK0000000002.json": _facts(20.0),
+                          "CIK0000000003.json": _facts(30.0)})  # sin compañía: se ignora
+        out = io.StringIO()
+        call_command("sec_bulk_facts", str(path), "--years", "100", "--batch-size", "1", stdout=out)
+        self.assertIn("2 compañías", out.getvalue())
+        self.assertEqual(Statement.objects.filter(company=a).count(), 3)
+        self.assertEqual(Statement.objects.filter(company=b, statement_type="IS").count(), 3)
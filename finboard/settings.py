@@ -180,4 +180,34 @@ if REDIS_URL:
 else:
     CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
+# Cachés de vistas versionadas por datos (ver core/cache.py): la página vive
+# mientras no cambie la versión; la versión leída se recachea cada N seg
+# (con LocMemCache es lo que tardan otros procesos en ver un bump).
+VERSIONED_CACHE_TTL = int(os.getenv("VERSIONED_CACHE_TTL", 7 * 24 * 3600))
+DATA_VERSION_TTL = int(os.getenv("DATA_VERSION_TTL", "5"))
+
 # ---------------------
+
+# -----------------------------------------------------
+# Vendor APIs: límite de requests/seg por proveedor
+# (token bucket compartido vía CACHES, o vía archivos con flock en
+# RATE_LIMIT_DIR si la caché es por proceso; ver core/ratelimit.py)
+# -----------------------------------------------------
+VENDOR_RATE_LIMITS = {
+    "eodhd": float(os.getenv("EODHD_RATE_LIMIT", "15")),
+    "fmp": float(os.getenv("FMP_RATE_LIMIT", "5")),
+    "sec": float(os.getenv("SEC_RATE_LIMIT", "9")),  # SEC fair access: máx. 10 req/s
+}
+RATE_LIMIT_DIR = Path(os.getenv("RATE_LIMIT_DIR", BASE_DIR / "var" / "ratelimit"))
+
+# Archivo local de respuestas crudas de proveedores (ver core/archive.py)
+RAW_ARCHIVE_DIR = Path(os.getenv("RAW_ARCHIVE_DIR", BASE_DIR / "var" / "raw"))
+
+# Corridas de ranking que se conservan por slug (ver rankings/engine.py)
+RANKING_RUNS_KEEP = int(os.getenv("RANKING_RUNS_KEEP", "30"))
+
+# Panel de cierres mmap derivado de PriceBar (ver marketdata/panel.py)
+PRICE_PANEL_DIR = Path(os.getenv("PRICE_PANEL_DIR", BASE_DIR / "var" / "panel"))
+
+# Índice local ticker -> CIK (companies.TickerCik): días antes de re-descargar
+SEC_CIK_INDEX_TTL_DAYS = int(os.getenv("SEC_CIK_INDEX_TTL_DAYS", "7"))
@@ -11,6 +11,7 @@ from api.views import (
     CompanyRevenueChart,
     CompanyPriceChart,
     MetricSeriesByTicker,
+    MetricsAsOf,
     MetricsLatestByTicker,
     PERanking,
     Screener,
@@ -40,6 +41,7 @@ urlpatterns = [
     path("api/", include(router.urls)),
     path("api/charts/<str:ticker>/revenue/", CompanyRevenueChart.as_view(), name="company-revenue-chart"),
     path("api/charts/<str:ticker>/price/", CompanyPriceChart.as_view(), name="company-price-chart"),
+    path("api/metrics/asof/", MetricsAsOf.as_view(), name="metrics-asof"),
     path("api/metrics/<str:ticker>/latest/", MetricsLatestByTicker.as_view(), name="metrics-latest-by-ticker"),
     path("api/rankings/pe/", PERanking.as_view(), name="pe-ranking"),
     path("api/screener/", Screener.as_view(), name="screener-api"),  # nombre distinto al HTML para evitar colisión
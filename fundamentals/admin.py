@@ -1,4 +1,6 @@
 from django.contrib import admin
-from .models import Statement, Metric
+from .models import Statement, Metric, LatestMetric, StatementFact
 admin.site.register(Statement)
 admin.site.register(Metric)
+admin.site.register(StatementFact)
+admin.site.register(LatestMetric)
@@ -0,0 +1,194 @@
+"""
+Point-in-time ("as of date D") metric queries.
+
+Per metric key, the index holds every company's history as flat arrays
+sorted by (company, date), packed into int64 search codes
+(company position << 32 | day number). One searchsorted over N query codes
+answers "value of every company as of D" -- the same lookup runs over a
+whole (dates x companies) grid for backtests.
+
+Technical keys read the daily TechnicalBar series (Metric keeps only their
+latest value). Indexes are built lazily per key and cached per process
+(at most MAX_INDEXES, least recently used evicted), rebuilt when the global
+data version (core.cache) changes. Only keys that exist (known_keys) are
+indexed: unknown ones come back empty without touching the cache.
+"""
+import datetime as dt
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from core.cache import data_version
+from fundamentals.models import LatestMetric, Metric
+from marketdata.models import TechnicalBar
+from marketdata.technicals import TECH_FIELDS
+
+_DAY_OFFSET = 1 << 31  # keeps pre-1970 day numbers positive in the packed codes
+
+MAX_INDEXES = 64  # each holds a key's full history across companies
+
+_lock = threading.Lock()
+_cache = {"stamp": None, "keys": OrderedDict(), "known": None}
+
+
+def _codes(pos, dates):
+    return (pos.astype(np.int64) << 32) | (dates.astype("datetime64[D]").astype(np.int64) + _DAY_OFFSET)
+
+
+def _search(codes, pos, qpos, when):
+    """
+    Row index k of the last row <= when[d] of company position qpos[n], for the
+    (D*N) grid, and the mask of grid cells that have one.
+    """
+    D, N = len(when), len(qpos)
+    qpos = np.tile(qpos, D)
+    k = np.searchsorted(codes, _codes(qpos, np.repeat(when, N)), side="right") - 1
+    ok = k >= 0
+    ok[ok] = pos[k[ok]] == qpos[ok]  # hit belongs to the queried company
+    return k, ok
+
+
+def asof_matrix(cids, dates, values, ids, when):
+    """
+    (D, N) values and source dates: for each when[d] and company ids[n]
+    (ascending), the last row with date <= when[d]. Rows must be sorted by
+    (company_id, date); among equal dates the last row wins.
+    """
+    when = np.atleast_1d(np.asarray(when, dtype="datetime64[D]"))
+    D, N = len(when), len(ids)
+    out = np.full(D * N, np.nan)
+    src = np.full(D * N, np.datetime64("NaT"), dtype="datetime64[D]")
+    if N and len(cids):
+        pos = np.searchsorted(ids, cids)
+        known = (pos < N) & (ids[np.minimum(pos, N - 1)] == cids)
+        pos, dates, values = pos[known], dates[known], values[known]
+        k, ok = _search(_codes(pos, dates), pos, np.arange(N), when)
+        out[ok] = values[k[ok]]
+        src[ok] = dates[k[ok]]
+    return out.reshape(D, N), src.reshape(D, N)
+
+
+def load_points(keys, company_ids=None, lag_days=0):
+    """
+    {key: (cids, dates, values)} sorted by (company, date): Metric rows by
+    period_end (+ lag_days), TechnicalBar for technical keys. One query per source.
+    """
+    out = {}
+    metric_keys = [k for k in keys if k not in TECH_FIELDS]
+    tech_keys = [k for k in keys if k in TECH_FIELDS]
+    if metric_keys:
+        qs = Metric.objects.filter(key__in=metric_keys, value__isnull=False)
+        if company_ids is not None:
+            qs = qs.filter(company_id__in=list(company_ids))
+        buf = {k: ([], [], []) for k in metric_keys}
+        for key, cid, pe, v in (qs.order_by("key", "company_id", "period_end", "id")
+                                .values_list("key", "company_id", "period_end", "value")
+                                .iterator(chunk_size=20000)):
+            b = buf[key]
+            b[0].append(cid)
+            b[1].append(pe)
+            b[2].append(float(v))
+        lag = np.timedelta64(int(lag_days), "D")
+        for k, (c, d, v) in buf.items():
+            out[k] = (np.asarray(c, dtype=np.int64), np.asarray(d, dtype="datetime64[D]") + lag,
+                      np.asarray(v, dtype=np.float64))
+    if tech_keys:
+        fields = [TECH_FIELDS[k] for k in tech_keys]
+        qs = TechnicalBar.objects.all()
+        if company_ids is not None:
+            qs = qs.filter(company_id__in=list(company_ids))
+        rows = list(qs.order_by("company_id", "date").values_list("company_id", "date", *fields))
+        cids = np.array([r[0] for r in rows], dtype=np.int64)
+        dates = np.array([r[1] for r in rows], dtype="datetime64[D]")
+        for n, k in enumerate(tech_keys):
+            vals = np.array([r[2 + n] for r in rows], dtype=np.float64)
+            ok = ~np.isnan(vals)
+            out[k] = (cids[ok], dates[ok], vals[ok])
+    return out
+
+
+class KeyIndex:
+    """
+    Full history of one key: companies in `ids`, rows sorted by (company, date)
+    with their packed search codes built once, so a cross-section costs one
+    searchsorted per requested company.
+    """
+
+    def __init__(self, cids, dates, values):
+        self.dates, self.values = dates, values
+        self.ids = np.unique(cids)
+        self.pos = np.searchsorted(self.ids, cids)
+        self.codes = _codes(self.pos, dates)
+
+    def cross_section(self, when, company_ids=None):
+        """(ids, values, dates) as of `when`; companies with no row yet are dropped."""
+        if company_ids is None:
+            ids, qpos = self.ids, np.arange(len(self.ids))
+        else:
+            ids = np.unique(np.asarray(list(company_ids), dtype=np.int64))
+            ids = ids[np.isin(ids, self.ids)]
+            qpos = np.searchsorted(self.ids, ids)
+        if not len(ids):
+            return ids, np.empty(0), np.empty(0, dtype="datetime64[D]")
+        k, ok = _search(self.codes, self.pos, qpos, np.atleast_1d(np.datetime64(when, "D")))
+        k = k[ok]
+        return ids[ok], self.values[k], self.dates[k]
+
+
+def _state(stamp):
+    """Per-process cache for `stamp` (call with _lock held); reset after a version bump."""
+    if _cache["stamp"] != stamp:
+        _cache.update(stamp=stamp, keys=OrderedDict(), known=None)
+    return _cache
+
+
+def known_keys():
+    """Metric keys with at least one value (LatestMetric has one row per company/key) plus technicals."""
+    stamp = data_version()
+    with _lock:
+        known = _state(stamp)["known"]
+    if known is None:
+        known = frozenset(LatestMetric.objects.values_list("key", flat=True).distinct()) | frozenset(TECH_FIELDS)
+        with _lock:
+            if _cache["stamp"] == stamp:
+                _cache["known"] = known
+    return known
+
+
+def key_index(key):
+    """Cached KeyIndex for `key` (rebuilt after a data version bump)."""
+    stamp = data_version()
+    with _lock:
+        keys = _state(stamp)["keys"]
+        idx = keys.get(key)
+        if idx is not None:
+            keys.move_to_end(key)
+            return idx
+    if key not in known_keys():
+        empty = np.array([], dtype=np.int64)
+        return KeyIndex(empty, empty.astype("datetime64[D]"), empty.astype(np.float64))
+    idx = KeyIndex(*load_points([key])[key])
+    with _lock:
+        if _cache["stamp"] == stamp:
+            keys = _cache["keys"]
+            keys[key] = idx
+            while len(keys) > MAX_INDEXES:
+                keys.popitem(last=False)
+    return idx
+
+
+def metrics_asof(when, keys, company_ids=None, with_dates=False):
+    """
+    Cross-section as of `when`: {key: {company_id: value}}, or
+    {key: {company_id: (value, period_end)}} with with_dates=True.
+    """
+    when = np.datetime64(when if isinstance(when, dt.date) else dt.date.fromisoformat(str(when)), "D")
+    out = {}
+    for key in keys:
+        ids, vals, src = key_index(key).cross_section(when, company_ids)
+        if with_dates:
+            out[key] = {cid: (v, d) for cid, v, d in zip(ids.tolist(), vals.tolist(), src.astype("O").tolist())}
+        else:
+            out[key] = dict(zip(ids.tolist(), vals.tolist()))
+    return out
@@ -0,0 +1,164 @@
+"""
+Canonical field registry and the StatementFact table.
+
+Vendors (FMP, SEC, older loaders) name the same concept differently. Aliases
+are resolved once, when a Statement is written, into narrow StatementFact rows
+(company, statement_type, period_type, period_end, field, value), so series
+reads are single indexed range scans with no JSON parsing.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from fundamentals.models import Statement, StatementFact
+
+# canonical field -> payload keys, in priority order (first numeric value wins).
+# Payload keys that are not an alias of anything are stored under their own name.
+FIELD_ALIASES = {
+    "Revenue": ["Revenue", "TotalRevenue", "Revenues"],
+    "NetIncome": ["NetIncome", "NetIncomeLoss", "ProfitLoss"],
+    "EBITDA": ["EBITDA", "Ebitda"],
+    "OperatingIncome": ["OperatingIncome", "OperatingIncomeLoss"],
+    "DepreciationAndAmortization": [
+        "DepreciationAndAmortization",
+        "DepreciationDepletionAndAmortization",
+        "DepreciationAmortizationAndAccretionNet",
+    ],
+    "EPS": [
+        "EPS",
+        "DilutedEPS",
+        "EPS_Diluted",
+        "EarningsPerShareDiluted",
+        "EarningsPerShareBasicAndDiluted",
+        "BasicEPS",
+        "EPS_Basic",
+    ],
+    "WeightedAverageShsOutDil": [
+        "WeightedAverageShsOutDil",
+        "WeightedAverageNumberOfDilutedSharesOutstanding",
+        "WeightedAverageNumberOfSharesOutstandingDiluted",
+    ],
+    "CashAndCashEquivalents": [
+        "CashAndCashEquivalents",
+        "CashAndShortTermInvestments",
+        "CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents",
+    ],
+    "ShortTermDebt": ["ShortTermDebt", "DebtCurrent", "ShortTermBorrowings", "CurrentDebt"],
+    "LongTermDebt": ["LongTermDebt", "LongTermDebtNoncurrent", "LongTermBorrowings"],
+    "CommonStockSharesOutstanding": ["CommonStockSharesOutstanding"],
+}
+_ALIAS_OF = {a: field for field, aliases in FIELD_ALIASES.items() for a in aliases}
+
+
+def canonical(key):
+    """Canonical field name for a payload key (itself if it is not an alias)."""
+    return _ALIAS_OF.get(key, key)
+
+
+def _num(x):
+    try:
+        v = float(x)
+    except (TypeError, ValueError):
+        return None
+    return v if v == v and v not in (float("inf"), float("-inf")) else None
+
+
+def resolve_payload(payload):
+    """json_payload -> {canonical field: float}, aliases resolved by priority."""
+    payload = payload or {}
+    out = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for a in aliases:
+            v = _num(payload.get(a))
+            if v is not None:
+                out[field] = v
+                break
+    for key, raw in payload.items():
+        if key in _ALIAS_OF:
+            continue
+        v = _num(raw)
+        if v is not None:
+            out[key] = v
+    return out
+
+
+def sync_facts(statements, batch_size=2000):
+    """
+    Make the StatementFact rows of saved Statement instances match their
+    payloads: upsert every resolved field and delete the facts of those
+    (company, statement, period) that the payload no longer has. Returns rows written.
+    """
+    facts = {}  # duplicate Statement rows for one period: the later one wins
+    periods = set()
+    for s in statements:
+        periods.add((s.company_id, s.statement_type, s.period_type, s.period_end))
+        for field, value in resolve_payload(s.json_payload).items():
+            key = (s.company_id, s.statement_type, s.period_type, s.period_end, field)
+            facts[key] = value
+    if not periods:
+        return 0
+    stale = [
+        fid for fid, *key in StatementFact.objects
+        .filter(company_id__in={p[0] for p in periods}, statement_type__in={p[1] for p in periods},
+                period_type__in={p[2] for p in periods}, period_end__in={p[3] for p in periods})
+        .values_list("id", "company_id", "statement_type", "period_type", "period_end", "field")
+        .iterator(chunk_size=batch_size)
+        if tuple(key[:4]) in periods and tuple(key) not in facts
+    ]
+    with transaction.atomic():
+        for i in range(0, len(stale), batch_size):
+            StatementFact.objects.filter(id__in=stale[i:i + batch_size]).delete()
+        StatementFact.objects.bulk_create(
+            [StatementFact(company_id=cid, statement_type=st, period_type=pt, period_end=pe, field=f, value=v)
+             for (cid, st, pt, pe, f), v in facts.items()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["company", "statement_type", "period_type", "period_end", "field"],
+            update_fields=["value"],
+        )
+    return len(facts)
+
+
+def fact_series(company_id, field, statement_type="IS", period_type="Q"):
+    """[(period_end, value)] ascending for one canonical field (one index range scan)."""
+    return list(StatementFact.objects
+                .filter(company_id=company_id, field=canonical(field),
+                        statement_type=statement_type, period_type=period_type)
+                .order_by("period_end")
+                .values_list("period_end", "value"))
+
+
+def fact_table(company_id, statement_type, period_type="Q", fields=None):
+    """
+    {period_end: {field: value}} for a company's statements of one type,
+    optionally restricted to some canonical fields. One query.
+    """
+    qs = StatementFact.objects.filter(company_id=company_id, statement_type=statement_type,
+                                      period_type=period_type)
+    if fields is not None:
+        qs = qs.filter(field__in=[canonical(f) for f in fields])
+    out = defaultdict(dict)
+    for pe, field, value in qs.order_by("period_end").values_list("period_end", "field", "value"):
+        out[pe][field] = value
+    return dict(out)
+
+
+def rebuild_facts(company_ids=None, chunk_size=2000):
+    """Recompute StatementFact from Statement.json_payload. Returns rows written."""
+    qs = Statement.objects.order_by("id")
+    old = StatementFact.objects.all()
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+        old = old.filter(company_id__in=list(company_ids))
+    n, buf = 0, []
+    with transaction.atomic():
+        old.delete()
+        for s in (qs.only("company_id", "statement_type", "period_type", "period_end", "json_payload")
+                  .iterator(chunk_size=chunk_size)):
+            buf.append(s)
+            if len(buf) >= chunk_size:
+                n += sync_facts(buf)
+                buf.clear()
+        if buf:
+            n += sync_facts(buf)
+    return n
@@ -2,14 +2,36 @@
 import os
 import time
 import datetime as dt
-import requests
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
 from companies.models import Company
-from fundamentals.models import Statement
+from core.archive import PayloadArchive
+from core.fetch import VendorClient, fetch_concurrently
+from core.watermarks import mark_dirty
+from fundamentals.services import upsert_statements
 
 BASE = "https://financialmodelingprep.com/api/v3"
 
+# statement_type -> (endpoint FMP, {clave payload: campo FMP})
+STATEMENTS = {
+    "IS": ("income-statement", {
+        "Revenue": "revenue",
+        "NetIncome": "netIncome",
+        "EPS": "eps",
+        "EBITDA": "ebitda",
+        "WeightedAverageShsOutDil": "weightedAverageShsOutDil",
+        # Para derivar EBITDA si falta:
+        "OperatingIncome": "operatingIncome",
+        "DepreciationAndAmortization": "depreciationAndAmortization",
+    }),
+    "BS": ("balance-sheet-statement", {
+        "CashAndCashEquivalents": "cashAndCashEquivalents",
+        "ShortTermDebt": "shortTermDebt",
+        "LongTermDebt": "longTermDebt",
+        "CommonStockSharesOutstanding": "commonStockSharesOutstanding",
+    }),
+}
+STATEMENT_NAMES = {"IS": "Income Statement", "BS": "Balance Sheet"}
+
 def _iso(d: str):
     try:
         return dt.date.fromisoformat(d[:10])
@@ -30,13 +52,15 @@ def _norm_symbol(c: Company, suffix: str) -> str:
         sym = f"{sym}{suf}"
     return sym
 
-def _req(url, params, logger):
+def _req(client, url, params, logger, archive=None, archive_key=None):
     try:
-        r = requests.get(url, params=params, timeout=60)
+        r = client.get(url, params=params)
         if r.status_code == 401:
             logger("  401 Unauthorized (API key sin permiso para este endpoint/period).")
             return None, 401
         r.raise_for_status()
+        if archive is not None:
+            archive.put("fmp", *archive_key, r.content)
         js = r.json() or []
         return js, r.status_code
     except Exception as e:
@@ -53,11 +77,19 @@ class Command(BaseCommand):
         parser.add_argument("--period", type=str, default="quarter", choices=["quarter","annual"],
                             help="Periodo de estados (quarter/annual). En demo/free suele permitirse solo 'annual'.")
 
-        parser.add_argument("--sleep", type=float, default=0.2, help="Pausa entre requests (seg)")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Pausa extra entre requests (seg, por hilo)")
+        parser.add_argument("--rate", type=float, default=None,
+                            help="Máximo de requests/seg (default settings.VENDOR_RATE_LIMITS['fmp'] / FMP_RATE_LIMIT)")
+        parser.add_argument("--workers", type=int, default=4, help="Descargas concurrentes (default 4)")
+        parser.add_argument("--replay", action="store_true",
+                            help="Re-ingesta desde el archivo local de respuestas crudas (sin red)")
+        parser.add_argument("--replay-date", type=dt.date.fromisoformat, default=None,
+                            help="Con --replay: usar la descarga más reciente hasta esta fecha (YYYY-MM-DD)")
 
     def handle(self, *args, **opts):
-        api_key = os.getenv("FMP_API_KEY")
-        if not api_key:
+        replay = bool(opts.get("replay"))
+        api_key = os.getenv("FMP_API_KEY") or ""
+        if not api_key and not replay:
             raise CommandError("Falta FMP_API_KEY en el entorno (setx FMP_API_KEY TU_TOKEN)")
 
         years  = int(opts["years"])
@@ -65,7 +97,8 @@ class Command(BaseCommand):
         limit_a = years + 2
         suffix = (opts.get("suffix") or "").strip()
         period = (opts.get("period") or "quarter").lower()
-        sleep  = float(opts.get("sleep") or 0.2)
+        sleep  = float(opts.get("sleep") or 0)
+        workers = max(1, int(opts.get("workers") or 4))
 
         # Si estás en demo/free y pides 'quarter', forzamos a 'annual'
         if api_key.lower() == "demo" and period == "quarter":
@@ -76,82 +109,78 @@ class Command(BaseCommand):
         if opts.get("tickers"):
             qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
 
-        for c in qs:
-            sym = _norm_symbol(c, suffix)
-            lim = limit_q if period == "quarter" else limit_a
-            self.stdout.write(f"[{c.ticker}] {sym} (últimos {years} años, period={period})")
-
-            # --- Income Statement ---
-            url_is = f"{BASE}/income-statement/{sym}"
-            data_is, code_is = _req(url_is, {"period": period, "limit": lim, "apikey": api_key}, self.stderr.write)
-
-            # Fallback: si 401 y estabas pidiendo quarter, reintenta annual
-            if code_is == 401 and period == "quarter":
-                self.stdout.write(self.style.NOTICE("  Reintentando Income Statement con period=annual ..."))
-                data_is, code_is = _req(url_is, {"period": "annual", "limit": limit_a, "apikey": api_key}, self.stderr.write)
-
-            # --- Balance Sheet ---
-            url_bs = f"{BASE}/balance-sheet-statement/{sym}"
-            data_bs, code_bs = _req(url_bs, {"period": period, "limit": lim, "apikey": api_key}, self.stderr.write)
-            if code_bs == 401 and period == "quarter":
-                self.stdout.write(self.style.NOTICE("  Reintentando Balance Sheet con period=annual ..."))
-                data_bs, code_bs = _req(url_bs, {"period": "annual", "limit": limit_a, "apikey": api_key}, self.stderr.write)
-
-            created, updated = 0, 0
-            with transaction.atomic():
-                # ----- IS -----
-                for row in (data_is or []):
-                    d = _iso(row.get("date") or row.get("calendarYear"))
-                    if not d:
-                        continue
-                    payload = {
-                        "Revenue": row.get("revenue"),
-                        "NetIncome": row.get("netIncome"),
-                        "EPS": row.get("eps"),
-                        "EBITDA": row.get("ebitda"),
-                        "WeightedAverageShsOutDil": row.get("weightedAverageShsOutDil"),
-                        # Para derivar EBITDA si falta:
-                        "OperatingIncome": row.get("operatingIncome"),
-                        "DepreciationAndAmortization": row.get("depreciationAndAmortization"),
-                    }
-                    obj, was_created = Statement.objects.update_or_create(
-                        company=c, statement_type="IS", period_type="Q" if period=="quarter" else "Y",
-                        period_end=d, defaults={"json_payload": payload},
-                    )
-                    if not was_created:
-                        data = obj.json_payload or {}
-                        data.update({k: v for k, v in payload.items() if v is not None})
-                        obj.json_payload = data
-                        obj.save(update_fields=["json_payload"])
-                        updated += 1
-                    else:
-                        created += 1
-
-                # ----- BS -----
-                for row in (data_bs or []):
+        lim = limit_q if period == "quarter" else limit_a
+        ptype = "Q" if period == "quarter" else "Y"
+
+        archive = PayloadArchive()
+
+        def replayed(job):
+            """Como fetch(), pero leyendo la última respuesta archivada."""
+            c, st = job
+            sym, endpoint = _norm_symbol(c, suffix), STATEMENTS[st][0]
+            data = archive.latest_json("fmp", sym, f"{endpoint}.{period}", until=opts.get("replay_date"))
+            if data is None and period == "quarter":
+                data = archive.latest_json("fmp", sym, f"{endpoint}.annual", until=opts.get("replay_date"))
+            return data, [] if data is not None else [("err", "  (sin respuestas archivadas)")]
+
+        def fetch(job):
+            """(company, 'IS'|'BS') -> (filas, mensajes). Corre en el pool; sin DB."""
+            c, st = job
+            notes = []
+            sym, endpoint = _norm_symbol(c, suffix), STATEMENTS[st][0]
+            url = f"{BASE}/{endpoint}/{sym}"
+            try:
+                data, code = _req(client, url, {"period": period, "limit": lim, "apikey": api_key},
+                                  lambda m: notes.append(("err", m)),
+                                  archive, (sym, f"{endpoint}.{period}"))
+                # Fallback: si 401 y estabas pidiendo quarter, reintenta annual
+                if code == 401 and period == "quarter":
+                    notes.append(("notice", f"  Reintentando {STATEMENT_NAMES[st]} con period=annual ..."))
+                    data, code = _req(client, url, {"period": "annual", "limit": limit_a, "apikey": api_key},
+                                      lambda m: notes.append(("err", m)),
+                                      archive, (sym, f"{endpoint}.annual"))
+            finally:
+                if sleep:
+                    time.sleep(sleep)
+            return data, notes
+
+        # IS y BS de cada ticker se piden en paralelo; se guarda cuando llegan ambos.
+        companies = list(qs)
+        jobs = [(c, st) for c in companies for st in STATEMENTS]
+        pending = {}
+        touched = set()
+        client = None if replay else VendorClient("fmp", concurrency=workers, rate=opts.get("rate"))
+        for (c, st), res, err in fetch_concurrently(jobs, replayed if replay else fetch, workers=workers):
+            data, notes = res if err is None else (None, [("err", f"  error request: {err}")])
+            got = pending.setdefault(c.id, {"data": {}, "notes": []})
+            got["data"][st] = data
+            got["notes"].extend(notes)
+            if len(got["data"]) < len(STATEMENTS):
+                continue
+            pending.pop(c.id)
+
+            self.stdout.write(f"[{c.ticker}] {_norm_symbol(c, suffix)} (últimos {years} años, period={period})")
+            for level, msg in got["notes"]:
+                if level == "notice":
+                    self.stdout.write(self.style.NOTICE(msg))
+                else:
+                    self.stderr.write(msg)
+
+            rows = []
+            for st, (_, fields) in STATEMENTS.items():
+                for row in (got["data"][st] or []):
                     d = _iso(row.get("date") or row.get("calendarYear"))
                     if not d:
                         continue
-                    payload = {
-                        "CashAndCashEquivalents": row.get("cashAndCashEquivalents"),
-                        "ShortTermDebt": row.get("shortTermDebt"),
-                        "LongTermDebt": row.get("longTermDebt"),
-                        "CommonStockSharesOutstanding": row.get("commonStockSharesOutstanding"),
-                    }
-                    obj, was_created = Statement.objects.update_or_create(
-                        company=c, statement_type="BS", period_type="Q" if period=="quarter" else "Y",
-                        period_end=d, defaults={"json_payload": payload},
-                    )
-                    if not was_created:
-                        data = obj.json_payload or {}
-                        data.update({k: v for k, v in payload.items() if v is not None})
-                        obj.json_payload = data
-                        obj.save(update_fields=["json_payload"])
-                        updated += 1
-                    else:
-                        created += 1
+                    rows.append((c.id, st, ptype, d, {k: row.get(src) for k, src in fields.items()}))
+            # merge con lo existente (gana lo nuevo no nulo) + StatementFact
+            created, updated = upsert_statements(rows)
 
             self.stdout.write(f"  IS/BS: nuevos={created}, actualizados={updated}")
-            time.sleep(sleep)
+            if created or updated:
+                touched.add(c.id)
+        if client:
+            client.close()
+        mark_dirty(touched, "statements")
 
         self.stdout.write(self.style.SUCCESS("FMP fundamentals: ingesta completada"))
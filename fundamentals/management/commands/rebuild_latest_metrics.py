@@ -0,0 +1,20 @@
+# fundamentals/management/commands/rebuild_latest_metrics.py
+"""
+Regenera LatestMetric (último valor por compañía y métrica) desde Metric.
+
+MetricWriter la mantiene al día en cada escritura; esto sirve para la carga
+inicial o si Metric se modificó por fuera del writer.
+
+  python manage.py rebuild_latest_metrics
+"""
+from django.core.management.base import BaseCommand
+
+from fundamentals.services import rebuild_latest_metrics
+
+
+class Command(BaseCommand):
+    help = "Regenera la tabla LatestMetric desde el histórico de Metric."
+
+    def handle(self, *args, **opts):
+        n = rebuild_latest_metrics()
+        self.stdout.write(self.style.SUCCESS(f"LatestMetric regenerada: {n} filas"))
@@ -0,0 +1,30 @@
+# fundamentals/management/commands/rebuild_statement_facts.py
+"""
+Regenera StatementFact desde Statement.json_payload (ver fundamentals/facts.py).
+
+Las ingestas ya mantienen la tabla al día; esto sirve para la carga inicial o
+tras cambiar el registro de alias FIELD_ALIASES.
+
+  python manage.py rebuild_statement_facts
+  python manage.py rebuild_statement_facts --tickers AAPL MSFT
+"""
+from django.core.management.base import BaseCommand
+
+from companies.models import Company
+from fundamentals.facts import rebuild_facts
+
+
+class Command(BaseCommand):
+    help = "Regenera la tabla normalizada StatementFact desde los payloads JSON de Statement."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tickers", nargs="*", help="Limitar a ciertos tickers")
+        parser.add_argument("--chunk", type=int, default=2000, help="Statements por lote (default 2000)")
+
+    def handle(self, *args, **opts):
+        ids = None
+        if opts.get("tickers"):
+            ids = list(Company.objects.filter(ticker__in=[t.upper() for t in opts["tickers"]])
+                       .values_list("id", flat=True))
+        n = rebuild_facts(ids, chunk_size=max(1, int(opts["chunk"])))
+        self.stdout.write(self.style.SUCCESS(f"StatementFact regenerada: {n} filas"))
@@ -12,109 +12,78 @@ Usa:
   - IS (Q): WeightedAverageShsOutDil (acciones promedio diluidas) si existe.
   - PriceBar (D): precio más cercano en o antes de la fecha del trimestre.
 
+Por compañía: 2 lecturas indexadas de StatementFact (IS/BS, alias ya resueltos),
+los cierres desde el panel mmap (o 1 query) con joins as-of por searchsorted,
+y las escrituras de Metric agrupadas en lotes (MetricWriter).
+
 Comandos:
   python manage.py recompute_metrics --tickers AAPL MSFT --verbose
+  python manage.py recompute_metrics --workers 16
+  python manage.py recompute_metrics --workers 16 --shard 0/2   # nodo 1 de 2
+  python manage.py recompute_metrics --full                     # ignora marcas de agua
+
+Por defecto sólo procesa compañías marcadas como sucias por las ingestas
+(core/watermarks.py).
 """
 
-from decimal import Decimal
-from typing import List, Tuple, Optional
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.utils import timezone
 
 from companies.models import Company
-from fundamentals.models import Statement, Metric
-from marketdata.models import PriceBar
+from core.parallel import add_parallel_arguments, run_chunks, shard_ids
+from core.watermarks import dirty_ids, mark_clean
+from fundamentals.facts import fact_table
+from fundamentals.services import MetricWriter
+from marketdata.panel import close_series
+
+# Concepto -> campo canónico de StatementFact (alias resueltos al ingerir, ver fundamentals/facts.py)
+IS_KEYS = {
+    "rev": "Revenue",
+    "ni": "NetIncome",
+    "ebd": "EBITDA",
+    "op": "OperatingIncome",
+    "da": "DepreciationAndAmortization",
+    "shrs_dil": "WeightedAverageShsOutDil",  # (durations) promedio diluido trimestral
+}
+BS_KEYS = {
+    "cash": "CashAndCashEquivalents",
+    "debt_s": "ShortTermDebt",
+    "debt_l": "LongTermDebt",
+    "shrs": "CommonStockSharesOutstanding",
+}
 
 
 # -----------------------------
 # Utilidades
 # -----------------------------
-def _num(x):
-    try:
-        return float(x)
-    except Exception:
-        return None
-
-
-def _series_is(company: Company, key_candidates, limit: int = 40) -> List[Tuple]:
-    """
-    Serie IS trimestral ascendente [(period_end, value), ...]
-    key_candidates: str o lista de claves posibles dentro de json_payload.
-    """
-    if isinstance(key_candidates, str):
-        key_candidates = [key_candidates]
-    qs = (
-        Statement.objects.filter(
-            company=company, statement_type="IS", period_type="Q"
-        )
-        .only("period_end", "json_payload")
-        .order_by("-period_end")[: max(8, limit)]
-    )
-    out = []
-    for s in qs:
-        payload = s.json_payload or {}
-        val = None
-        for k in key_candidates:
-            val = _num(payload.get(k))
-            if val is not None:
-                break
-        if val is not None:
-            out.append((s.period_end, val))
-    return list(reversed(out))  # asc
-
-
-def _series_bs(company: Company, key_candidates, limit: int = 40) -> List[Tuple]:
+def _load_series(company: Company, statement_type: str, groups: Dict[str, str],
+                 limit: int = 40) -> Dict[str, List[Tuple]]:
     """
-    Serie BS trimestral (instantes) ascendente [(period_end, value), ...]
+    {concepto: [(period_end, value), ...]} ascendente de los últimos `limit`
+    trimestres, en una sola lectura indexada de StatementFact.
     """
-    if isinstance(key_candidates, str):
-        key_candidates = [key_candidates]
-    qs = (
-        Statement.objects.filter(
-            company=company, statement_type="BS", period_type="Q"
-        )
-        .only("period_end", "json_payload")
-        .order_by("-period_end")[: max(8, limit)]
-    )
-    out = []
-    for s in qs:
-        payload = s.json_payload or {}
-        val = None
-        for k in key_candidates:
-            val = _num(payload.get(k))
-            if val is not None:
-                break
-        if val is not None:
-            out.append((s.period_end, val))
-    return list(reversed(out))
-
-
-def _nearest_prior(series: List[Tuple], when) -> Optional[float]:
-    """Último valor con fecha <= when en una serie ascendente."""
-    val = None
-    for d, v in series:
-        if d <= when:
-            val = v
-        else:
-            break
-    return val
-
-
-def _price_on_or_prior(company: Company, when):
-    """(date, price) del último PriceBar con fecha <= when."""
-    b = (
-        PriceBar.objects.filter(company=company, date__lte=when)
-        .only("date", "close")
-        .order_by("-date")
-        .first()
-    )
-    if not b:
-        return None, None
-    try:
-        return b.date, float(b.close)
-    except Exception:
-        return None, None
+    table = fact_table(company.id, statement_type, "Q", fields=groups.values())
+    periods = sorted(table)[-max(8, limit):]
+    return {
+        name: [(pe, table[pe][field]) for pe in periods if field in table[pe]]
+        for name, field in groups.items()
+    }
+
+
+def _asof(dates: np.ndarray, values: np.ndarray, when: np.ndarray) -> List[Optional[float]]:
+    """Join as-of por búsqueda binaria: último valor con fecha <= cada `when` (o None)."""
+    idx = np.searchsorted(dates, when, side="right") - 1
+    return [float(values[i]) if i >= 0 else None for i in idx.tolist()]
+
+
+def _asof_series(series: List[Tuple], when: np.ndarray) -> List[Optional[float]]:
+    dates = np.array([d for d, _ in series], dtype="datetime64[D]")
+    values = np.array([v for _, v in series], dtype=np.float64)
+    return _asof(dates, values, when)
 
 
 def _ttm_at(series: List[Tuple], idx: int) -> Optional[float]:
@@ -127,47 +96,26 @@ def _ttm_at(series: List[Tuple], idx: int) -> Optional[float]:
     return float(sum(vals))
 
 
-def _save_upsert(company: Company, key: str, value, period_end, period_type="TTM"):
-    """Upsert por (company, key, period_end, period_type)."""
-    if value is None or period_end is None:
-        return
-    Metric.objects.update_or_create(
-        company=company,
-        key=key,
-        period_end=period_end,
-        period_type=period_type,
-        defaults={"value": Decimal(str(value))},
-    )
-
-
 # -----------------------------
 # Cálculo por compañía (histórico)
 # -----------------------------
-def recompute_historical(company: Company, verbose: bool = False):
+def recompute_historical(company: Company, writer: MetricWriter, log: Optional[List[str]] = None):
     """
     Calcula y PERSISTE series TTM históricas por trimestre:
       Revenue_TTM, NetIncome_TTM, EBITDA_TTM, Revenue_YoY,
       EPS_TTM, PE_TTM, EV_Sales, EV_EBITDA.
-    """
 
-    # ----- Income Statement (durations, trimestrales)
-    rev_q = _series_is(company, ["Revenue", "TotalRevenue", "Revenues"])
-    ni_q = _series_is(company, ["NetIncome", "NetIncomeLoss", "ProfitLoss"])
-
-    # EBITDA directo si existe:
-    ebd_q = _series_is(company, ["EBITDA", "Ebitda"])
+    Lee IS/BS una vez cada uno (StatementFact) y los cierres una vez (panel
+    mmap); las filas van al MetricWriter compartido, que escribe por lotes.
+    Los mensajes de detalle van a `log` (si se da). Devuelve la fecha del
+    último cierre leído (None si no hay cierres).
+    """
+    is_ = _load_series(company, "IS", IS_KEYS)
+    rev_q, ni_q, ebd_q, shrs_dil_q = is_["rev"], is_["ni"], is_["ebd"], is_["shrs_dil"]
 
     # Fallback robusto: EBITDA ≈ OperatingIncome + Depreciation&Amortization
     if not ebd_q or len(ebd_q) < 4:
-        op_q = _series_is(company, ["OperatingIncome", "OperatingIncomeLoss"])
-        da_q = _series_is(
-            company,
-            [
-                "DepreciationAndAmortization",
-                "DepreciationDepletionAndAmortization",
-                "DepreciationAmortizationAndAccretionNet",
-            ],
-        )
+        op_q, da_q = is_["op"], is_["da"]
         if op_q or da_q:
             op_map = dict(op_q)
             da_map = dict(da_q)
@@ -180,143 +128,108 @@ def recompute_historical(company: Company, verbose: bool = False):
                     continue
                 ebd_q.append((d, (o or 0.0) + (a or 0.0)))
 
-    # Diluted EPS series (opcional; la usamos para EPS_TTM si hay shares)
-    eps_q = _series_is(
-        company,
-        [
-            "EPS",
-            "DilutedEPS",
-            "EPS_Diluted",
-            "EarningsPerShareDiluted",
-            "EarningsPerShareBasicAndDiluted",
-            "BasicEPS",
-            "EPS_Basic",
-        ],
-    )
-
-    # ----- Balance Sheet (instantes, trimestrales)
-    cash_q = _series_bs(
-        company,
-        [
-            "CashAndCashEquivalents",
-            "CashAndShortTermInvestments",
-            "CashCashEquivalentsRestrictedCashAndRestrictedCashEquivalents",
-        ],
-    )
-    debt_s_q = _series_bs(
-        company,
-        ["ShortTermDebt", "DebtCurrent", "ShortTermBorrowings", "CurrentDebt"],
-    )
-    debt_l_q = _series_bs(
-        company, ["LongTermDebt", "LongTermDebtNoncurrent", "LongTermBorrowings"]
-    )
-    shrs_q = _series_bs(company, ["CommonStockSharesOutstanding"])
-    # (durations) promedio diluido trimestral
-    shrs_dil_q = _series_is(
-        company,
-        [
-            "WeightedAverageShsOutDil",
-            "WeightedAverageNumberOfDilutedSharesOutstanding",
-            "WeightedAverageNumberOfSharesOutstandingDiluted",
-        ],
-    )
-
+    # cierres primero: su última fecha es la marca de agua de precios (aunque se omita)
+    px_dates, px_closes = close_series(company.id)
+    px_through = px_dates[-1].astype("O") if len(px_dates) else None
     if not rev_q:
-        if verbose:
-            print(f"  {company.ticker}: sin Revenue en IS; omito.")
-        return
-
-    with transaction.atomic():
-        for idx in range(len(rev_q)):
-            date_q = rev_q[idx][0]
-
-            # TTM básicos
-            rev_ttm = _ttm_at(rev_q, idx)
-            ni_ttm = _ttm_at(ni_q, idx) if ni_q else None
-            ebd_ttm = _ttm_at(ebd_q, idx) if ebd_q else None
-
-            # YoY TTM (usando Revenue)
-            yoy = None
-            if idx >= 7:
-                curr4 = sum([rev_q[i][1] for i in range(idx - 3, idx + 1)])
-                prev4 = sum([rev_q[i][1] for i in range(idx - 7, idx - 3)])
-                if prev4:
-                    yoy = (curr4 / prev4) - 1.0
-
-            # Precio y Acciones
-            _, price = _price_on_or_prior(company, date_q)
-            shares = _nearest_prior(shrs_dil_q, date_q) or _nearest_prior(
-                shrs_q, date_q
-            )
-
-            # EPS TTM (si hay NI_TTM y acciones)
-            eps_ttm = None
-            if ni_ttm is not None and shares:
-                eps_ttm = ni_ttm / shares
-
-            # Market Cap & EV
-            mcap = price * shares if (price and shares) else None
-            cash = _nearest_prior(cash_q, date_q) or 0.0
-            debt = ( _nearest_prior(debt_s_q, date_q) or 0.0 ) + (
-                _nearest_prior(debt_l_q, date_q) or 0.0
-            )
-            ev = (mcap or 0.0) + debt - cash
-
-            # Ratios
-            pe_ttm = (price / eps_ttm) if price and eps_ttm not in (None, 0) else None
-            ev_sales = (ev / rev_ttm) if rev_ttm not in (None, 0) else None
-            ev_ebitda = (ev / ebd_ttm) if ebd_ttm not in (None, 0) else None
-
-            # Persistencia (una fila por trimestre)
-            if rev_ttm is not None:
-                _save_upsert(company, "Revenue_TTM", rev_ttm, date_q, "TTM")
-            if ni_ttm is not None:
-                _save_upsert(company, "NetIncome_TTM", ni_ttm, date_q, "TTM")
-            if ebd_ttm is not None:
-                _save_upsert(company, "EBITDA_TTM", ebd_ttm, date_q, "TTM")
-            if yoy is not None:
-                _save_upsert(company, "Revenue_YoY", yoy, date_q, "TTM")
-            if eps_ttm is not None:
-                _save_upsert(company, "EPS_TTM", eps_ttm, date_q, "TTM")
-            if pe_ttm is not None:
-                _save_upsert(company, "PE_TTM", pe_ttm, date_q, "TTM")
-            if ev_sales is not None:
-                _save_upsert(company, "EV_Sales", ev_sales, date_q, "TTM")
-            if ev_ebitda is not None:
-                _save_upsert(company, "EV_EBITDA", ev_ebitda, date_q, "TTM")
+        if log is not None:
+            log.append(f"  {company.ticker}: sin Revenue en IS; omito.")
+        return px_through
+
+    bs = _load_series(company, "BS", BS_KEYS)
+
+    # As-of (fecha <= trimestre) de precio, acciones, caja y deuda para todos los trimestres
+    q_dates = np.array([d for d, _ in rev_q], dtype="datetime64[D]")
+    prices = _asof(px_dates, px_closes, q_dates)
+    shrs_dil_at = _asof_series(shrs_dil_q, q_dates)
+    shrs_at = _asof_series(bs["shrs"], q_dates)
+    cash_at = _asof_series(bs["cash"], q_dates)
+    debt_s_at = _asof_series(bs["debt_s"], q_dates)
+    debt_l_at = _asof_series(bs["debt_l"], q_dates)
+
+    rows = []
+    for idx in range(len(rev_q)):
+        date_q = rev_q[idx][0]
+
+        # TTM básicos
+        rev_ttm = _ttm_at(rev_q, idx)
+        ni_ttm = _ttm_at(ni_q, idx) if ni_q else None
+        ebd_ttm = _ttm_at(ebd_q, idx) if ebd_q else None
+
+        # YoY TTM (usando Revenue)
+        yoy = None
+        if idx >= 7:
+            curr4 = sum([rev_q[i][1] for i in range(idx - 3, idx + 1)])
+            prev4 = sum([rev_q[i][1] for i in range(idx - 7, idx - 3)])
+            if prev4:
+                yoy = (curr4 / prev4) - 1.0
+
+        # Precio y Acciones
+        price = prices[idx]
+        shares = shrs_dil_at[idx] or shrs_at[idx]
+
+        # EPS TTM (si hay NI_TTM y acciones)
+        eps_ttm = None
+        if ni_ttm is not None and shares:
+            eps_ttm = ni_ttm / shares
+
+        # Market Cap & EV
+        mcap = price * shares if (price and shares) else None
+        cash = cash_at[idx] or 0.0
+        debt = (debt_s_at[idx] or 0.0) + (debt_l_at[idx] or 0.0)
+        ev = (mcap or 0.0) + debt - cash
+
+        # Ratios
+        pe_ttm = (price / eps_ttm) if price and eps_ttm not in (None, 0) else None
+        ev_sales = (ev / rev_ttm) if rev_ttm not in (None, 0) else None
+        ev_ebitda = (ev / ebd_ttm) if ebd_ttm not in (None, 0) else None
+
+        # Persistencia (una fila por trimestre)
+        for key, value in (
+            ("Revenue_TTM", rev_ttm),
+            ("NetIncome_TTM", ni_ttm),
+            ("EBITDA_TTM", ebd_ttm),
+            ("Revenue_YoY", yoy),
+            ("EPS_TTM", eps_ttm),
+            ("PE_TTM", pe_ttm),
+            ("EV_Sales", ev_sales),
+            ("EV_EBITDA", ev_ebitda),
+        ):
+            rows.append((company.id, key, date_q, "TTM", value))
 
     # Extras diarios (último precio y marketcap) – útil para otras vistas
-    b = (
-        PriceBar.objects.filter(company=company)
-        .only("date", "close")
-        .order_by("-date")
-        .first()
-    )
-    if b:
-        try:
-            price_last = float(b.close)
-            Metric.objects.update_or_create(
-                company=company,
-                key="Price",
-                period_end=b.date,
-                period_type="D",
-                defaults={"value": Decimal(str(price_last))},
-            )
-            # MarketCap diario con acciones más recientes disponibles
-            shares_last = (shrs_dil_q[-1][1] if shrs_dil_q else None) or (
-                shrs_q[-1][1] if shrs_q else None
-            )
-            if shares_last:
-                mcap_last = price_last * shares_last
-                Metric.objects.update_or_create(
-                    company=company,
-                    key="MarketCap",
-                    period_end=b.date,
-                    period_type="D",
-                    defaults={"value": Decimal(str(mcap_last))},
-                )
-        except Exception:
-            pass
+    if len(px_dates):
+        b_date, price_last = px_dates[-1].astype("O"), float(px_closes[-1])
+        rows.append((company.id, "Price", b_date, "D", price_last))
+        # MarketCap diario con acciones más recientes disponibles
+        shares_last = (shrs_dil_q[-1][1] if shrs_dil_q else None) or (
+            bs["shrs"][-1][1] if bs["shrs"] else None
+        )
+        if shares_last:
+            rows.append((company.id, "MarketCap", b_date, "D", price_last * shares_last))
+
+    writer.add_rows(rows)
+    return px_through
+
+
+def _recompute_chunk(company_ids: List[int], started_at, verbose: bool = False) -> dict:
+    """
+    Lote de compañías (corre en el proceso actual o en un worker de core.parallel).
+    Con verbose, el detalle vuelve en "log" para que el comando lo escriba en su stdout.
+    """
+    errors, through = [], {}
+    log = [] if verbose else None
+    with MetricWriter() as writer:
+        for c in Company.objects.filter(id__in=company_ids).order_by("id"):
+            if verbose:
+                log.append(f"→ {c.ticker}: recomputando histórico TTM ...")
+            try:
+                through[c.id] = recompute_historical(c, writer, log=log)
+            except Exception as e:
+                errors.append(f"{c.ticker}: error {e}")
+    mark_clean("metrics", list(through), started_at, prices_through=through)
+    return {"inserted": writer.inserted, "updated": writer.updated, "skipped": writer.skipped,
+            "errors": errors, "log": log or []}
 
 
 # -----------------------------
@@ -330,18 +243,36 @@ class Command(BaseCommand):
             "--tickers", nargs="*", help="Limitar a ciertos tickers (ej. AAPL MSFT)"
         )
         parser.add_argument("--verbose", action="store_true", help="Log detallado")
+        parser.add_argument("--full", action="store_true",
+                            help="Recalcular todas las compañías, no sólo las marcadas como sucias")
+        add_parallel_arguments(parser)
+        parser.add_argument("--warm-cache", action="store_true",
+                            help="Al terminar, precalentar la caché de páginas (ver warm_cache)")
 
     def handle(self, *args, **opts):
         qs = Company.objects.all()
         if opts.get("tickers"):
             qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
-
-        for c in qs:
-            if opts["verbose"]:
-                self.stdout.write(f"→ {c.ticker}: recomputando histórico TTM ...")
-            try:
-                recompute_historical(c, verbose=opts["verbose"])
-            except Exception as e:
-                self.stderr.write(f"  {c.ticker}: error {e}")
-
-        self.stdout.write(self.style.SUCCESS("Recompute histórico TTM completo."))
+        ids = shard_ids(qs.order_by("id").values_list("id", flat=True), opts.get("shard"))
+        started_at = timezone.now()
+        if not opts.get("full"):
+            # sólo compañías con estados/precios nuevos desde la última corrida
+            n_all, ids = len(ids), dirty_ids("metrics", ids)
+            self.stdout.write(f"{len(ids)} de {n_all} compañías con cambios (usa --full para todas)")
+
+        def progress(done, total, part):
+            for line in part.get("log", []):
+                self.stdout.write(line)
+            for err in part.get("errors", []):
+                self.stderr.write(f"  {err}")
+            if opts["workers"] > 1:
+                self.stdout.write(f"  {done}/{total} compañías")
+
+        t = run_chunks(_recompute_chunk, ids, workers=opts["workers"], progress=progress,
+                       started_at=started_at, verbose=opts["verbose"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recompute histórico TTM completo ({len(ids)} compañías — inserted: {t.get('inserted', 0)}, "
+            f"updated: {t.get('updated', 0)}, unchanged: {t.get('skipped', 0)}, "
+            f"errores: {len(t.get('errors', []))})."))
+        if opts.get("warm_cache"):
+            call_command("warm_cache", stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('fundamentals', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statement_type', models.CharField(choices=[('IS', 'Income'), ('BS', 'Balance'), ('CF', 'Cashflow')], max_length=2)),
+                ('period_type', models.CharField(choices=[('Q', 'Quarter'), ('Y', 'Year')], max_length=1)),
+                ('period_end', models.DateField()),
+                ('field', models.CharField(max_length=128)),
+                ('value', models.FloatField()),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='companies.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'field', 'statement_type', 'period_type', 'period_end'], name='fundamental_company_a0b0ef_idx')],
+                'unique_together': {('company', 'statement_type', 'period_type', 'period_end', 'field')},
+            },
+        ),
+    ]
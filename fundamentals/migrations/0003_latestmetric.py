@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('fundamentals', '0002_statementfact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('value', models.DecimalField(decimal_places=6, max_digits=20)),
+                ('period_end', models.DateField()),
+                ('period_type', models.CharField(choices=[('Q', 'Quarter'), ('TTM', 'TTM')], max_length=4)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='companies.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'company'], name='fundamental_key_3fc820_idx')],
+                'unique_together': {('company', 'key')},
+            },
+        ),
+    ]
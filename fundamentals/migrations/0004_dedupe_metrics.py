@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:23
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+UNIQUE = ("company_id", "key", "period_end", "period_type")
+
+
+def dedupe_metrics(apps, schema_editor):
+    """Deja una fila por (company, key, period_end, period_type): la última escrita (mayor id)."""
+    Metric = apps.get_model("fundamentals", "Metric")
+    LatestMetric = apps.get_model("fundamentals", "LatestMetric")
+    groups = (Metric.objects.values(*UNIQUE)
+              .annotate(n=Count("id"), keep=Max("id")).filter(n__gt=1))
+    touched = set()
+    for g in groups.iterator():
+        Metric.objects.filter(**{f: g[f] for f in UNIQUE}).exclude(id=g["keep"]).delete()
+        touched.add((g["company_id"], g["key"]))
+    # LatestMetric pudo quedar apuntando al valor de una fila borrada
+    for cid, key in touched:
+        m = (Metric.objects.filter(company_id=cid, key=key)
+             .order_by("-period_end", "-period_type").first())
+        LatestMetric.objects.update_or_create(
+            company_id=cid, key=key,
+            defaults={"value": m.value, "period_end": m.period_end, "period_type": m.period_type})
+
+
+# Sólo datos: el UniqueConstraint va en 0005 (misma razón que rankings 0003/0004).
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundamentals', '0003_latestmetric'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_metrics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('fundamentals', '0004_dedupe_metrics'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='metric',
+            constraint=models.UniqueConstraint(fields=('company', 'key', 'period_end', 'period_type'), name='metric_unique_period'),
+        ),
+    ]
@@ -21,3 +21,39 @@ class Metric(models.Model):
 
     class Meta:
         indexes = [models.Index(fields=["company","key","period_end"])]
+        # clave de los upserts de MetricWriter (ON CONFLICT)
+        constraints = [models.UniqueConstraint(fields=["company", "key", "period_end", "period_type"],
+                                               name="metric_unique_period")]
+
+class LatestMetric(models.Model):
+    """
+    Último valor de cada métrica por compañía (mayor period_end), mantenido por
+    MetricWriter en la misma transacción que Metric. Lecturas de corte transversal
+    (screener, P/E) en una sola query.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    value = models.DecimalField(max_digits=20, decimal_places=6)
+    period_end = models.DateField()
+    period_type = models.CharField(max_length=4, choices=Metric.PTYPES)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [("company", "key")]
+        indexes = [models.Index(fields=["key", "company"])]
+
+class StatementFact(models.Model):
+    """
+    Vista normalizada de Statement.json_payload: un valor numérico por fila, con
+    los alias ya resueltos al nombre canónico (fundamentals/facts.py) al escribir.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    statement_type = models.CharField(max_length=2, choices=Statement.ST_TYPES)
+    period_type = models.CharField(max_length=1, choices=Statement.PTYPES)
+    period_end = models.DateField()
+    field = models.CharField(max_length=128)
+    value = models.FloatField()
+
+    class Meta:
+        unique_together = [("company", "statement_type", "period_type", "period_end", "field")]
+        indexes = [models.Index(fields=["company", "field", "statement_type", "period_type", "period_end"])]
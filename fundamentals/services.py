@@ -1,33 +1,233 @@
+import math
+from decimal import Decimal
+
 import pandas as pd
-from fundamentals.models import Statement, Metric
-from marketdata.models import PriceBar
-
-def _safe_df(qs):
-    if not qs.exists(): return None
-    df = pd.DataFrame([{"period_end": s.period_end, **s.json_payload} for s in qs])
-    if df.empty: return None
-    df.set_index("period_end", inplace=True)
-    df.sort_index(inplace=True)
-    for col in df.columns:  # ensure numeric
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+from django.db import transaction
+from core.cache import bump_data_version
+from fundamentals.facts import fact_table, sync_facts
+from fundamentals.models import LatestMetric, Metric, Statement
+from marketdata.panel import last_close
+
+def _facts_df(company, statement_type):
+    # quarterly StatementFact rows -> period_end x canonical field frame
+    table = fact_table(company.id, statement_type, "Q")
+    if not table: return None
+    df = pd.DataFrame.from_dict(table, orient="index").sort_index()
+    df.index.name = "period_end"
     return df
 
 def _last_close(company):
-    last = PriceBar.objects.filter(company=company).order_by("-date").first()
-    return float(last.close) if last else None, (last.date if last else None)
-
-def _write_metric(company, key, period_end, value, ttm=False):
-    if value is None or pd.isna(value): return
-    Metric.objects.update_or_create(
-        company=company, key=key, period_end=period_end,
-        period_type=("TTM" if ttm else "Q"),
-        defaults={"value": float(value)}
-    )
-
-def compute_metrics_for_company(c):
+    d, close = last_close(company.id)
+    return close, d
+
+def _write_metric(writer, company, key, period_end, value, ttm=False):
+    writer.add(company.id, key, period_end, ("TTM" if ttm else "Q"), value)
+
+def upsert_statements(rows, batch_size=1000):
+    """
+    Batched Statement upsert. rows: iterable of
+    (company_id, statement_type, period_type, period_end, payload).
+    Existing rows are merged (new non-null values win) and their StatementFact
+    rows are kept in sync. Returns (created, updated).
+    """
+    incoming = {}
+    for cid, st, pt, pe, payload in rows:
+        key = (cid, st, pt, pe)
+        incoming.setdefault(key, {}).update(payload)
+    if not incoming:
+        return 0, 0
+
+    existing = {}
+    cids = {k[0] for k in incoming}
+    qs = (Statement.objects
+          .filter(company_id__in=cids,
+                  statement_type__in={k[1] for k in incoming},
+                  period_type__in={k[2] for k in incoming})
+          .only("id", "company_id", "statement_type", "period_type", "period_end", "json_payload"))
+    for s in qs.iterator(chunk_size=2000):
+        existing[(s.company_id, s.statement_type, s.period_type, s.period_end)] = s
+
+    to_create, to_update = [], []
+    for key, payload in incoming.items():
+        obj = existing.get(key)
+        if obj is None:
+            cid, st, pt, pe = key
+            to_create.append(Statement(company_id=cid, statement_type=st, period_type=pt,
+                                       period_end=pe, json_payload=payload))
+        else:
+            data = dict(obj.json_payload or {})
+            data.update({k: v for k, v in payload.items() if v is not None})
+            if data != obj.json_payload:
+                obj.json_payload = data
+                to_update.append(obj)
+
+    with transaction.atomic():
+        Statement.objects.bulk_create(to_create, batch_size=batch_size)
+        Statement.objects.bulk_update(to_update, ["json_payload"], batch_size=batch_size)
+        sync_facts(to_create + to_update)
+    return len(to_create), len(to_update)
+
+class MetricWriter:
+    """
+    Buffered, change-aware Metric upserts keyed on
+    (company_id, key, period_end, period_type).
+
+    Rows are buffered and written every `buffer_size` rows (and on flush() /
+    leaving the `with` block): one SELECT for the buffered keys, then chunked
+    INSERT ... ON CONFLICT on the Metric unique constraint, so concurrent
+    writers never duplicate a row. Rows whose stored value already equals the
+    new one (at the column's 6-decimal precision) are skipped. None/NaN/inf
+    values are ignored. Counts: inserted, updated, skipped. LatestMetric is
+    advanced in the same transaction. The data version is bumped once per
+    flush() / `with` block for every company touched, not per buffer.
+    """
+
+    def __init__(self, buffer_size=5000, batch_size=1000):
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.inserted = self.updated = self.skipped = 0
+        self._buf = {}
+        self._touched = set()
+        self._field = Metric._meta.get_field("value")
+        self._quantum = Decimal(1).scaleb(-self._field.decimal_places)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._write()
+        self._bump()  # buffers already written stay written even if the block failed
+
+    def _dec(self, value):
+        return self._field.to_python(value).quantize(self._quantum)
+
+    def add(self, company_id, key, period_end, period_type, value):
+        if value is None or pd.isna(value) or period_end is None or not math.isfinite(value):
+            return
+        self._buf[(company_id, key, period_end, period_type)] = self._dec(float(value))
+        if len(self._buf) >= self.buffer_size:
+            self._write()
+
+    def add_rows(self, rows):
+        """rows: iterable of (company_id, key, period_end, period_type, value)."""
+        for row in rows:
+            self.add(*row)
+
+    def flush(self):
+        """Write the buffer and bump the data version of every company written since the last flush()."""
+        self._write()
+        self._bump()
+
+    def _bump(self):
+        if self._touched:
+            touched, self._touched = self._touched, set()
+            bump_data_version(touched)
+
+    def _write(self):
+        if not self._buf:
+            return
+        incoming, self._buf = self._buf, {}
+        # pre-read only to classify (inserted / updated / skipped); the upsert below is the write
+        qs = (Metric.objects
+              .filter(company_id__in={k[0] for k in incoming},
+                      key__in={k[1] for k in incoming},
+                      period_end__in={k[2] for k in incoming})
+              .values_list("company_id", "key", "period_end", "period_type", "value"))
+        existing = {(cid, key, pe, pt): value for cid, key, pe, pt, value in qs.iterator(chunk_size=2000)}
+
+        changed, n_new = [], 0
+        for (cid, key, pe, pt), value in incoming.items():
+            old = existing.get((cid, key, pe, pt))
+            if old is not None and self._dec(old) == value:
+                self.skipped += 1
+                continue
+            n_new += (cid, key, pe, pt) not in existing
+            changed.append(Metric(company_id=cid, key=key, period_end=pe, period_type=pt, value=value))
+
+        with transaction.atomic():
+            Metric.objects.bulk_create(
+                changed,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=["company", "key", "period_end", "period_type"],
+                update_fields=["value"],
+            )
+            self._sync_latest(changed)
+        self._touched.update(m.company_id for m in changed)
+        self.inserted += n_new
+        self.updated += len(changed) - n_new
+
+    def _sync_latest(self, written):
+        """
+        Advance LatestMetric for (company, key) pairs whose newest row was written.
+        Newest = greatest (period_end, period_type), the same order rebuild_latest_metrics uses.
+        """
+        newest = {}
+        for m in written:
+            k = (m.company_id, m.key)
+            if k not in newest or (m.period_end, m.period_type) >= (newest[k].period_end, newest[k].period_type):
+                newest[k] = m
+        if not newest:
+            return
+        current = dict(
+            ((cid, key), (pe, pt)) for cid, key, pe, pt in LatestMetric.objects
+            .filter(company_id__in={k[0] for k in newest}, key__in={k[1] for k in newest})
+            .values_list("company_id", "key", "period_end", "period_type")
+        )
+        rows = [LatestMetric(company_id=cid, key=key, value=m.value, period_end=m.period_end,
+                             period_type=m.period_type)
+                for (cid, key), m in newest.items()
+                if (cid, key) not in current or (m.period_end, m.period_type) >= current[(cid, key)]]
+        LatestMetric.objects.bulk_create(
+            rows,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=["company", "key"],
+            update_fields=["value", "period_end", "period_type", "updated_at"],
+        )
+
+    def summary(self):
+        return f"inserted: {self.inserted}, updated: {self.updated}, unchanged: {self.skipped}"
+
+def latest_metric_maps(keys, company_ids=None):
+    """{key: {company_id: float}} from LatestMetric, one query for all keys."""
+    out = {k: {} for k in keys}
+    qs = LatestMetric.objects.filter(key__in=list(keys))
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+    for cid, key, value in qs.values_list("company_id", "key", "value"):
+        out[key][cid] = float(value)
+    return out
+
+def rebuild_latest_metrics(batch_size=2000):
+    """Rebuild LatestMetric from Metric (newest period_end per company/key, ties -> greatest period_type)."""
+    rows = (Metric.objects.order_by("company_id", "key", "-period_end", "-period_type")
+            .values_list("company_id", "key", "value", "period_end", "period_type"))
+    n, buf, last = 0, [], None
+    with transaction.atomic():
+        LatestMetric.objects.all().delete()
+        for cid, key, value, pe, pt in rows.iterator(chunk_size=batch_size):
+            if (cid, key) == last:
+                continue
+            last = (cid, key)
+            buf.append(LatestMetric(company_id=cid, key=key, value=value, period_end=pe, period_type=pt))
+            if len(buf) >= batch_size:
+                LatestMetric.objects.bulk_create(buf)
+                n += len(buf)
+                buf.clear()
+        LatestMetric.objects.bulk_create(buf)
+        n += len(buf)
+    bump_data_version()
+    return n
+
+def compute_metrics_for_company(c, writer=None):
+    # a caller-supplied writer batches across companies; otherwise flush here
+    if writer is None:
+        with MetricWriter() as writer:
+            return compute_metrics_for_company(c, writer)
     # ---------- Income Statement ----------
-    is_q = Statement.objects.filter(company=c, statement_type="IS", period_type="Q").order_by("period_end")
-    df = _safe_df(is_q)
+    df = _facts_df(c, "IS")
     if df is not None:
         # core TTMs
         for k in ["Revenue","NetIncome","OperatingIncome","GrossProfit","DA","SGA","RnD"]:
@@ -56,8 +256,7 @@ def compute_metrics_for_company(c):
             df["EBITDA_TTM"] = df["OperatingIncome_TTM"] + df["DA_TTM"]
 
         # ---------- Cash Flow ----------
-        cf_q = Statement.objects.filter(company=c, statement_type="CF", period_type="Q").order_by("period_end")
-        cdf = _safe_df(cf_q)
+        cdf = _facts_df(c, "CF")
         if cdf is not None:
             if "CFO" in cdf: cdf["CFO_TTM"] = cdf["CFO"].rolling(4, min_periods=4).sum()
             if "CapEx" in cdf: cdf["CapEx_TTM"] = cdf["CapEx"].rolling(4, min_periods=4).sum()
@@ -65,8 +264,7 @@ def compute_metrics_for_company(c):
                 cdf["FCF_TTM"] = cdf["CFO_TTM"] - cdf["CapEx_TTM"]
 
         # ---------- Balance Sheet (latest point-in-time) ----------
-        bs_q = Statement.objects.filter(company=c, statement_type="BS", period_type="Q").order_by("period_end")
-        bdf = _safe_df(bs_q)
+        bdf = _facts_df(c, "BS")
         last_bs = bdf.tail(1) if bdf is not None and not bdf.empty else None
 
         # ---------- Valuation (point-in-time using last close) ----------
@@ -97,14 +295,14 @@ def compute_metrics_for_company(c):
 
         if df is not None and pe is not None:
             for col in [x for x in ["Revenue_QoQ","Revenue_YoY","Revenue_TTM","NetIncome_TTM","GrossMargin_TTM","OpMargin_TTM","NetMargin_TTM","EBITDA_TTM"] if x in df.columns]:
-                _write_metric(c, col, pe, df.iloc[-1][col], ttm=col.endswith("_TTM"))
+                _write_metric(writer, c, col, pe, df.iloc[-1][col], ttm=col.endswith("_TTM"))
         if cdf is not None and pe_cf is not None:
             for col in [x for x in ["CFO_TTM","CapEx_TTM","FCF_TTM"] if x in cdf.columns]:
-                _write_metric(c, col, pe_cf, cdf.iloc[-1][col], ttm=True)
+                _write_metric(writer, c, col, pe_cf, cdf.iloc[-1][col], ttm=True)
             # FCF margin (TTM)
             if "FCF_TTM" in cdf.columns and df is not None and "Revenue_TTM" in df.columns:
                 fcf_margin = cdf.iloc[-1]["FCF_TTM"] / df.iloc[-1]["Revenue_TTM"] if df.iloc[-1]["Revenue_TTM"] else None
-                _write_metric(c, "FCF_Margin_TTM", pe_cf, fcf_margin, ttm=True)
+                _write_metric(writer, c, "FCF_Margin_TTM", pe_cf, fcf_margin, ttm=True)
 
         if last_bs is not None and pe_bs is not None:
             # Leverage / liquidity
@@ -113,27 +311,27 @@ def compute_metrics_for_company(c):
             ca = float(last_bs.iloc[0]["CurrentAssets"]) if "CurrentAssets" in last_bs.columns and pd.notna(last_bs.iloc[0]["CurrentAssets"]) else None
             debt_to_assets = (debt/ta) if (ta and debt is not None) else None
             current_ratio = (ca/cl) if (ca and cl) else None
-            _write_metric(c, "NetDebt", pe_bs, net_debt)
-            _write_metric(c, "DebtToAssets", pe_bs, debt_to_assets)
-            _write_metric(c, "CurrentRatio", pe_bs, current_ratio)
+            _write_metric(writer, c, "NetDebt", pe_bs, net_debt)
+            _write_metric(writer, c, "DebtToAssets", pe_bs, debt_to_assets)
+            _write_metric(writer, c, "CurrentRatio", pe_bs, current_ratio)
 
         if pe is not None:
             # Valuation metrics (point-in-time, store as 'Q')
-            _write_metric(c, "Price", pe, last_close)
-            _write_metric(c, "Shares", pe, shares)
-            _write_metric(c, "MarketCap", pe, market_cap)
-            _write_metric(c, "EnterpriseValue", pe, ev)
+            _write_metric(writer, c, "Price", pe, last_close)
+            _write_metric(writer, c, "Shares", pe, shares)
+            _write_metric(writer, c, "MarketCap", pe, market_cap)
+            _write_metric(writer, c, "EnterpriseValue", pe, ev)
             if ev is not None and df is not None and "Revenue_TTM" in df.columns and df.iloc[-1]["Revenue_TTM"]:
-                _write_metric(c, "EV_Sales", pe, ev / df.iloc[-1]["Revenue_TTM"])
+                _write_metric(writer, c, "EV_Sales", pe, ev / df.iloc[-1]["Revenue_TTM"])
             if ev is not None and "EBITDA_TTM" in (df.columns if df is not None else []):
                 ebitda = df.iloc[-1]["EBITDA_TTM"]
                 if ebitda and ebitda > 0:
-                    _write_metric(c, "EV_EBITDA", pe, ev / ebitda)
+                    _write_metric(writer, c, "EV_EBITDA", pe, ev / ebitda)
             # P/E (TTM)
             if market_cap and shares and df is not None and "NetIncome_TTM" in df.columns and df.iloc[-1]["NetIncome_TTM"]:
                 eps_ttm = df.iloc[-1]["NetIncome_TTM"] / shares
                 if eps_ttm and eps_ttm > 0:
-                    _write_metric(c, "PE_TTM", pe, (last_close / eps_ttm) if last_close else None)
+                    _write_metric(writer, c, "PE_TTM", pe, (last_close / eps_ttm) if last_close else None)
             # FCF Yield
             if market_cap and cdf is not None and "FCF_TTM" in cdf.columns and cdf.iloc[-1]["FCF_TTM"]:
-                _write_metric(c, "FCF_Yield", pe, cdf.iloc[-1]["FCF_TTM"] / market_cap)
+                _write_metric(writer, c, "FCF_Yield", pe, cdf.iloc[-1]["FCF_TTM"] / market_cap)
@@ -1,3 +1,293 @@
-from django.test import TestCase
+import datetime as dt
+import io
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from companies.models import Company
+from fundamentals import asof
+from fundamentals.asof import KeyIndex, asof_matrix, metrics_asof
+from fundamentals import services
+from fundamentals.facts import fact_table, resolve_payload, sync_facts
+from fundamentals.models import LatestMetric, Metric, Statement, StatementFact
+from fundamentals.management.commands.recompute_metrics import _asof, _asof_series
+from fundamentals.services import MetricWriter, rebuild_latest_metrics
+from marketdata.models import PriceBar
+from marketdata.panel import close_series
+
+
+def _brute_asof(cids, dates, values, ids, when):
+    out = np.full((len(when), len(ids)), np.nan)
+    for i, w in enumerate(when):
+        for j, c in enumerate(ids):
+            sel = np.flatnonzero((cids == c) & (dates <= w))
+            if len(sel):
+                out[i, j] = values[sel[-1]]
+    return out
+
+
+class AsofMatrixTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        cids = rng.choice([1, 2, 3, 5, 9], 300)
+        dates = rng.integers(-200, 400, 300).astype("datetime64[D]")  # incluye fechas pre-1970
+        order = np.lexsort((dates, cids))
+        self.cids, self.dates = cids[order], dates[order]
+        self.values = rng.random(300)
+
+    def test_matches_brute_force(self):
+        ids = np.array([1, 3, 5, 9, 11])
+        when = np.array([-300, -100, 0, 50, 399, 1000], dtype="datetime64[D]")
+        got, src = asof_matrix(self.cids, self.dates, self.values, ids, when)
+        want = _brute_asof(self.cids, self.dates, self.values, ids, when)
+        np.testing.assert_array_equal(got, want)
+        self.assertTrue((src[~np.isnan(got)] <= np.repeat(when, len(ids)).reshape(got.shape)[~np.isnan(got)]).all())
+        self.assertTrue(np.isnan(got[:, -1]).all())  # compañía sin filas
+
+    def test_empty_inputs(self):
+        when = np.array(["2020-01-31", "2020-02-29"], dtype="datetime64[D]")
+        got, src = asof_matrix(self.cids, self.dates, self.values, np.array([], dtype=np.int64), when)
+        self.assertEqual(got.shape, (2, 0))
+        self.assertEqual(src.shape, (2, 0))
+        empty = np.array([], dtype=np.int64)
+        got, src = asof_matrix(empty, empty.astype("datetime64[D]"), empty.astype(float), np.array([1, 2]), when)
+        self.assertTrue(np.isnan(got).all())
+        self.assertTrue(np.isnat(src).all())
+
+    def test_key_index_cross_section(self):
+        index = KeyIndex(self.cids, self.dates, self.values)
+        when = np.datetime64(50, "D")
+        want = _brute_asof(self.cids, self.dates, self.values, index.ids, [when])[0]
+        ids, vals, src = index.cross_section(when)
+        np.testing.assert_array_equal(vals, want[~np.isnan(want)])
+        self.assertTrue((src <= when).all())
+
+        ids, vals, _ = index.cross_section(when, [9, 3, 42])
+        self.assertEqual(ids.tolist(), [3, 9])
+        for cid, v in zip(ids.tolist(), vals.tolist()):
+            self.assertEqual(v, want[index.ids.tolist().index(cid)])
+
+    def test_key_index_empty(self):
+        index = KeyIndex(self.cids, self.dates, self.values)
+        for company_ids in ({}.keys(), [42]):
+            ids, vals, src = index.cross_section(np.datetime64("2020-06-30"), company_ids)
+            self.assertEqual((len(ids), len(vals), len(src)), (0, 0, 0))
+        empty = np.array([], dtype=np.int64)
+        ids, _, _ = KeyIndex(empty, empty.astype("datetime64[D]"), empty.astype(float)).cross_section(
+            np.datetime64("2020-06-30"))
+        self.assertEqual(len(ids), 0)
+
+
+class MetricsAsofTests(TestCase):
+    def setUp(self):
+        # las versiones de datos se reinician con cada test: vaciar las cachés por proceso
+        cache.clear()
+        asof._cache.update(stamp=None)  # se rearma en la próxima lectura
+        self.a = Company.objects.create(ticker="AAA", name="A")
+        self.b = Company.objects.create(ticker="BBB", name="B")
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", dt.date(2020, 3, 31), "TTM", 10.0)
+            w.add(self.a.id, "PE_TTM", dt.date(2020, 6, 30), "TTM", 12.0)
+            w.add(self.b.id, "PE_TTM", dt.date(2020, 6, 30), "TTM", 20.0)
+
+    def test_point_in_time(self):
+        self.assertEqual(metrics_asof(dt.date(2020, 1, 1), ["PE_TTM"]), {"PE_TTM": {}})
+        self.assertEqual(metrics_asof("2020-05-15", ["PE_TTM"]), {"PE_TTM": {self.a.id: 10.0}})
+        got = metrics_asof(dt.date(2020, 7, 1), ["PE_TTM"], with_dates=True)["PE_TTM"]
+        self.assertEqual(got, {self.a.id: (12.0, dt.date(2020, 6, 30)), self.b.id: (20.0, dt.date(2020, 6, 30))})
+        self.assertEqual(metrics_asof(dt.date(2020, 7, 1), ["PE_TTM"], company_ids=[self.b.id]),
+                         {"PE_TTM": {self.b.id: 20.0}})
+
+    def test_unknown_keys_are_not_indexed(self):
+        self.assertEqual(metrics_asof(dt.date(2020, 7, 1), ["NOPE"]), {"NOPE": {}})
+        self.assertNotIn("NOPE", asof._cache["keys"])
+        self.assertIn("PE_TTM", asof.known_keys())
+
+    def test_index_cache_is_bounded(self):
+        with MetricWriter() as w:
+            for i in range(5):
+                w.add(self.a.id, f"K{i}", dt.date(2020, 6, 30), "TTM", float(i))
+        with mock.patch.object(asof, "MAX_INDEXES", 3):
+            for i in range(5):
+                metrics_asof(dt.date(2020, 7, 1), [f"K{i}"])
+            metrics_asof(dt.date(2020, 7, 1), ["K2"])  # recién usada: no se desaloja
+            metrics_asof(dt.date(2020, 7, 1), ["PE_TTM"])
+        self.assertEqual(list(asof._cache["keys"]), ["K4", "K2", "PE_TTM"])
+
+    def test_index_refreshes_after_write(self):
+        self.assertEqual(metrics_asof(dt.date(2020, 12, 31), ["PE_TTM"])["PE_TTM"][self.a.id], 12.0)
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", dt.date(2020, 9, 30), "TTM", 15.0)
+        self.assertEqual(metrics_asof(dt.date(2020, 12, 31), ["PE_TTM"])["PE_TTM"][self.a.id], 15.0)
+
+
+class MetricWriterTests(TestCase):
+    def setUp(self):
+        self.a = Company.objects.create(ticker="AAA", name="A")
+        self.b = Company.objects.create(ticker="BBB", name="B")
+        self.q1, self.q2 = dt.date(2020, 3, 31), dt.date(2020, 6, 30)
+
+    def _latest(self, company, key="PE_TTM"):
+        m = LatestMetric.objects.get(company=company, key=key)
+        return float(m.value), m.period_end
+
+    def test_counts_and_precision(self):
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q1, "TTM", 10.0)
+            w.add(self.b.id, "PE_TTM", self.q1, "TTM", 20.0)
+        self.assertEqual((w.inserted, w.updated, w.skipped), (2, 0, 0))
+
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q1, "TTM", 10.0000004)  # igual a 6 decimales
+            w.add(self.b.id, "PE_TTM", self.q1, "TTM", 21.0)
+            w.add(self.b.id, "PE_TTM", self.q1, "Q", 21.0)  # otro period_type: fila aparte
+        self.assertEqual((w.inserted, w.updated, w.skipped), (1, 1, 1))
+        self.assertEqual(Metric.objects.count(), 3)
+        self.assertEqual(float(Metric.objects.get(company=self.b, period_type="TTM").value), 21.0)
+
+    def test_ignores_missing_values(self):
+        with MetricWriter() as w:
+            for v in (None, float("nan"), float("inf"), -float("inf"), np.nan):
+                w.add(self.a.id, "PE_TTM", self.q1, "TTM", v)
+            w.add(self.a.id, "PE_TTM", None, "TTM", 1.0)
+        self.assertEqual((w.inserted, w.updated, w.skipped), (0, 0, 0))
+        self.assertFalse(Metric.objects.exists())
+
+    def test_latest_only_moves_forward(self):
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q2, "TTM", 12.0)
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q1, "TTM", 10.0)  # backfill de un período anterior
+        self.assertEqual(self._latest(self.a), (12.0, self.q2))
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q2, "TTM", 13.0)  # corrección del vigente
+        self.assertEqual(self._latest(self.a), (13.0, self.q2))
+
+    def test_upsert_survives_concurrent_insert(self):
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", self.q1, "TTM", 10.0)
+        # otro writer leyó antes de esa inserción: su pre-lectura no ve la fila
+        with mock.patch.object(Metric.objects, "filter", return_value=Metric.objects.none()):
+            with MetricWriter() as w:
+                w.add(self.a.id, "PE_TTM", self.q1, "TTM", 11.0)
+        self.assertEqual(Metric.objects.count(), 1)
+        self.assertEqual(float(Metric.objects.get().value), 11.0)
+        self.assertEqual(self._latest(self.a), (11.0, self.q1))
+
+    def test_bumps_once_per_block(self):
+        with mock.patch.object(services, "bump_data_version") as bump:
+            with MetricWriter(buffer_size=2) as w:
+                for i in range(5):
+                    w.add(self.a.id if i % 2 else self.b.id, f"K{i}", self.q1, "Q", float(i))
+                self.assertEqual(bump.call_count, 0)  # buffers llenos escriben, no versionan
+        self.assertEqual(Metric.objects.count(), 5)
+        bump.assert_called_once_with({self.a.id, self.b.id})
+
+
+def _nearest_prior(series, when):
+    """Búsqueda previa de recompute_metrics: último valor con fecha <= when."""
+    val = None
+    for d, v in series:
+        if d <= when:
+            val = v
+        else:
+            break
+    return val
+
+
+class RecomputeAsofTests(SimpleTestCase):
+    def test_matches_previous_per_quarter_lookup(self):
+        series = [(dt.date(2020, 3, 31), 1.0), (dt.date(2020, 6, 30), 2.0), (dt.date(2020, 12, 31), 4.0)]
+        quarters = [dt.date(2019, 12, 31),  # antes del primer punto
+                    dt.date(2020, 3, 31),   # fecha exacta
+                    dt.date(2020, 9, 30),   # hueco: vale el de junio
+                    dt.date(2020, 12, 31), dt.date(2021, 3, 31)]
+        when = np.array(quarters, dtype="datetime64[D]")
+        self.assertEqual(_asof_series(series, when), [_nearest_prior(series, q) for q in quarters])
+        self.assertEqual(_asof_series([], when), [None] * len(quarters))
+
+
+@override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp())  # sin panel: precios desde PriceBar
+class RecomputeMetricsTests(TestCase):
+    def setUp(self):
+        self.c = Company.objects.create(ticker="AAA", name="A")
+
+    def test_price_join_matches_previous_queries(self):
+        days = [dt.date(2020, 3, 27), dt.date(2020, 3, 31), dt.date(2020, 6, 26), dt.date(2020, 10, 2)]
+        PriceBar.objects.bulk_create([PriceBar(company=self.c, date=d, close=10.0 + i) for i, d in enumerate(days)])
+        quarters = [dt.date(2019, 12, 31), dt.date(2020, 3, 31), dt.date(2020, 6, 30), dt.date(2020, 9, 30),
+                    dt.date(2020, 12, 31)]
+        px_dates, px_closes = close_series(self.c.id)
+        got = _asof(px_dates, px_closes, np.array(quarters, dtype="datetime64[D]"))
+        want = [PriceBar.objects.filter(company=self.c, date__lte=q).order_by("-date")
+                .values_list("close", flat=True).first() for q in quarters]
+        self.assertEqual(got, want)
+        self.assertEqual(got, [None, 11.0, 12.0, 12.0, 13.0])
+
+    def test_verbose_output_goes_to_command_stdout(self):
+        out = io.StringIO()
+        call_command("recompute_metrics", "--full", "--verbose", stdout=out, stderr=io.StringIO())
+        self.assertIn("→ AAA: recomputando", out.getvalue())
+        self.assertIn("AAA: sin Revenue en IS", out.getvalue())
+
+
+class FactsTests(TestCase):
+    def test_alias_priority(self):
+        self.assertEqual(resolve_payload({"Revenues": 5, "TotalRevenue": 4}), {"Revenue": 4.0})
+        self.assertEqual(resolve_payload({"Revenue": "n/a", "TotalRevenue": "3", "Revenues": 9}), {"Revenue": 3.0})
+        self.assertEqual(resolve_payload({"DebtCurrent": float("nan"), "ShortTermBorrowings": 2}),
+                         {"ShortTermDebt": 2.0})
+        self.assertEqual(resolve_payload({"NetIncomeLoss": 1, "Custom": "7", "Note": "texto"}),
+                         {"NetIncome": 1.0, "Custom": 7.0})
+        self.assertEqual(resolve_payload(None), {})
+
+    def test_resync_drops_fields_missing_from_payload(self):
+        c = Company.objects.create(ticker="AAA", name="A")
+        q1, q2 = dt.date(2020, 3, 31), dt.date(2020, 6, 30)
+        s1 = Statement.objects.create(company=c, statement_type="IS", period_type="Q", period_end=q1,
+                                      json_payload={"Revenues": 10, "NetIncomeLoss": 2, "Custom": 3})
+        s2 = Statement.objects.create(company=c, statement_type="IS", period_type="Q", period_end=q2,
+                                      json_payload={"Revenue": 11, "NetIncome": 3})
+        sync_facts([s1, s2])
+        self.assertEqual(fact_table(c.id, "IS")[q1], {"Revenue": 10.0, "NetIncome": 2.0, "Custom": 3.0})
+
+        s1.json_payload = {"TotalRevenue": 12, "NetIncomeLoss": None}
+        s1.save()
+        self.assertEqual(sync_facts([s1]), 1)
+        self.assertEqual(fact_table(c.id, "IS"), {q1: {"Revenue": 12.0}, q2: {"Revenue": 11.0, "NetIncome": 3.0}})
+        self.assertEqual(StatementFact.objects.count(), 3)
+
+
+class LatestMetricTests(TestCase):
+    def _expected(self):
+        """Fila más nueva de Metric por (compañía, key): mayor (period_end, period_type)."""
+        out = {}
+        for cid, key, pe, pt, v in Metric.objects.values_list("company_id", "key", "period_end", "period_type", "value"):
+            if (cid, key) not in out or (pe, pt) > out[(cid, key)][:2]:
+                out[(cid, key)] = (pe, pt, v)
+        return out
+
+    def _latest(self):
+        return {(cid, key): (pe, pt, v) for cid, key, pe, pt, v in
+                LatestMetric.objects.values_list("company_id", "key", "period_end", "period_type", "value")}
+
+    def test_matches_metric_after_mixed_writes(self):
+        rng = np.random.default_rng(11)
+        ids = [Company.objects.create(ticker=f"T{i}", name=f"N{i}").id for i in range(4)]
+        quarters = [dt.date(2020, 3, 31), dt.date(2020, 6, 30), dt.date(2020, 9, 30), dt.date(2020, 12, 31)]
+        for batch in range(6):
+            # altas, backfills de períodos anteriores, correcciones y varios period_type por fecha
+            with MetricWriter(buffer_size=7) as w:
+                for _ in range(25):
+                    w.add(int(rng.choice(ids)), str(rng.choice(["PE_TTM", "Price"])),
+                          quarters[int(rng.integers(0, 4 if batch else 2))],
+                          str(rng.choice(["Q", "TTM", "D"])), float(rng.integers(1, 5)))
+            with self.subTest(batch=batch):
+                self.assertEqual(self._latest(), self._expected())
+        rebuilt_from = self._latest()
+        rebuild_latest_metrics()
+        self.assertEqual(self._latest(), rebuilt_from)
@@ -1,3 +1,4 @@
 from django.contrib import admin
-from .models import PriceBar
+from .models import PriceBar, TechnicalBar
 admin.site.register(PriceBar)
+admin.site.register(TechnicalBar)
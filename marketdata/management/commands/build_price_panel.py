@@ -0,0 +1,38 @@
+# marketdata/management/commands/build_price_panel.py
+"""
+Reconstruye el panel mmap de cierres (marketdata/panel.py) desde PriceBar.
+eodhd_prices ya lo actualiza de forma incremental; este comando sirve para la
+primera construcción o tras cargas de precios por otras vías. Las compañías
+cuyos cierres cambiaron en el panel quedan sucias para los recálculos
+(core.watermarks), que leen del panel.
+
+  python manage.py build_price_panel
+  python manage.py build_price_panel --tickers AAPL MSFT
+"""
+from django.core.management.base import BaseCommand
+
+from companies.models import Company
+from core.watermarks import mark_dirty
+from marketdata.panel import panel_stamps, rebuild_panel
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el panel de cierres (NumPy mmap) usado por las rutas de lectura."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tickers", nargs="*",
+                            help="Releer sólo estas compañías (el resto se copia del panel vigente)")
+
+    def handle(self, *args, **opts):
+        ids = None
+        if opts.get("tickers"):
+            ids = list(Company.objects.filter(ticker__in=[t.upper() for t in opts["tickers"]])
+                       .values_list("id", flat=True))
+        before = panel_stamps()
+        n = rebuild_panel(ids)
+        after = panel_stamps()
+        changed = [cid for cid in set(before) | set(after) if before.get(cid) != after.get(cid)]
+        changed = list(Company.objects.filter(id__in=changed).values_list("id", flat=True))  # sin borradas
+        mark_dirty(changed, "prices")
+        self.stdout.write(self.style.SUCCESS(
+            f"Panel de cierres listo: {n} cierres ({len(changed)} compañías con cambios)"))
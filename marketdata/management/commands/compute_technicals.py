@@ -1,61 +1,185 @@
-﻿from django.core.management.base import BaseCommand
+﻿import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
 from companies.models import Company
-from marketdata.models import PriceBar
+from core.parallel import add_parallel_arguments, run_chunks, shard_ids
+from core.watermarks import dirty_ids, mark_clean
 from fundamentals.models import Metric
-import pandas as pd
+from fundamentals.services import MetricWriter
+from marketdata.models import TechnicalBar, TechnicalState
+from marketdata.services import upsert_technical_bars
+from marketdata.technicals import (
+    TECH_KEYS, compute_technicals, history_stats, iter_technical_bars, load_close_panel, right_align,
+    save_states, states_from_panel,
+)
+
+# Metric keys that only ever hold the latest value (history lives in TechnicalBar).
+# "Price" is excluded: recompute_metrics also writes it at quarter ends.
+LATEST_ONLY_KEYS = TECH_KEYS + ["close"]
+
+
+def _latest_rows(ids, dates, closes, tech):
+    """Metric rows for each column's last bar (right-aligned: the last row)."""
+    last_dates = dates[-1].astype("O")
+    last = {k: tech[k][-1] for k in TECH_KEYS}
+    last["close"] = closes[-1]
+    rows = []
+    for j, cid in enumerate(ids.tolist()):
+        pe = last_dates[j]
+        for k in TECH_KEYS + ["close"]:
+            rows.append((cid, k, pe, "Q", last[k][j]))
+        # also store Close as Price (consistency with fundamentals)
+        rows.append((cid, "Price", pe, "Q", closes[-1, j]))
+    return rows
+
+
+def _history_matches(state, n, total, n_new, sum_new):
+    """True if the stored bars are exactly the state's history plus the new bars."""
+    if n != state.bar_count + n_new:
+        return False
+    expected = state.close_sum + sum_new
+    return abs((total or 0.0) - expected) <= 1e-9 * max(1.0, abs(expected))
+
+
+def _seed(states, ids, attr):
+    """Carried RSI accumulator per column (NaN = none yet)."""
+    vals = [getattr(states[cid], attr) for cid in ids]
+    return np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+
+
+def _technicals_chunk(chunk_ids, started_at, full=False, batch_size=5000):
+    """One price matrix worth of companies (runs in-process or in a core.parallel worker)."""
+    n_full = n_inc = n_skip = n_bars = 0
+    writer = MetricWriter()
+    states = {}
+    if not full:
+        states = {s.company_id: s for s in TechnicalState.objects.filter(company_id__in=chunk_ids)}
+
+    inc_ids, full_ids = [], [cid for cid in chunk_ids if cid not in states]
+    if states:
+        # only bars after each company's last processed date
+        new_ids, new_dates, new_closes = load_close_panel(
+            list(states), after={cid: s.last_date for cid, s in states.items()})
+        new_by_id = {cid: j for j, cid in enumerate(new_ids.tolist())}
+        stored = history_stats(list(states))
+        for cid, st in states.items():
+            col = new_closes[:, new_by_id[cid]] if cid in new_by_id else np.empty(0)
+            col = col[~np.isnan(col)]
+            n, total = stored.get(cid, (0, 0.0))
+            if not _history_matches(st, n, total, len(col), float(col.sum())):
+                full_ids.append(cid)  # history edited/backfilled -> start over
+            elif len(col):
+                inc_ids.append(cid)
+            else:
+                n_skip += 1
+
+    rows, new_states = [], []
+    if full_ids:
+        ids, dates, closes = load_close_panel(sorted(full_ids))
+        if len(ids):
+            tech, avg_up, avg_down = compute_technicals(closes)
+            rows += _latest_rows(ids, dates, closes, tech)
+            n_bars += upsert_technical_bars(
+                iter_technical_bars(ids, dates, closes, tech), batch_size=batch_size)
+            new_states += states_from_panel(ids, dates, closes, avg_up, avg_down)
+            n_full += len(ids)
+
+    if inc_ids:
+        ids = np.asarray(inc_ids, dtype=np.int64)
+        tails = [np.asarray(states[cid].tail, dtype=np.float64) for cid in inc_ids]
+        fresh_cols = [new_closes[:, new_by_id[cid]] for cid in inc_ids]
+        fresh_cols = [c[~np.isnan(c)] for c in fresh_cols]
+        closes = right_align([np.concatenate([t, c]) for t, c in zip(tails, fresh_cols)])
+        T = closes.shape[0]
+
+        # new bars are the last n_new rows of each column; dates only matter there
+        n_new = np.array([len(c) for c in fresh_cols])
+        fresh = np.arange(T)[:, None] >= (T - n_new)[None, :]
+        dates = np.full(closes.shape, np.datetime64("NaT"), dtype="datetime64[D]")
+        # new_dates spans every state company (incl. ones sent to full_ids, which
+        # may have more new bars than T): keep the rows the incremental ones use
+        sub = new_dates[-int(n_new.max()):, [new_by_id[cid] for cid in inc_ids]]
+        dates[T - sub.shape[0]:] = sub
+
+        tech, avg_up, avg_down = compute_technicals(
+            closes, fresh, _seed(states, inc_ids, "avg_up"), _seed(states, inc_ids, "avg_down"))
+        rows += _latest_rows(ids, dates, closes, tech)
+        n_bars += upsert_technical_bars(
+            iter_technical_bars(ids, dates, closes, tech, rows=fresh), batch_size=batch_size)
+        base = {cid: (states[cid].bar_count - len(t), states[cid].close_sum - float(t.sum()))
+                for cid, t in zip(inc_ids, tails)}
+        new_states += states_from_panel(ids, dates, closes, avg_up, avg_down, base=base)
+        n_inc += len(ids)
+
+    writer.add_rows(rows)
+    writer.flush()  # before pruning older rows below
+    save_states(new_states)
+
+    # keep a single (latest) Metric row per technical key; only rows whose bar
+    # is already in TechnicalBar go (legacy history: migration marketdata 0005)
+    Metric.objects.filter(
+        company_id__in=chunk_ids,
+        key__in=LATEST_ONLY_KEYS,
+        period_end__lt=Subquery(
+            TechnicalState.objects.filter(company=OuterRef("company")).values("last_date")[:1]),
+    ).filter(
+        Exists(TechnicalBar.objects.filter(company=OuterRef("company"), date=OuterRef("period_end"))),
+    ).delete()
+
+    # watermark = last close actually read (the panel may lag PriceBar)
+    through = {cid: st.last_date for cid, st in states.items()}
+    through.update({st.company_id: st.last_date for st in new_states})
+    mark_clean("technicals", chunk_ids, started_at,
+               prices_through={cid: through.get(cid) for cid in chunk_ids})
+    return {"full": n_full, "incremental": n_inc, "up_to_date": n_skip, "series_rows": n_bars,
+            "inserted": writer.inserted, "updated": writer.updated, "skipped": writer.skipped}
 
-def rsi(series, period=14):
-    delta = series.diff()
-    up = delta.clip(lower=0)
-    down = -delta.clip(upper=0)
-    roll_up = up.ewm(alpha=1/period, adjust=False).mean()
-    roll_down = down.ewm(alpha=1/period, adjust=False).mean()
-    rs = roll_up / roll_down
-    return 100 - (100 / (1 + rs))
 
 class Command(BaseCommand):
     help = "Compute basic technicals (SMA50/200, RSI14, 52w distances, 30d volatility)"
 
-    def handle(self, *args, **kwargs):
-        n = 0
-        for c in Company.objects.all():
-            qs = PriceBar.objects.filter(company=c).order_by("date").values("date","close")
-            if not qs.exists():
-                continue
-            df = pd.DataFrame(qs)
-            df["close"] = pd.to_numeric(df["close"], errors="coerce")
-            df.dropna(subset=["close"], inplace=True)
-            if df.empty:
-                continue
-
-            df["SMA_50"] = df["close"].rolling(50).mean()
-            df["SMA_200"] = df["close"].rolling(200).mean()
-            df["RSI_14"] = rsi(df["close"], 14)
-
-            # 52w window ~ 252 trading days
-            df["52w_high"] = df["close"].rolling(252).max()
-            df["52w_low"] = df["close"].rolling(252).min()
-            df["DistTo52wHigh"] = df["close"]/df["52w_high"] - 1.0
-            df["DistTo52wLow"] = df["close"]/df["52w_low"] - 1.0
-
-            # 30d realized vol (annualized)
-            ret = df["close"].pct_change()
-            df["Vol_30d"] = ret.rolling(30).std() * (252**0.5)
-
-            last = df.tail(1).iloc[0]
-            pe = last["date"]
-
-            def write(key, val):
-                if pd.notna(val):
-                    Metric.objects.update_or_create(
-                        company=c, key=key, period_end=pe, period_type="Q",
-                        defaults={"value": float(val)}
-                    )
-
-            for k in ["SMA_50","SMA_200","RSI_14","DistTo52wHigh","DistTo52wLow","Vol_30d","close"]:
-                write(k, last.get(k))
-            # also store Close as Price (consistency with fundamentals)
-            write("Price", last["close"])
-            n += 1
-
-        self.stdout.write(self.style.SUCCESS(f"Technicals computed for {n} companies"))
+    def add_arguments(self, parser):
+        parser.add_argument("--tickers", nargs="*", help="Limit to specific tickers")
+        parser.add_argument("--chunk", type=int, default=2000,
+                            help="Companies per price matrix (bounds memory, default 2000)")
+        parser.add_argument("--full", action="store_true",
+                            help="Process every company and recompute from full history (ignore watermarks and carried state)")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="TechnicalBar rows per write batch (default 5000)")
+        add_parallel_arguments(parser)
+        parser.add_argument("--warm-cache", action="store_true",
+                            help="Warm page/API caches when done (see warm_cache)")
+
+    def handle(self, *args, **opts):
+        qs = Company.objects.order_by("id")
+        if opts.get("tickers"):
+            qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
+        all_ids = shard_ids(qs.values_list("id", flat=True), opts.get("shard"))
+        started_at = timezone.now()
+        if not opts.get("full"):
+            # only companies with new bars since their last run (core.watermarks)
+            n_all, all_ids = len(all_ids), dirty_ids("technicals", all_ids)
+            self.stdout.write(f"{len(all_ids)} of {n_all} companies have new prices (--full for all)")
+        chunk = max(1, int(opts.get("chunk") or 2000))
+        workers = max(1, int(opts.get("workers") or 1))
+        if workers > 1:
+            # enough chunks to keep every worker busy
+            chunk = min(chunk, max(1, -(-len(all_ids) // workers)))
+
+        def progress(done, total, part):
+            if workers > 1:
+                self.stdout.write(f"  {done}/{total} companies")
+
+        t = run_chunks(_technicals_chunk, all_ids, workers=workers, chunk_size=chunk, progress=progress,
+                       started_at=started_at, full=bool(opts.get("full")), batch_size=max(1, int(opts.get("batch_size") or 5000)))
+        for err in t.get("errors", []):
+            self.stderr.write(f"  {err}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Technicals computed — full: {t.get('full', 0)}, incremental: {t.get('incremental', 0)}, "
+            f"up to date: {t.get('up_to_date', 0)}, series rows: {t.get('series_rows', 0)}; "
+            f"metrics inserted: {t.get('inserted', 0)}, updated: {t.get('updated', 0)}, "
+            f"unchanged: {t.get('skipped', 0)}"))
+        if opts.get("warm_cache"):
+            call_command("warm_cache", stdout=self.stdout, stderr=self.stderr)
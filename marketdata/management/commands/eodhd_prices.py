@@ -2,12 +2,14 @@
 import os
 import time
 import datetime as dt
-from decimal import Decimal
 
-import requests
 from django.core.management.base import BaseCommand, CommandError
 from companies.models import Company
-from marketdata.models import PriceBar
+from core.archive import PayloadArchive
+from core.fetch import VendorClient, fetch_concurrently
+from core.watermarks import mark_dirty
+from marketdata.panel import rebuild_panel
+from marketdata.services import bars_from_rows, last_bar_dates, upsert_bars
 
 
 EODHD_BASE = "https://eodhd.com/api/eod/{symbol}"  # daily candles
@@ -33,72 +35,98 @@ class Command(BaseCommand):
         parser.add_argument("--tickers", nargs="*", help="Limitar a ciertos tickers (ej: AAPL TSCO PYPL)")
         parser.add_argument("--suffix", type=str, default="", help="Sufijo de exchange (ej: .US, .MX, .L, .NS, .HK)")
         parser.add_argument("--years", type=int, default=8, help="Años hacia atrás (default 8)")
-        parser.add_argument("--sleep", type=float, default=0.25, help="Pausa entre requests (seg)")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Pausa extra entre requests (seg, por hilo)")
+        parser.add_argument("--rate", type=float, default=None,
+                            help="Máximo de requests/seg (default settings.VENDOR_RATE_LIMITS['eodhd'] / EODHD_RATE_LIMIT)")
+        parser.add_argument("--workers", type=int, default=8, help="Descargas concurrentes (default 8)")
+        parser.add_argument("--full", action="store_true",
+                            help="Ignora la última fecha guardada y descarga los --years completos")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Filas por INSERT en el upsert (default 1000)")
+        parser.add_argument("--replay", action="store_true",
+                            help="Re-ingesta desde el archivo local de respuestas crudas (sin red)")
+        parser.add_argument("--replay-date", type=dt.date.fromisoformat, default=None,
+                            help="Con --replay: usar sólo descargas hasta esta fecha (YYYY-MM-DD)")
 
     def handle(self, *args, **opts):
+        replay = bool(opts.get("replay"))
         api_key = os.getenv("EODHD_API_KEY")
-        if not api_key:
+        if not api_key and not replay:
             raise CommandError("Falta EODHD_API_KEY en el entorno (export EODHD_API_KEY=...)")
 
         years = int(opts["years"])
         since = dt.date.today() - dt.timedelta(days=years * 365)
         suffix = (opts.get("suffix") or "").strip()
-        sleep = float(opts.get("sleep") or 0.25)
+        sleep = float(opts.get("sleep") or 0)
+        batch_size = int(opts.get("batch_size") or 1000)
+        workers = max(1, int(opts.get("workers") or 8))
 
         qs = Company.objects.all()
         if opts.get("tickers"):
             qs = qs.filter(ticker__in=[t.upper() for t in opts["tickers"]])
 
-        total = 0
-        for c in qs:
+        # Modo incremental (default): cada compañía arranca en su última barra guardada
+        # (inclusive, para refrescar una vela parcial). Sin historia -> --years completos.
+        last_dates = {} if opts.get("full") or replay else last_bar_dates()
+        archive = PayloadArchive()
+
+        def fetch(c):
+            """Descarga en un hilo del pool; no toca la base de datos."""
             symbol = _symbol_for_company(c, suffix)
-            url = EODHD_BASE.format(symbol=symbol)
+            start = max(since, last_dates[c.id]) if c.id in last_dates else since
+            if replay:
+                # Fusiona todas las descargas archivadas (la más nueva gana por fecha)
+                merged = {}
+                for rows in archive.iter_json("eodhd", symbol, "eod", until=opts.get("replay_date")):
+                    merged.update({row.get("date"): row for row in rows or []})
+                return symbol, None, [merged[d] for d in sorted(merged, key=str)]
             params = {
                 "api_token": api_key,
-                "from": since.isoformat(),
+                "from": start.isoformat(),
                 "period": "d",
                 "fmt": "json",
             }
-            self.stdout.write(f"[{c.ticker}] {symbol}  →  {since}..today")
             try:
-                r = requests.get(url, params=params, timeout=60)
+                r = client.get(EODHD_BASE.format(symbol=symbol), params=params)
                 r.raise_for_status()
-                data = r.json()
-                if not data:
-                    self.stderr.write("  (sin datos)")
+                archive.put("eodhd", symbol, "eod", r.content)
+                return symbol, start, r.json()
+            finally:
+                if sleep:
                     time.sleep(sleep)
-                    continue
-            except Exception as e:
-                self.stderr.write(f"  error request: {e}")
-                time.sleep(sleep)
+
+        client = None if replay else VendorClient("eodhd", concurrency=workers, rate=opts.get("rate"))
+        total = 0
+        touched = set()
+        # Un único escritor: los resultados llegan a este hilo y se guardan aquí.
+        for c, res, err in fetch_concurrently(list(qs), fetch, workers=workers):
+            if err is not None:
+                self.stderr.write(f"[{c.ticker}] error request: {err}")
+                continue
+            symbol, start, data = res
+            if start:
+                self.stdout.write(f"[{c.ticker}] {symbol}  →  {start}..today")
+            else:
+                self.stdout.write(f"[{c.ticker}] {symbol}  ←  archivo local")
+            if not data:
+                self.stderr.write("  (sin datos)")
                 continue
 
             # Esperado: lista de dicts con keys: date, open, high, low, close, volume
-            for row in data:
-                d = row.get("date")
-                if not d:
-                    continue
-                try:
-                    date_obj = dt.date.fromisoformat(d[:10])
-                except Exception:
-                    continue
-
-                try:
-                    PriceBar.objects.update_or_create(
-                        company=c,
-                        date=date_obj,
-                        defaults={
-                            "open":   Decimal(str(row.get("open") or 0)),
-                            "high":   Decimal(str(row.get("high") or 0)),
-                            "low":    Decimal(str(row.get("low") or 0)),
-                            "close":  Decimal(str(row.get("close") or 0)),
-                            "volume": int(row.get("volume") or 0),
-                        },
-                    )
-                    total += 1
-                except Exception as e:
-                    self.stderr.write(f"  {c.ticker} {date_obj}: error guardando ({e})")
-
-            time.sleep(sleep)
+            bars = bars_from_rows(c, data)
+            try:
+                total += upsert_bars(bars, batch_size=batch_size)
+                if bars:
+                    touched.add(c.id)
+            except Exception as e:
+                self.stderr.write(f"  {c.ticker}: error guardando ({e})")
+        if client:
+            client.close()
+
+        # Panel mmap de cierres: sólo se releen las compañías actualizadas. Se marcan
+        # sucias después, cuando los recálculos ya leen los cierres nuevos.
+        if touched:
+            n = rebuild_panel(touched)
+            mark_dirty(touched, "prices")
+            self.stdout.write(f"Panel de cierres actualizado ({len(touched)} compañías, {n} cierres)")
 
         self.stdout.write(self.style.SUCCESS(f"Listo. Registros procesados/actualizados: {total}"))
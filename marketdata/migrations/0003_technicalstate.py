@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('marketdata', '0002_alter_pricebar_close_alter_pricebar_date_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechnicalState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_date', models.DateField()),
+                ('bar_count', models.IntegerField()),
+                ('close_sum', models.FloatField()),
+                ('avg_up', models.FloatField(blank=True, null=True)),
+                ('avg_down', models.FloatField(blank=True, null=True)),
+                ('tail', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='technical_state', to='companies.company')),
+            ],
+        ),
+    ]
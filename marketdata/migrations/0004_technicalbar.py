@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('marketdata', '0003_technicalstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechnicalBar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('close', models.FloatField(blank=True, null=True)),
+                ('sma_50', models.FloatField(blank=True, null=True)),
+                ('sma_200', models.FloatField(blank=True, null=True)),
+                ('rsi_14', models.FloatField(blank=True, null=True)),
+                ('dist_52w_high', models.FloatField(blank=True, null=True)),
+                ('dist_52w_low', models.FloatField(blank=True, null=True)),
+                ('vol_30d', models.FloatField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='companies.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'date'], name='marketdata__company_93f10f_idx')],
+                'unique_together': {('company', 'date')},
+            },
+        ),
+    ]
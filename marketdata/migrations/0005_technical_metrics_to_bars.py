@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:40
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+# Metric key -> columna de TechnicalBar (copia fija: la migración no importa código de la app)
+FIELDS = {
+    "close": "close",
+    "SMA_50": "sma_50",
+    "SMA_200": "sma_200",
+    "RSI_14": "rsi_14",
+    "DistTo52wHigh": "dist_52w_high",
+    "DistTo52wLow": "dist_52w_low",
+    "Vol_30d": "vol_30d",
+}
+
+
+def _copy_company(TechnicalBar, cid, series):
+    """Vuelca {fecha: {columna: valor}} de una compañía sin pisar barras ya calculadas."""
+    existing = {b.date: b for b in TechnicalBar.objects.filter(company_id=cid, date__in=list(series))}
+    to_create, to_update = [], []
+    for day, cols in series.items():
+        bar = existing.get(day)
+        if bar is None:
+            to_create.append(TechnicalBar(company_id=cid, date=day, **cols))
+            continue
+        missing = {f: v for f, v in cols.items() if getattr(bar, f) is None}
+        if missing:
+            for f, v in missing.items():
+                setattr(bar, f, v)
+            to_update.append(bar)
+    TechnicalBar.objects.bulk_create(to_create, batch_size=1000)
+    TechnicalBar.objects.bulk_update(to_update, list(FIELDS.values()), batch_size=1000)
+
+
+def metrics_to_bars(apps, schema_editor):
+    """
+    La historia de técnicos que vivía en Metric (una fila por corrida) pasa a
+    TechnicalBar; en Metric queda sólo el último valor de cada (compañía, key).
+    """
+    Metric = apps.get_model("fundamentals", "Metric")
+    TechnicalBar = apps.get_model("marketdata", "TechnicalBar")
+    rows = (Metric.objects.filter(key__in=list(FIELDS)).order_by("company_id", "period_end")
+            .values_list("company_id", "key", "period_end", "value"))
+    cid, series = None, {}
+    for c, key, day, value in rows.iterator(chunk_size=5000):
+        if c != cid:
+            if series:
+                _copy_company(TechnicalBar, cid, series)
+            cid, series = c, {}
+        series.setdefault(day, {})[FIELDS[key]] = float(value)
+    if series:
+        _copy_company(TechnicalBar, cid, series)
+
+    newest = (Metric.objects.filter(company=OuterRef("company"), key=OuterRef("key"))
+              .order_by("-period_end").values("period_end")[:1])
+    Metric.objects.filter(key__in=list(FIELDS), period_end__lt=Subquery(newest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fundamentals', '0005_metric_unique_period'),
+        ('marketdata', '0004_technicalbar'),
+    ]
+
+    operations = [
+        migrations.RunPython(metrics_to_bars, migrations.RunPython.noop),
+    ]
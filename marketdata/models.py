@@ -16,3 +16,38 @@ class PriceBar(models.Model):
             models.Index(fields=["company", "date"]),
             models.Index(fields=["date"]),
         ]
+
+class TechnicalState(models.Model):
+    """
+    Estado incremental de compute_technicals por compañía: acumuladores EWM del
+    RSI y la cola de cierres que necesitan las ventanas (SMA200, 52w, vol 30d).
+    bar_count/close_sum permiten detectar historia editada (=> recálculo completo).
+    """
+    company = models.OneToOneField("companies.Company", on_delete=models.CASCADE, related_name="technical_state")
+    last_date = models.DateField()
+    bar_count = models.IntegerField()
+    close_sum = models.FloatField()
+    avg_up = models.FloatField(null=True, blank=True)
+    avg_down = models.FloatField(null=True, blank=True)
+    tail = models.JSONField(default=list)  # últimos cierres, ascendente
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class TechnicalBar(models.Model):
+    """
+    Serie diaria de indicadores técnicos (una fila por compañía/fecha con
+    columnas tipadas). Metric sólo guarda el último valor de cada indicador.
+    """
+    company = models.ForeignKey("companies.Company", on_delete=models.CASCADE)
+    date = models.DateField()
+    close = models.FloatField(null=True, blank=True)
+    sma_50 = models.FloatField(null=True, blank=True)
+    sma_200 = models.FloatField(null=True, blank=True)
+    rsi_14 = models.FloatField(null=True, blank=True)
+    dist_52w_high = models.FloatField(null=True, blank=True)
+    dist_52w_low = models.FloatField(null=True, blank=True)
+    vol_30d = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [("company", "date")]
+        indexes = [models.Index(fields=["company", "date"])]
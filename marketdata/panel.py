@@ -0,0 +1,301 @@
+# marketdata/panel.py
+"""
+Panel de cierres en disco (derivado de PriceBar) para las rutas de lectura.
+
+Layout CSR en arrays NumPy, abiertos con mmap (np.load(mmap_mode="r")): las
+páginas viven en el page cache del SO y se comparten entre todos los workers
+de gunicorn y los jobs batch, sin materializar objetos del ORM.
+
+    <PRICE_PANEL_DIR>/CURRENT            -> nombre de la generación vigente
+    <PRICE_PANEL_DIR>/gen-<n>/ids.npy      (N,)   company_id ascendente
+    <PRICE_PANEL_DIR>/gen-<n>/offsets.npy  (N+1,) inicio de cada compañía
+    <PRICE_PANEL_DIR>/gen-<n>/dates.npy    (M,)   datetime64[D], ascendente por compañía
+    <PRICE_PANEL_DIR>/gen-<n>/closes.npy   (M,)   float64
+
+Cada reconstrucción escribe una generación nueva y cambia CURRENT con un
+os.replace atómico: los lectores nunca ven un panel a medio escribir. La
+reconstrucción incremental (tras eodhd_prices) sólo relee de la base las
+compañías tocadas y copia el resto desde la generación anterior.
+
+    <PRICE_PANEL_DIR>/gen-<n>/meta.json    {"max_id", "as_of"} de PriceBar al construirla
+
+Si el panel no existe, no trae a la compañía o va detrás de PriceBar (hay
+cierres más nuevos que su última fecha: reconstrucción fallida o cargas por
+otra vía), los helpers leen esa compañía del ORM. La frescura no se consulta
+por compañía: al abrir el panel (y luego cada FRESHNESS_SECONDS) una query
+agregada compara max(id)/max(date) de PriceBar con meta.json; sólo si la base
+avanzó se calcula, en otra query, el conjunto de compañías atrasadas. Las
+reconstrucciones se serializan con un flock (core.locks): dos corridas a la
+vez no pisan la misma generación ni pierden las compañías que relee la otra.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from core.fsutil import atomic_write
+from core.locks import file_lock
+from marketdata.models import PriceBar
+
+KEEP_GENERATIONS = 2  # la vigente + la anterior (lectores que aún la tengan abierta)
+FRESHNESS_SECONDS = 5  # cada cuánto un proceso vuelve a comparar el panel con PriceBar
+
+_cache = {"key": None, "panel": None, "stale": None, "checked": 0.0}
+
+
+def _root() -> Path:
+    return Path(getattr(settings, "PRICE_PANEL_DIR", settings.BASE_DIR / "var" / "panel"))
+
+
+class ClosePanel:
+    def __init__(self, path: Path):
+        self.path = path
+        for name in ("ids", "offsets", "dates", "closes"):
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+        try:
+            self.meta = json.loads((path / "meta.json").read_text("utf-8"))
+        except FileNotFoundError:  # generación anterior a meta.json: se verifica siempre
+            self.meta = {}
+
+    def last_dates(self) -> dict:
+        """{company_id: última fecha} del panel."""
+        offsets = np.asarray(self.offsets)
+        return dict(zip(np.asarray(self.ids).tolist(),
+                        np.asarray(self.dates)[offsets[1:] - 1].astype("O").tolist()))
+
+    def _slice(self, company_id: int) -> Optional[slice]:
+        i = int(np.searchsorted(self.ids, company_id))
+        if i >= len(self.ids) or self.ids[i] != company_id:
+            return None
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def __contains__(self, company_id) -> bool:
+        return self._slice(company_id) is not None
+
+    def series(self, company_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(dates, closes) de la compañía como vistas del mmap, o None."""
+        s = self._slice(company_id)
+        return None if s is None else (self.dates[s], self.closes[s])
+
+    def asof(self, company_id: int, when: dt.date) -> Optional[Tuple[dt.date, float]]:
+        """
+        (date, close) del último cierre con fecha <= when; (None, None) si no hay
+        ninguno y None si la compañía no está en el panel.
+        """
+        s = self._slice(company_id)
+        if s is None:
+            return None
+        d = self.dates[s]
+        k = int(np.searchsorted(d, np.datetime64(when, "D"), side="right")) - 1
+        if k < 0:
+            return None, None
+        return d[k].astype("O"), float(self.closes[s][k])
+
+
+def get_panel() -> Optional[ClosePanel]:
+    """Panel vigente (cacheado por proceso; se reabre si cambió CURRENT)."""
+    current = _root() / "CURRENT"
+    try:
+        st = current.stat()
+    except FileNotFoundError:
+        return None
+    key = (st.st_ino, st.st_mtime_ns)  # os.replace => inodo nuevo
+    if _cache["key"] != key:
+        try:
+            _cache["panel"] = ClosePanel(_root() / current.read_text("ascii").strip())
+        except (FileNotFoundError, ValueError):
+            _cache["panel"] = None
+        _cache.update(key=key, stale=None)
+    return _cache["panel"]
+
+
+def _db_stamp() -> dict:
+    agg = PriceBar.objects.aggregate(max_id=Max("id"), as_of=Max("date"))
+    return {"max_id": agg["max_id"], "as_of": agg["as_of"].isoformat() if agg["as_of"] else None}
+
+
+def stale_ids(panel: ClosePanel) -> frozenset:
+    """
+    Compañías en las que el panel va detrás de PriceBar. Una query agregada
+    por proceso cada FRESHNESS_SECONDS; si la base no avanzó desde meta.json,
+    ninguna (sin mirar compañía por compañía).
+    """
+    now = time.monotonic()
+    if _cache["stale"] is None or now - _cache["checked"] > FRESHNESS_SECONDS:
+        fresh = bool(panel.meta) and _db_stamp() == panel.meta
+        _cache["stale"] = frozenset() if fresh else frozenset(_stale_ids(panel))
+        _cache["checked"] = now
+    return _cache["stale"]
+
+
+# -- lectura con fallback al ORM -------------------------------------------------
+def _panel_series(company_id: int, until: Optional[dt.date] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Serie de la compañía en el panel si está al día con PriceBar (hasta `until`);
+    None si no hay panel, no la trae o hay cierres más nuevos en la base.
+    """
+    panel = get_panel()
+    res = panel.series(company_id) if panel is not None else None
+    if res is None:
+        return None
+    if company_id in stale_ids(panel) and (until is None or until > res[0][-1].astype("O")):
+        return None
+    return res
+
+
+def close_series(company_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(dates datetime64[D], closes float64) ascendentes de una compañía."""
+    res = _panel_series(company_id)
+    if res is not None:
+        return res
+    rows = list(PriceBar.objects.filter(company_id=company_id, close__isnull=False)
+                .order_by("date").values_list("date", "close"))
+    return (np.array([r[0] for r in rows], dtype="datetime64[D]"),
+            np.array([r[1] for r in rows], dtype=np.float64))
+
+
+def close_asof(company_id: int, when: dt.date) -> Tuple[Optional[dt.date], Optional[float]]:
+    """(date, close) del último cierre con fecha <= when."""
+    if _panel_series(company_id, when) is not None:
+        return get_panel().asof(company_id, when)
+    row = (PriceBar.objects.filter(company_id=company_id, date__lte=when, close__isnull=False)
+           .order_by("-date").values_list("date", "close").first())
+    return (row[0], float(row[1])) if row else (None, None)
+
+
+def last_close(company_id: int) -> Tuple[Optional[dt.date], Optional[float]]:
+    """(date, close) del último cierre disponible."""
+    res = _panel_series(company_id)
+    if res is not None:
+        d, c = res
+        return (d[-1].astype("O"), float(c[-1])) if len(d) else (None, None)
+    return close_asof(company_id, dt.date.max)
+
+
+def _stale_ids(panel: ClosePanel, company_ids=None) -> list:
+    """Compañías con cierres en PriceBar más nuevos que su última fecha en el panel (o ausentes)."""
+    qs = PriceBar.objects.filter(close__isnull=False)
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+    db_last = qs.values("company_id").annotate(last=Max("date")).values_list("company_id", "last")
+    panel_last = panel.last_dates()
+    return sorted(cid for cid, last in db_last if cid not in panel_last or last > panel_last[cid])
+
+
+def panel_stamps() -> dict:
+    """{company_id: (nº de cierres, última fecha, suma)} del panel vigente ({} si no hay)."""
+    panel = get_panel()
+    if panel is None or not len(panel.ids):
+        return {}
+    offsets = np.asarray(panel.offsets)
+    counts = np.diff(offsets)
+    last = np.asarray(panel.dates)[offsets[1:] - 1]
+    sums = np.add.reduceat(np.asarray(panel.closes), offsets[:-1])
+    return {cid: (int(n), d, float(t))
+            for cid, n, d, t in zip(np.asarray(panel.ids).tolist(), counts, last.astype("O"), sums)}
+
+
+def panel_rows(company_ids=None):
+    """
+    Filas planas (cids, dates, closes) del panel vigente, ordenadas por
+    (company_id, date), o None si no hay panel. Una query agregada sobre
+    PriceBar (stale_ids, cacheada por proceso) detecta las compañías atrasadas
+    o ausentes del panel; ésas se leen de la base.
+    """
+    panel = get_panel()
+    if panel is None:
+        return None
+    stale = sorted(stale_ids(panel) if company_ids is None else stale_ids(panel) & set(company_ids))
+    counts = np.diff(panel.offsets)
+    if company_ids is None:
+        sel = np.ones(len(panel.ids), dtype=bool)
+    else:
+        sel = np.isin(panel.ids, np.asarray(list(company_ids), dtype=np.int64))
+    sel &= ~np.isin(panel.ids, np.asarray(stale, dtype=np.int64))
+    rows = np.repeat(sel, counts)
+    cids = np.repeat(np.asarray(panel.ids), counts)[rows]
+    dates, closes = np.asarray(panel.dates)[rows], np.asarray(panel.closes)[rows]
+    if stale:
+        # las atrasadas se leen de la base y se intercalan manteniendo el orden
+        s_cids, s_dates, s_closes = _read_db(stale)
+        cids, dates, closes = (np.concatenate([cids, s_cids]), np.concatenate([dates, s_dates]),
+                               np.concatenate([closes, s_closes]))
+        order = np.lexsort((dates, cids))
+        cids, dates, closes = cids[order], dates[order], closes[order]
+    return cids, dates, closes
+
+
+# -- construcción ----------------------------------------------------------------
+def _read_db(company_ids=None, chunk_size=20000):
+    qs = PriceBar.objects.filter(close__isnull=False)
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+    cids, dates, closes = [], [], []
+    for cid, d, close in (qs.order_by("company_id", "date")
+                          .values_list("company_id", "date", "close").iterator(chunk_size=chunk_size)):
+        cids.append(cid)
+        dates.append(d)
+        closes.append(close)
+    return (np.asarray(cids, dtype=np.int64), np.asarray(dates, dtype="datetime64[D]"),
+            np.asarray(closes, dtype=np.float64))
+
+
+def rebuild_panel(company_ids: Iterable[int] = None) -> int:
+    """
+    Escribe una nueva generación del panel y la publica. Sin company_ids (o sin
+    panel previo) relee todo PriceBar; con company_ids sólo relee esas compañías
+    y copia el resto de la generación vigente. Devuelve el nº de cierres.
+    """
+    root = _root()
+    with file_lock(root / ".rebuild.lock"):
+        return _rebuild_locked(root, company_ids)
+
+
+def _rebuild_locked(root: Path, company_ids) -> int:
+    old = get_panel()  # releído bajo el lock: incluye lo que publicó otra reconstrucción
+    # estado de PriceBar antes de leer: lo que llegue durante la lectura cuenta como más nuevo
+    meta = _db_stamp()
+    if company_ids is None or old is None:
+        cids, dates, closes = _read_db()
+    else:
+        touched = np.unique(np.asarray(list(company_ids), dtype=np.int64))
+        # las compañías copiadas del panel anterior siguen al día sólo si no hubo
+        # filas nuevas fuera de las releídas desde que se construyó
+        since = old.meta.get("max_id")
+        if since is None or PriceBar.objects.filter(id__gt=since).exclude(company_id__in=touched.tolist()).exists():
+            meta = old.meta
+        n_cids, n_dates, n_closes = _read_db(touched.tolist())
+        # conservar del panel anterior las compañías no tocadas
+        keep = ~np.isin(old.ids, touched)
+        counts = np.diff(old.offsets)
+        row_keep = np.repeat(keep, counts)
+        o_cids = np.repeat(np.asarray(old.ids), counts)[row_keep]
+        cids = np.concatenate([o_cids, n_cids])
+        dates = np.concatenate([np.asarray(old.dates)[row_keep], n_dates])
+        closes = np.concatenate([np.asarray(old.closes)[row_keep], n_closes])
+        order = np.lexsort((dates, cids))
+        cids, dates, closes = cids[order], dates[order], closes[order]
+
+    ids, start = np.unique(cids, return_index=True)
+    offsets = np.append(start, len(cids)).astype(np.int64)
+
+    gens = sorted((int(p.name[4:]) for p in root.glob("gen-*") if p.name[4:].isdigit()), reverse=True)
+    name = f"gen-{(gens[0] + 1) if gens else 1}"
+    path = root / name
+    path.mkdir(parents=True)
+    for fname, arr in (("ids", ids), ("offsets", offsets), ("dates", dates), ("closes", closes)):
+        np.save(path / f"{fname}.npy", arr)
+    (path / "meta.json").write_text(json.dumps(meta), "utf-8")
+    atomic_write(root / "CURRENT", name.encode("ascii"))
+
+    for g in gens[KEEP_GENERATIONS - 1:]:
+        shutil.rmtree(root / f"gen-{g}", ignore_errors=True)
+    return len(closes)
@@ -0,0 +1,103 @@
+import datetime as dt
+from typing import Dict, Iterable, List
+
+from django.db.models import Max
+
+from marketdata.models import PriceBar, TechnicalBar
+
+PRICE_FIELDS = ["open", "high", "low", "close", "volume"]
+TECH_BAR_FIELDS = ["close", "sma_50", "sma_200", "rsi_14", "dist_52w_high", "dist_52w_low", "vol_30d"]
+
+
+def last_bar_dates(company_ids=None) -> Dict[int, dt.date]:
+    """{company_id: última fecha en PriceBar} en una sola consulta agregada."""
+    qs = PriceBar.objects.all()
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+    rows = qs.values("company_id").annotate(last=Max("date")).values_list("company_id", "last")
+    return dict(rows)
+
+
+def bars_from_rows(company, rows: Iterable[dict]) -> List[PriceBar]:
+    """
+    Convierte filas de un proveedor (dicts con date/open/high/low/close/volume)
+    en instancias PriceBar sin guardar. Ignora filas sin fecha válida y
+    deduplica por fecha (gana la última).
+    """
+    out = {}
+    for row in rows:
+        d = row.get("date")
+        if not d:
+            continue
+        try:
+            date_obj = dt.date.fromisoformat(str(d)[:10])
+            out[date_obj] = PriceBar(
+                company=company,
+                date=date_obj,
+                open=float(row.get("open") or 0),
+                high=float(row.get("high") or 0),
+                low=float(row.get("low") or 0),
+                close=float(row.get("close") or 0),
+                volume=int(row.get("volume") or 0),
+            )
+        except (TypeError, ValueError):
+            continue
+    return list(out.values())
+
+
+def upsert_bars(bars: List[PriceBar], batch_size: int = 1000) -> int:
+    """
+    Upsert por lotes sobre la clave única (company, date):
+    un INSERT ... ON CONFLICT DO UPDATE por cada `batch_size` barras.
+    """
+    if not bars:
+        return 0
+    PriceBar.objects.bulk_create(
+        bars,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["company", "date"],
+        update_fields=PRICE_FIELDS,
+    )
+    return len(bars)
+
+
+def upsert_technical_bars(bars: Iterable[TechnicalBar], batch_size: int = 5000) -> int:
+    """
+    Escritor por lotes de TechnicalBar: consume `bars` (puede ser un generador)
+    y hace un upsert sobre (company, date) cada `batch_size` filas, así la serie
+    completa de miles de compañías nunca vive entera en memoria.
+    """
+    n = 0
+    buf: List[TechnicalBar] = []
+
+    def flush():
+        TechnicalBar.objects.bulk_create(
+            buf,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["company", "date"],
+            update_fields=TECH_BAR_FIELDS,
+        )
+        buf.clear()
+
+    for bar in bars:
+        buf.append(bar)
+        if len(buf) >= batch_size:
+            n += len(buf)
+            flush()
+    if buf:
+        n += len(buf)
+        flush()
+    return n
+
+
+def technical_series(company_id: int, start: dt.date = None, end: dt.date = None,
+                     fields: Iterable[str] = None) -> List[tuple]:
+    """Serie diaria de indicadores de una compañía en una sola consulta: [(date, *fields)]."""
+    qs = TechnicalBar.objects.filter(company_id=company_id)
+    if start:
+        qs = qs.filter(date__gte=start)
+    if end:
+        qs = qs.filter(date__lte=end)
+    return list(qs.order_by("date").values_list("date", *(fields or TECH_BAR_FIELDS)))
@@ -0,0 +1,228 @@
+"""
+Universe-wide technicals over a bars x company close matrix.
+
+Closes for many companies are read in one pass (the mmap panel of
+marketdata.panel when built, else one streamed query) and packed into a
+dense matrix where column j holds company j's closes right-aligned (its last
+bar is the last row, shorter histories are NaN-padded at the top). Rolling
+windows therefore count each company's own bars, exactly like the former
+per-company pandas code, while every indicator is computed for all columns at
+once.
+
+Incremental runs rebuild the same matrix from each company's carried
+TechnicalState (RSI accumulators + the last TAIL closes) plus only its new
+bars, so a daily update costs O(new bars) instead of O(history).
+"""
+import numpy as np
+import pandas as pd
+from django.db.models import Count, Sum
+
+from marketdata.models import PriceBar, TechnicalBar, TechnicalState
+from marketdata.panel import panel_rows
+
+TECH_KEYS = ["SMA_50", "SMA_200", "RSI_14", "DistTo52wHigh", "DistTo52wLow", "Vol_30d"]
+
+# Metric key -> TechnicalBar column
+TECH_FIELDS = {
+    "SMA_50": "sma_50",
+    "SMA_200": "sma_200",
+    "RSI_14": "rsi_14",
+    "DistTo52wHigh": "dist_52w_high",
+    "DistTo52wLow": "dist_52w_low",
+    "Vol_30d": "vol_30d",
+}
+
+# Longest lookback (52w high/low); also covers SMA_200 and the 31 closes of Vol_30d.
+TAIL = 252
+
+
+def right_align(series_list):
+    """[1-D arrays] -> (T, N) matrix, each column right-aligned and NaN-padded on top."""
+    N = len(series_list)
+    T = max((len(s) for s in series_list), default=0)
+    out = np.full((T, N), np.nan)
+    for j, s in enumerate(series_list):
+        if len(s):
+            out[T - len(s):, j] = s
+    return out
+
+
+def _flat_closes(company_ids=None, after=None, chunk_size=20000):
+    """(cids, dates, closes) flat rows ordered by (company_id, date): mmap panel, else ORM."""
+    flat = panel_rows(company_ids)
+    if flat is not None:
+        cids, dates, closes = flat
+        if after:
+            keys = np.fromiter(after, dtype=np.int64, count=len(after))
+            lim = np.array([after[k] for k in keys.tolist()], dtype="datetime64[D]")
+            order = np.argsort(keys)
+            keys, lim = keys[order], lim[order]
+            pos = np.clip(np.searchsorted(keys, cids), 0, max(len(keys) - 1, 0))
+            has = keys[pos] == cids
+            keep = ~has | (dates > lim[pos])
+            cids, dates, closes = cids[keep], dates[keep], closes[keep]
+        ok = ~np.isnan(closes)
+        return cids[ok], dates[ok], closes[ok]
+
+    qs = PriceBar.objects.filter(close__isnull=False)
+    if company_ids is not None:
+        qs = qs.filter(company_id__in=list(company_ids))
+    if after:
+        qs = qs.filter(date__gt=min(after.values()))
+    rows = qs.order_by("company_id", "date").values_list("company_id", "date", "close")
+
+    cids, dates, closes = [], [], []
+    for cid, d, close in rows.iterator(chunk_size=chunk_size):
+        if after and cid in after and d <= after[cid]:
+            continue
+        cids.append(cid)
+        dates.append(d)
+        closes.append(close)
+    return (np.asarray(cids, dtype=np.int64), np.asarray(dates, dtype="datetime64[D]"),
+            np.asarray(closes, dtype=np.float64))
+
+
+def load_close_panel(company_ids=None, after=None, chunk_size=20000):
+    """
+    Closes for many companies in one pass (mmap panel, or one streamed
+    PriceBar query) -> (ids, dates, closes):
+      ids    (N,)   company ids, ascending
+      dates  (T, N) datetime64[D], NaT where padded
+      closes (T, N) float64, NaN where padded
+    after: optional {company_id: date}; only bars strictly after it are kept.
+    """
+    cids, dates, closes = _flat_closes(company_ids, after, chunk_size)
+    if not len(cids):
+        return np.array([], dtype=np.int64), np.empty((0, 0), "datetime64[D]"), np.empty((0, 0))
+
+    ids, start, counts = np.unique(cids, return_index=True, return_counts=True)
+    T, N = int(counts.max()), len(ids)
+    col = np.repeat(np.arange(N), counts)
+    row = np.arange(len(cids)) - np.repeat(start, counts) + np.repeat(T - counts, counts)
+
+    C = np.full((T, N), np.nan)
+    C[row, col] = closes
+    D = np.full((T, N), np.datetime64("NaT"), dtype="datetime64[D]")
+    D[row, col] = dates
+    return ids, D, C
+
+
+def history_stats(company_ids):
+    """{company_id: (bar count, close sum)} from the same source as load_close_panel."""
+    flat = panel_rows(company_ids)
+    if flat is None:
+        rows = (PriceBar.objects.filter(company_id__in=list(company_ids), close__isnull=False)
+                .values("company_id").annotate(n=Count("id"), total=Sum("close"))
+                .values_list("company_id", "n", "total"))
+        return {cid: (n, total) for cid, n, total in rows}
+    cids, _, closes = flat
+    ok = ~np.isnan(closes)
+    ids, inv, counts = np.unique(cids[ok], return_inverse=True, return_counts=True)
+    sums = np.bincount(inv, weights=closes[ok], minlength=len(ids))
+    return {cid: (int(n), float(t)) for cid, n, t in zip(ids.tolist(), counts, sums)}
+
+
+def rsi_ewm(closes, fresh=None, avg_up=None, avg_down=None, period=14):
+    """
+    RSI with the recursion of pandas ewm(alpha=1/period, adjust=False), run
+    row by row and vectorized across columns. The accumulators can be seeded
+    (avg_up/avg_down per column, NaN = start fresh) and only rows where `fresh`
+    is True advance them. Returns (rsi matrix, avg_up, avg_down).
+    """
+    T, N = closes.shape
+    a = 1.0 / period
+    up_s = np.full(N, np.nan) if avg_up is None else np.asarray(avg_up, dtype=np.float64).copy()
+    dn_s = np.full(N, np.nan) if avg_down is None else np.asarray(avg_down, dtype=np.float64).copy()
+    delta = np.vstack([np.full((1, N), np.nan), np.diff(closes, axis=0)])
+    up = np.clip(delta, 0, None)
+    down = np.clip(-delta, 0, None)
+
+    out = np.full((T, N), np.nan)
+    for t in range(1, T):
+        ok = ~np.isnan(delta[t])
+        if fresh is not None:
+            ok &= fresh[t]
+        if not ok.any():
+            continue
+        start = ok & np.isnan(up_s)
+        up_s = np.where(start, up[t], np.where(ok, (1 - a) * up_s + a * up[t], up_s))
+        dn_s = np.where(start, down[t], np.where(ok, (1 - a) * dn_s + a * down[t], dn_s))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[t, ok] = (100 - 100 / (1 + up_s / dn_s))[ok]
+    return out, up_s, dn_s
+
+
+def compute_technicals(closes, fresh=None, avg_up=None, avg_down=None):
+    """
+    (T, N) closes -> ({key: (T, N) indicator matrix}, avg_up, avg_down),
+    column-wise for all companies. fresh/avg_up/avg_down seed the RSI
+    accumulators for incremental runs (see rsi_ewm).
+    """
+    df = pd.DataFrame(closes)
+    out = {
+        "SMA_50": df.rolling(50).mean().to_numpy(),
+        "SMA_200": df.rolling(200).mean().to_numpy(),
+    }
+    out["RSI_14"], avg_up, avg_down = rsi_ewm(closes, fresh, avg_up, avg_down, 14)
+    # 52w window ~ 252 trading days
+    out["DistTo52wHigh"] = (df / df.rolling(252).max() - 1.0).to_numpy()
+    out["DistTo52wLow"] = (df / df.rolling(252).min() - 1.0).to_numpy()
+    # 30d realized vol (annualized)
+    ret = df / df.shift(1) - 1.0
+    out["Vol_30d"] = (ret.rolling(30).std() * (252**0.5)).to_numpy()
+    return out, avg_up, avg_down
+
+
+def _nan_to_none(x):
+    return None if x is None or np.isnan(x) else float(x)
+
+
+def states_from_panel(ids, dates, closes, avg_up, avg_down, base=None):
+    """
+    Build TechnicalState rows after a run over `closes`. `base` maps
+    company_id -> (bar_count, close_sum) of the history older than the matrix
+    (incremental runs, where the matrix starts at the carried tail).
+    """
+    out = []
+    for j, cid in enumerate(ids.tolist()):
+        col = closes[:, j]
+        valid = ~np.isnan(col)
+        if not valid.any():
+            continue
+        count0, sum0 = (base or {}).get(cid, (0, 0.0))
+        out.append(TechnicalState(
+            company_id=cid,
+            last_date=dates[np.flatnonzero(valid)[-1], j].astype("O"),
+            bar_count=count0 + int(valid.sum()),
+            close_sum=sum0 + float(col[valid].sum()),
+            avg_up=_nan_to_none(avg_up[j]),
+            avg_down=_nan_to_none(avg_down[j]),
+            tail=col[valid][-TAIL:].tolist(),
+        ))
+    return out
+
+
+def iter_technical_bars(ids, dates, closes, tech, rows=None):
+    """
+    Yield TechnicalBar rows (unsaved) for every valid bar of the matrix, or only
+    where the (T, N) boolean mask `rows` is True (e.g. the new bars of an
+    incremental run). NaN indicators (warm-up) are stored as NULL.
+    """
+    mask = ~np.isnan(closes)
+    if rows is not None:
+        mask &= rows
+    cols = {TECH_FIELDS[k]: tech[k] for k in TECH_KEYS}
+    ids = ids.tolist()
+    for t, j in zip(*np.nonzero(mask.T)[::-1]):
+        kw = {f: _nan_to_none(m[t, j]) for f, m in cols.items()}
+        yield TechnicalBar(company_id=ids[j], date=dates[t, j].astype("O"), close=float(closes[t, j]), **kw)
+
+
+def save_states(states, batch_size=500):
+    TechnicalState.objects.bulk_create(
+        states,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["company"],
+        update_fields=["last_date", "bar_count", "close_sum", "avg_up", "avg_down", "tail", "updated_at"],
+    )
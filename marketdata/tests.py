@@ -1,3 +1,306 @@
-from django.test import TestCase
+import datetime as dt
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from companies.models import Company
+from fundamentals.models import Metric
+from marketdata import panel
+from marketdata.management.commands import eodhd_prices
+from marketdata.management.commands.compute_technicals import _technicals_chunk
+from marketdata.models import PriceBar, TechnicalBar, TechnicalState
+from marketdata.services import (
+    TECH_BAR_FIELDS, bars_from_rows, last_bar_dates, technical_series, upsert_bars, upsert_technical_bars,
+)
+from marketdata.technicals import (
+    TAIL, TECH_FIELDS, TECH_KEYS, compute_technicals, iter_technical_bars, right_align, rsi_ewm,
+)
+
+
+def _walk(rng, n, start=100.0):
+    return start * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+
+
+class RsiEwmTests(SimpleTestCase):
+    def test_incremental_matches_full(self):
+        rng = np.random.default_rng(1)
+        series = [_walk(rng, n) for n in (400, 300, 40, 16)]
+        split = [380, 250, 25, 15]  # barras ya procesadas por columna
+        full, up_f, dn_f = rsi_ewm(right_align(series))
+
+        _, up0, dn0 = rsi_ewm(right_align([s[:k] for s, k in zip(series, split)]))
+        cols = [np.concatenate([s[:k][-TAIL:], s[k:]]) for s, k in zip(series, split)]
+        closes = right_align(cols)
+        T = closes.shape[0]
+        n_new = np.array([len(s) - k for s, k in zip(series, split)])
+        fresh = np.arange(T)[:, None] >= (T - n_new)[None, :]
+        inc, up_i, dn_i = rsi_ewm(closes, fresh, up0, dn0)
+
+        np.testing.assert_allclose(up_i, up_f, rtol=1e-12)
+        np.testing.assert_allclose(dn_i, dn_f, rtol=1e-12)
+        for j, n in enumerate(n_new):
+            np.testing.assert_allclose(inc[-n:, j], full[-n:, j], rtol=1e-10)
+
+
+@override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp())  # sin panel: lecturas desde PriceBar
+class TechnicalsChunkTests(TestCase):
+    def _bars(self, company, closes, start):
+        PriceBar.objects.bulk_create([PriceBar(company=company, date=start + dt.timedelta(days=i), close=float(c))
+                                      for i, c in enumerate(closes)])
+
+    def _stored(self, company):
+        fields = list(TECH_FIELDS.values())
+        return np.array(list(TechnicalBar.objects.filter(company=company).order_by("date")
+                             .values_list("close", *fields)), dtype=np.float64)
+
+    def _expected(self, closes):
+        tech, _, _ = compute_technicals(closes[:, None])
+        return np.column_stack([closes] + [tech[k][:, 0] for k in TECH_FIELDS])
+
+    def test_mixed_incremental_and_full_chunk(self):
+        rng = np.random.default_rng(3)
+        start = dt.date(2020, 1, 1)
+        ipo = Company.objects.create(ticker="IPO", name="young")
+        split = Company.objects.create(ticker="SPL", name="split-adjusted")
+        ipo_closes, split_closes = _walk(rng, 20), _walk(rng, 60)
+        self._bars(ipo, ipo_closes, start)
+        self._bars(split, split_closes, start)
+        _technicals_chunk([ipo.id, split.id], timezone.now())
+        self.assertEqual(TechnicalState.objects.count(), 2)
+
+        # IPO: 1 barra nueva (incremental); SPL: historia ajustada + 30 barras nuevas (completo)
+        ipo_new = _walk(rng, 1, ipo_closes[-1])
+        self._bars(ipo, ipo_new, start + dt.timedelta(days=20))
+        split_new = _walk(rng, 30, split_closes[-1])
+        self._bars(split, split_new, start + dt.timedelta(days=60))
+        PriceBar.objects.filter(company=split).update(close=F("close") * 0.5)
+        split_all = np.array(list(PriceBar.objects.filter(company=split).order_by("date")
+                                  .values_list("close", flat=True)))
+
+        out = _technicals_chunk([ipo.id, split.id], timezone.now())
+        self.assertEqual((out["incremental"], out["full"]), (1, 1))
+        np.testing.assert_allclose(self._stored(ipo), self._expected(np.concatenate([ipo_closes, ipo_new])),
+                                   rtol=1e-9, equal_nan=True)
+        np.testing.assert_allclose(self._stored(split), self._expected(split_all), rtol=1e-9, equal_nan=True)
+        self.assertEqual(TechnicalState.objects.get(company=ipo).last_date, start + dt.timedelta(days=20))
+
+    def test_prune_keeps_history_missing_from_bars(self):
+        c = Company.objects.create(ticker="OLD", name="legacy")
+        start = dt.date(2020, 1, 1)
+        self._bars(c, _walk(np.random.default_rng(5), 30), start)
+        legacy = dt.date(2019, 12, 31)  # técnico viejo en Metric, sin barra
+        Metric.objects.create(company=c, key="RSI_14", period_end=legacy, period_type="Q", value=55)
+        _technicals_chunk([c.id], timezone.now())
+        PriceBar.objects.create(company=c, date=start + dt.timedelta(days=30), close=120.0)
+        _technicals_chunk([c.id], timezone.now())
+        rsi = list(Metric.objects.filter(company=c, key="RSI_14").order_by("period_end").values_list("period_end", flat=True))
+        self.assertEqual(rsi, [legacy, start + dt.timedelta(days=30)])  # la corrida anterior se podó
+
+
+def _eod(date, close):
+    return {"date": date, "open": close, "high": close, "low": close, "close": close, "volume": 10}
+
+
+class UpsertBarsTests(TestCase):
+    def test_resent_bars_update_in_place(self):
+        c = Company.objects.create(ticker="AAA", name="A")
+        self.assertEqual(upsert_bars(bars_from_rows(c, [_eod("2024-05-09", 10.0), _eod("2024-05-10", 11.0)])), 2)
+        # la vela parcial del 10 vuelve corregida; el 13 es nuevo; filas duplicadas: gana la última
+        rows = [_eod("2024-05-10", 11.5), _eod("2024-05-13", 12.0), _eod("2024-05-13", 12.5), {"date": None}]
+        self.assertEqual(upsert_bars(bars_from_rows(c, rows), batch_size=1), 2)
+        self.assertEqual(list(PriceBar.objects.filter(company=c).order_by("date").values_list("date", "close")),
+                         [(dt.date(2024, 5, 9), 10.0), (dt.date(2024, 5, 10), 11.5), (dt.date(2024, 5, 13), 12.5)])
+        self.assertEqual(last_bar_dates(), {c.id: dt.date(2024, 5, 13)})
+        self.assertEqual(upsert_bars([]), 0)
+
+
+class _FakeResponse:
+    def __init__(self, rows):
+        self.content = json.dumps(rows).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.content)
+
+
+@override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp(), RAW_ARCHIVE_DIR=tempfile.mkdtemp())
+class EodhdPricesIncrementalTests(TestCase):
+    def setUp(self):
+        panel._cache.update(key=None, panel=None, stale=None, checked=0.0)
+        self.a = Company.objects.create(ticker="AAA", name="A")
+        self.b = Company.objects.create(ticker="BBB", name="B")
+        upsert_bars(bars_from_rows(self.a, [_eod("2024-05-09", 10.0), _eod("2024-05-10", 11.0)]))
+        self.feed = {"AAA": [_eod("2024-05-10", 11.5), _eod("2024-05-13", 12.0)],
+                     "BBB": [_eod("2024-05-13", 50.0)]}
+
+    def _run(self, *args):
+        starts = {}
+
+        def get(url, params):
+            symbol = url.rsplit("/", 1)[-1]
+            starts[symbol] = params["from"]
+            return _FakeResponse([r for r in self.feed[symbol] if r["date"] >= params["from"]])
+
+        with mock.patch.dict(os.environ, {"EODHD_API_KEY": "k"}), \
+                mock.patch.object(eodhd_prices, "VendorClient") as client:
+            client.return_value.get.side_effect = get
+            call_command("eodhd_prices", "--years", "30", "--workers", "2", *args, stdout=io.StringIO())
+        return starts
+
+    def _closes(self, c):
+        return list(PriceBar.objects.filter(company=c).order_by("date").values_list("date", "close"))
+
+    def test_second_run_fetches_from_last_bar(self):
+        since = (dt.date.today() - dt.timedelta(days=30 * 365)).isoformat()
+        self.assertEqual(self._run(), {"AAA": "2024-05-10", "BBB": since})  # BBB sin historia: --years
+        self.assertEqual(self._closes(self.a), [(dt.date(2024, 5, 9), 10.0), (dt.date(2024, 5, 10), 11.5),
+                                                (dt.date(2024, 5, 13), 12.0)])
+        self.feed["BBB"].append(_eod("2024-05-14", 51.0))
+        self.assertEqual(self._run(), {"AAA": "2024-05-13", "BBB": "2024-05-13"})
+        self.assertEqual(self._closes(self.b), [(dt.date(2024, 5, 13), 50.0), (dt.date(2024, 5, 14), 51.0)])
+        self.assertEqual(self._run("--full"), {"AAA": since, "BBB": since})
+        self.assertEqual(PriceBar.objects.count(), 5)  # re-envíos: actualizan, no duplican
+
+
+class TechnicalBarStoreTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.a = Company.objects.create(ticker="AAA", name="A")
+        self.b = Company.objects.create(ticker="BBB", name="B")
+        self.ids = np.array([self.a.id, self.b.id])
+        self.closes = right_align([_walk(rng, 260), _walk(rng, 40)])
+        T = self.closes.shape[0]
+        days = np.datetime64("2023-01-02") + np.arange(T)
+        self.dates = np.repeat(days[:, None], 2, axis=1)
+        self.tech, _, _ = compute_technicals(self.closes)
+
+    def _series(self, company):
+        return np.array([row[1:] for row in technical_series(company.id)], dtype=np.float64)
+
+    def _expected(self, j):
+        valid = ~np.isnan(self.closes[:, j])
+        return np.column_stack([self.closes[valid, j]] + [self.tech[k][valid, j] for k in TECH_KEYS])
+
+    def test_round_trip(self):
+        n = upsert_technical_bars(iter_technical_bars(self.ids, self.dates, self.closes, self.tech), batch_size=7)
+        self.assertEqual(n, 260 + 40)
+        self.assertEqual(TECH_BAR_FIELDS[1:], [TECH_FIELDS[k] for k in TECH_KEYS])
+        for j, c in enumerate((self.a, self.b)):
+            np.testing.assert_allclose(self._series(c), self._expected(j), rtol=1e-12, equal_nan=True)
+        first = technical_series(self.b.id)[0]
+        self.assertEqual(first[0], self.dates[-40, 1].astype("O"))
+        self.assertIsNone(first[2])  # SMA_50 en calentamiento -> NULL
+
+    def test_masked_rows_update_in_place(self):
+        upsert_technical_bars(iter_technical_bars(self.ids, self.dates, self.closes, self.tech))
+        closes = self.closes.copy()
+        closes[-1] *= 2
+        tech, _, _ = compute_technicals(closes)
+        fresh = np.zeros(closes.shape, dtype=bool)
+        fresh[-1] = True
+        self.assertEqual(upsert_technical_bars(iter_technical_bars(self.ids, self.dates, closes, tech, rows=fresh)), 2)
+        self.assertEqual(TechnicalBar.objects.count(), 300)
+        last = TechnicalBar.objects.get(company=self.a, date=self.dates[-1, 0].astype("O"))
+        self.assertEqual((last.close, last.sma_50), (closes[-1, 0], tech["SMA_50"][-1, 0]))
+
+
+class TechnicalMetricsMigrationTests(TestCase):
+    def test_copies_history_then_keeps_latest(self):
+        migration = importlib.import_module("marketdata.migrations.0005_technical_metrics_to_bars")
+        c = Company.objects.create(ticker="AAA", name="A")
+        days = [dt.date(2024, 1, d) for d in (2, 3, 4)]
+        for i, day in enumerate(days):
+            Metric.objects.create(company=c, key="SMA_50", period_end=day, period_type="Q", value=10 + i)
+            Metric.objects.create(company=c, key="close", period_end=day, period_type="Q", value=20 + i)
+        Metric.objects.create(company=c, key="Price", period_end=days[0], period_type="Q", value=20)
+        TechnicalBar.objects.create(company=c, date=days[0], close=99.0, rsi_14=50.0)  # barra ya calculada
+
+        migration.metrics_to_bars(apps, None)
+        bars = list(TechnicalBar.objects.filter(company=c).order_by("date").values_list("date", "close", "sma_50", "rsi_14"))
+        self.assertEqual(bars, [(days[0], 99.0, 10.0, 50.0), (days[1], 21.0, 11.0, None), (days[2], 22.0, 12.0, None)])
+        self.assertEqual(sorted(Metric.objects.values_list("key", "period_end")),
+                         [("Price", days[0]), ("SMA_50", days[2]), ("close", days[2])])
+
+
+class PanelTests(TestCase):
+    def setUp(self):
+        panel_dir = override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp())
+        panel_dir.enable()
+        self.addCleanup(panel_dir.disable)
+        self.c = Company.objects.create(ticker="AAA", name="A")
+        self.start = dt.date(2024, 1, 1)
+        PriceBar.objects.bulk_create([PriceBar(company=self.c, date=self.start + dt.timedelta(days=i), close=10.0 + i)
+                                      for i in range(5)])
+        panel.rebuild_panel()
+
+    def test_reads_fall_back_when_panel_is_behind(self):
+        new_day = self.start + dt.timedelta(days=5)
+        PriceBar.objects.create(company=self.c, date=new_day, close=99.0)  # sin reconstruir el panel
+        dates, closes = panel.close_series(self.c.id)
+        self.assertEqual((dates[-1].astype("O"), closes[-1]), (new_day, 99.0))
+        self.assertEqual(panel.last_close(self.c.id), (new_day, 99.0))
+        self.assertEqual(panel.close_asof(self.c.id, self.start + dt.timedelta(days=2)),
+                         (self.start + dt.timedelta(days=2), 12.0))
+        cids, dates, closes = panel.panel_rows([self.c.id])
+        self.assertEqual((len(cids), closes[-1]), (6, 99.0))
+
+    def test_fresh_panel_reads_without_per_company_queries(self):
+        other = Company.objects.create(ticker="BBB", name="B")
+        PriceBar.objects.create(company=other, date=self.start, close=5.0)
+        panel.rebuild_panel([other.id])
+        with self.assertNumQueries(1):  # una sola comparación con PriceBar por carga del panel
+            for cid in (self.c.id, other.id) * 3:
+                panel.close_series(cid)
+                panel.last_close(cid)
+                panel.close_asof(cid, self.start)
+            panel.panel_rows()
+        self.assertEqual(panel.stale_ids(panel.get_panel()), frozenset())
+
+    def test_concurrent_rebuilds(self):
+        ids = list(range(1, 7))
+        day = np.datetime64("2024-01-01")
+
+        def fake_read_db(company_ids=None, chunk_size=20000):
+            time.sleep(0.02)  # solapar las reconstrucciones
+            sel = ids if company_ids is None else sorted(company_ids)
+            n = 3 if company_ids is not None else 2  # relectura: una barra más
+            return (np.repeat(np.array(sel, dtype=np.int64), n),
+                    np.tile(day + np.arange(n), len(sel)), np.ones(n * len(sel)))
+
+        errors = []
+
+        def rebuild(cid):
+            try:
+                panel.rebuild_panel([cid])
+            except Exception as e:  # FileExistsError sin lock
+                errors.append(e)
+
+        no_db = {"max_id": None, "as_of": None}  # los hilos no tocan la base (SQLite de tests)
+        with mock.patch.object(panel, "_read_db", fake_read_db), mock.patch.object(panel, "_db_stamp", return_value=no_db):
+            panel.rebuild_panel()
+            threads = [threading.Thread(target=rebuild, args=(cid,)) for cid in ids]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        current = panel.get_panel()
+        self.assertEqual([len(current.series(cid)[0]) for cid in ids], [3] * len(ids))  # ninguna relectura perdida
+        gens = [p for p in Path(settings.PRICE_PANEL_DIR).glob("gen-*")]
+        self.assertLessEqual(len(gens), panel.KEEP_GENERATIONS)
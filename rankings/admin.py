@@ -1,3 +1,6 @@
 from django.contrib import admin
+from .models import Ranking, RankingRun
 
-# Register your models here.
+# Ranking.definition_json is the ranking registry (schema in rankings/engine.py)
+admin.site.register(Ranking)
+admin.site.register(RankingRun)
@@ -0,0 +1,227 @@
+"""
+Point-in-time backtests of ranking definitions (rankings/engine.py schema).
+
+All inputs are preloaded once into dense (dates x companies) matrices:
+  - each metric key as of every rebalance date, from Metric rows whose
+    period_end + lag_days is on or before that date -- no look-ahead. Filings
+    land weeks after the quarter closes, so lag_days defaults to
+    REPORTING_LAG_DAYS; pass 0 only for values known on their period_end;
+    technical keys come from the daily TechnicalBar series, since Metric
+    only keeps their latest value;
+  - the last close on or before each rebalance date (mmap panel or PriceBar),
+    dropped when older than max_stale_days.
+Both go through the vectorized as-of lookup of fundamentals/asof.py.
+A definition is then scored at every date at once (normalization runs per
+date across the investable cross-section) and evaluated against the next
+period's return: Spearman IC, quantile returns / top-minus-bottom spread and
+top-quantile turnover. Parameter sets are independent, so run_backtests can
+spread them over a process pool that receives the matrices once per worker.
+"""
+import datetime as dt
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from django import db
+
+from companies.models import Company
+from fundamentals.asof import asof_matrix, load_points
+from marketdata.technicals import _flat_closes
+from rankings.engine import required_keys, validate_definition
+
+# 10-Q filings are due 40-45 days after quarter end: a metric stamped with its
+# period_end is not public on that date
+REPORTING_LAG_DAYS = 45
+
+
+class BacktestData:
+    """Preloaded matrices shared by every parameter set of a backtest."""
+
+    def __init__(self, dates, ids, prices, values, sectors):
+        self.dates = dates      # (D,) datetime64[D] rebalance dates
+        self.ids = ids          # (N,) company ids, ascending
+        self.prices = prices    # (D, N) close as of each date, NaN = none/stale
+        self.values = values    # {key: (D, N)} point-in-time metric values
+        self.sectors = sectors  # (N,) lower-cased sector ("" if unknown)
+
+
+def rebalance_dates(start, end, freq="ME"):
+    return pd.date_range(start, end, freq=freq).values.astype("datetime64[D]")
+
+
+def load_backtest_data(keys, start, end, freq="ME", company_ids=None, lag_days=REPORTING_LAG_DAYS,
+                       max_stale_days=7):
+    dates = rebalance_dates(start, end, freq)
+    qs = Company.objects.order_by("id")
+    if company_ids is not None:
+        qs = qs.filter(id__in=list(company_ids))
+    companies = list(qs.values_list("id", "sector"))
+    ids = np.array([c[0] for c in companies], dtype=np.int64)
+    sectors = np.array([(c[1] or "").lower() for c in companies], dtype=object)
+
+    cids, pdates, closes = _flat_closes(ids.tolist())
+    prices, seen = asof_matrix(cids, pdates, closes, ids, dates)
+    stale = (dates[:, None] - seen) > np.timedelta64(int(max_stale_days), "D")
+    prices[stale] = np.nan
+
+    values = {}
+    for k, (c, d, v) in load_points(keys, ids.tolist(), lag_days).items():
+        values[k], _ = asof_matrix(c, d, v, ids, dates)
+    return BacktestData(dates, ids, prices, values, sectors)
+
+
+# -- scoring / evaluation ---------------------------------------------------------
+def _rank_rows(M):
+    """Percentile ranks along axis 1 (NaN stays NaN, ties averaged)."""
+    return pd.DataFrame(M).rank(axis=1, pct=True).to_numpy()
+
+
+def score_panel(definition, data):
+    """(D, N) scores of `definition` at every rebalance date; NaN = not ranked."""
+    weights = definition["weights"]
+    keys = list(weights)
+    D, N = data.prices.shape
+    nan = np.full((D, N), np.nan)
+    X = np.stack([data.values.get(k, nan) for k in keys], axis=2)
+    valid = ~np.isnan(X).any(axis=2) & ~np.isnan(data.prices)
+    filters = definition.get("filters") or {}
+    with np.errstate(invalid="ignore"):
+        for k, v in (filters.get("min") or {}).items():
+            valid &= data.values.get(k, nan) >= v
+        for k, v in (filters.get("max") or {}).items():
+            valid &= data.values.get(k, nan) <= v
+    if filters.get("sectors"):
+        allowed = {s.lower() for s in filters["sectors"]}
+        valid &= np.array([s in allowed for s in data.sectors], dtype=bool)[None, :]
+
+    sign = np.array([-1.0 if (definition.get("direction") or {}).get(k) == "lower" else 1.0 for k in keys])
+    X = np.where(valid[:, :, None], X * sign, np.nan)
+    how = definition.get("normalization", "zscore")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # dates with an empty cross-section
+        if how == "minmax":
+            lo, hi = np.nanmin(X, axis=1, keepdims=True), np.nanmax(X, axis=1, keepdims=True)
+            span = hi - lo
+            span[span == 0] = 1.0
+            Z = (X - lo) / span
+        elif how == "rank":
+            Z = np.stack([_rank_rows(X[:, :, n]) for n in range(len(keys))], axis=2)
+        else:
+            sd = np.nanstd(X, axis=1, keepdims=True)
+            sd[sd == 0] = 1.0
+            Z = (X - np.nanmean(X, axis=1, keepdims=True)) / sd
+    S = Z @ np.array([float(weights[k]) for k in keys])
+    return np.where(valid, S, np.nan)
+
+
+def _row_corr(A, B):
+    """Pearson correlation per row over entries where both are finite."""
+    ok = ~np.isnan(A) & ~np.isnan(B)
+    n = ok.sum(axis=1)
+    A, B = np.where(ok, A, 0.0), np.where(ok, B, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ma, mb = A.sum(axis=1) / n, B.sum(axis=1) / n
+        da, db_ = np.where(ok, A - ma[:, None], 0.0), np.where(ok, B - mb[:, None], 0.0)
+        return (da * db_).sum(axis=1) / np.sqrt((da ** 2).sum(axis=1) * (db_ ** 2).sum(axis=1))
+
+
+def evaluate(scores, data, quantiles=5, min_names=None):
+    """
+    IC / quantile spread / turnover of a (D, N) score panel against the next
+    rebalance period's returns. Quantile 1 holds the best scores.
+    """
+    min_names = max(quantiles, min_names or 0)
+    P = data.prices
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fwd = P[1:] / P[:-1] - 1.0
+    S = scores[:-1]
+    ok = ~np.isnan(S) & ~np.isnan(fwd)
+    enough = ok.sum(axis=1) >= min_names
+    S = np.where(ok & enough[:, None], S, np.nan)
+    R = np.where(ok & enough[:, None], fwd, np.nan)
+
+    ic = _row_corr(_rank_rows(S), _rank_rows(R))
+    pct = _rank_rows(S)
+    bucket = np.where(np.isnan(pct), 0, quantiles - np.ceil(pct * quantiles).clip(1, quantiles) + 1).astype(int)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        qret = np.stack([np.nanmean(np.where(bucket == b, R, np.nan), axis=1)
+                         for b in range(1, quantiles + 1)], axis=1)
+    spread = qret[:, 0] - qret[:, -1]
+
+    top = bucket == 1
+    held = top[:-1].sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        turnover = 1.0 - (top[1:] & top[:-1]).sum(axis=1) / held
+    turnover = np.where(held > 0, turnover, np.nan)
+
+    periods = np.flatnonzero(enough)
+    gaps = np.diff(data.dates.astype(np.int64))
+    ppy = 365.25 / float(np.median(gaps)) if len(gaps) else 12.0
+    ic_p, sp_p = ic[periods], spread[periods]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ic_std = float(np.nanstd(ic_p, ddof=1)) if len(ic_p) > 1 else float("nan")
+        summary = {
+            "periods": int(len(periods)),
+            "ic_mean": float(np.nanmean(ic_p)),
+            "ic_ir": float(np.nanmean(ic_p) / ic_std * np.sqrt(ppy)) if ic_std else float("nan"),
+            "ic_hit_rate": float(np.mean(ic_p[~np.isnan(ic_p)] > 0)) if len(ic_p) else float("nan"),
+            "quantile_mean": [float(x) for x in np.nanmean(qret[periods], axis=0)],
+            "spread_mean": float(np.nanmean(sp_p)),
+            "spread_ann": float(np.prod(1.0 + np.nan_to_num(sp_p)) ** (ppy / max(len(sp_p), 1)) - 1.0),
+            "turnover_mean": float(np.nanmean(turnover)),
+        }
+    return {
+        "summary": summary,
+        "dates": [d.astype("O").isoformat() for d in data.dates[:-1]],
+        "ic": ic.tolist(),
+        "quantile_returns": qret.tolist(),
+        "spread": spread.tolist(),
+        "turnover": [float("nan")] + turnover.tolist(),
+    }
+
+
+def backtest(definition, data, quantiles=5):
+    validate_definition(definition)
+    return evaluate(score_panel(definition, data), data, quantiles)
+
+
+# -- several parameter sets ---------------------------------------------------------
+_worker_data = {}
+
+
+def _init_worker(data):
+    from core.parallel import _init_worker as _django_worker
+
+    _django_worker()
+    _worker_data["data"] = data
+
+
+def _backtest_worker(name, definition, quantiles):
+    return name, backtest(definition, _worker_data["data"], quantiles)
+
+
+def run_backtests(definitions, start, end, freq="ME", quantiles=5, company_ids=None,
+                  lag_days=REPORTING_LAG_DAYS, max_stale_days=7, workers=1):
+    """
+    {name: definition} -> {name: backtest result}. Data for the union of the
+    definitions' keys is loaded once; with workers > 1 each process receives it
+    once and evaluates a share of the parameter sets.
+    """
+    for d in definitions.values():
+        validate_definition(d)
+    keys = list(dict.fromkeys(k for d in definitions.values() for k in required_keys(d)))
+    data = load_backtest_data(keys, start, end, freq, company_ids, lag_days, max_stale_days)
+    if workers <= 1 or len(definitions) <= 1:
+        return {name: backtest(d, data, quantiles) for name, d in definitions.items()}
+    db.connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+        futures = [pool.submit(_backtest_worker, name, d, quantiles) for name, d in definitions.items()]
+        return dict(f.result() for f in futures)
+
+
+def default_window(years=10, today=None):
+    today = today or dt.date.today()
+    return today - dt.timedelta(days=round(365.25 * years)), today
@@ -1,49 +1,226 @@
+import hashlib
+import json
+
+import numpy as np
 import pandas as pd
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 from companies.models import Company
-from fundamentals.models import Metric
-from rankings.models import Ranking, RankingResult
+from fundamentals.services import latest_metric_maps
+from rankings.models import Ranking, RankingResult, RankingRun
 
 SLUG = "quality_value"
 DEF = {"name": SLUG, "weights": {"Revenue_YoY": 1.0, "NetIncome_TTM": 0.5}}
 
-def run_ranking():
-    rows = []
-    for c in Company.objects.all():
-        m = {x.key: float(x.value) for x in Metric.objects.filter(company=c)}
-        if "Revenue_YoY" in m and "NetIncome_TTM" in m:
-            rows.append({"ticker": c.ticker, **m})
-    if not rows:
-        return None
-
-    df = pd.DataFrame(rows).set_index("ticker")
-    for k in DEF["weights"]:
-        mu = df[k].mean()
-        sd = df[k].std(ddof=0) or 1.0
-        df[f"z_{k}"] = (df[k] - mu) / sd
-    df["score"] = sum(DEF["weights"][k] * df[f"z_{k}"] for k in DEF["weights"])
-    df.sort_values("score", ascending=False, inplace=True)
+# Built-in rankings, created on first run. Any other Ranking row whose
+# definition_json follows the schema below is scored in the same pass.
+DEFAULT_RANKINGS = {SLUG: ("Quality + Value", DEF)}
+
+# definition_json schema:
+#   weights        {metric key: weight}                     (required)
+#   direction      {metric key: "higher" | "lower"}         default "higher" is better
+#   normalization  "zscore" | "minmax" | "rank"             default "zscore"
+#   filters        {"min": {key: v}, "max": {key: v}, "sectors": [..]}
+# Companies missing any weighted key are left out; filters run before normalizing.
+NORMALIZATIONS = ("zscore", "minmax", "rank")
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and np.isfinite(v)
+
+def _mapping(value, what):
+    if not isinstance(value, dict) or not all(isinstance(k, str) for k in value):
+        raise ValueError(f"{what} must be a mapping of metric keys")
+    return value
+
+def validate_definition(definition):
+    """Raise ValueError if `definition` does not follow the schema above."""
+    if not isinstance(definition, dict):
+        raise ValueError("definition must be a JSON object")
+    weights = definition.get("weights")
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError("definition needs a non-empty 'weights' mapping")
+    for k, w in _mapping(weights, "'weights'").items():
+        if not _is_number(w):
+            raise ValueError(f"weight for {k!r} must be a number")
+    for k, d in _mapping(definition.get("direction") or {}, "'direction'").items():
+        if d not in ("higher", "lower"):
+            raise ValueError(f"direction for {k!r} must be 'higher' or 'lower'")
+    if definition.get("normalization", "zscore") not in NORMALIZATIONS:
+        raise ValueError(f"normalization must be one of {NORMALIZATIONS}")
+    filters = definition.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise ValueError("'filters' must be a mapping")
+    unknown = set(filters) - {"min", "max", "sectors"}
+    if unknown:
+        raise ValueError(f"unknown filters: {sorted(unknown)}")
+    for bound in ("min", "max"):
+        for k, v in _mapping(filters.get(bound) or {}, f"filters.{bound}").items():
+            if not _is_number(v):
+                raise ValueError(f"filters.{bound} for {k!r} must be a number")
+    sectors = filters.get("sectors") or []
+    if not isinstance(sectors, list) or not all(isinstance(x, str) for x in sectors):
+        raise ValueError("filters.sectors must be a list of sector names")
+
+def required_keys(definition):
+    filters = definition.get("filters") or {}
+    keys = list(definition["weights"])
+    for bound in ("min", "max"):
+        keys += [k for k in (filters.get(bound) or {}) if k not in keys]
+    return keys
+
+def _load_matrix(keys):
+    """company_id x key frame of latest values (LatestMetric, one query); NaN = missing."""
+    return pd.DataFrame(latest_metric_maps(keys)).reindex(columns=keys).sort_index()
+
+def _normalize(X, how):
+    if how == "minmax":
+        lo, hi = X.min(axis=0), X.max(axis=0)
+        span = hi - lo
+        span[span == 0] = 1.0
+        return (X - lo) / span
+    if how == "rank":
+        return pd.DataFrame(X).rank(pct=True).to_numpy()
+    sd = X.std(axis=0)
+    sd[sd == 0] = 1.0
+    return (X - X.mean(axis=0)) / sd
+
+def score_definition(definition, matrix, sectors=None):
+    """
+    Score one definition against the shared company x key matrix.
+    Returns (company ids, scores, normalized drivers, weighted keys), best first;
+    ties keep the lower company id first.
+    """
+    weights = definition["weights"]
+    keys = list(weights)
+    filters = definition.get("filters") or {}
+    mask = matrix[keys].notna().all(axis=1).to_numpy().copy()
+    for k, v in (filters.get("min") or {}).items():
+        mask &= (matrix[k] >= v).to_numpy()
+    for k, v in (filters.get("max") or {}).items():
+        mask &= (matrix[k] <= v).to_numpy()
+    if filters.get("sectors"):
+        allowed = {s.lower() for s in filters["sectors"]}
+        mask &= np.array([(sectors.get(cid) or "").lower() in allowed for cid in matrix.index.tolist()], dtype=bool)
+
+    ids = matrix.index.to_numpy()[mask]
+    X = matrix[keys].to_numpy(dtype=np.float64)[mask]
+    if not len(ids):
+        return ids, np.empty(0), np.empty((0, len(keys))), keys
+    sign = np.array([-1.0 if (definition.get("direction") or {}).get(k) == "lower" else 1.0 for k in keys])
+    Z = _normalize(X * sign, definition.get("normalization", "zscore"))
+    score = Z @ np.array([float(weights[k]) for k in keys])
+    order = np.argsort(-score, kind="stable")
+    return ids[order], score[order], Z[order], keys
+
+def definition_hash(definition):
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode("utf-8")).hexdigest()
 
+def registered_rankings(slugs=None):
+    """Ranking rows to score (built-ins are created if missing)."""
+    for slug, (name, definition) in DEFAULT_RANKINGS.items():
+        Ranking.objects.get_or_create(slug=slug, defaults={"name": name, "definition_json": definition})
+    qs = Ranking.objects.order_by("slug")
+    if slugs:
+        qs = qs.filter(slug__in=list(slugs))
+    return list(qs)
+
+def run_rankings(slugs=None):
+    """
+    Score every registered ranking (or `slugs`) from one load of the union of
+    their metric keys. Returns ([published Ranking], {slug: error}).
+    """
+    rankings, errors = [], {}
+    for r in registered_rankings(slugs):
+        try:
+            validate_definition(r.definition_json)
+        except ValueError as e:
+            errors[r.slug] = str(e)
+            continue
+        rankings.append(r)
+    if not rankings:
+        return [], errors
+
+    keys = list(dict.fromkeys(k for r in rankings for k in required_keys(r.definition_json)))
+    matrix = _load_matrix(keys)
+    sectors = None
+    if any((r.definition_json.get("filters") or {}).get("sectors") for r in rankings):
+        sectors = dict(Company.objects.values_list("id", "sector"))
+
+    published = []
+    for r in rankings:
+        # one bad definition must not stop the others
+        try:
+            ids, scores, Z, wkeys = score_definition(r.definition_json, matrix, sectors)
+            if not len(ids):
+                errors[r.slug] = "no data to rank"
+                continue
+            results = [
+                RankingResult(
+                    company_id=int(cid),
+                    score=float(scores[i]),
+                    rank=i + 1,
+                    snapshot_json={k: float(Z[i, n]) for n, k in enumerate(wkeys)},
+                )
+                for i, cid in enumerate(ids.tolist())
+            ]
+            published.append(_publish(r, results))
+        except Exception as e:
+            errors[r.slug] = f"{type(e).__name__}: {e}"
+    return published, errors
+
+def run_ranking(slug=SLUG):
+    """Run a single registered ranking; None if it had nothing to rank."""
+    published, _ = run_rankings([slug])
+    return published[0] if published else None
+
+def _publish(r, results):
+    # Each execution is a new immutable run; readers keep using current_run
+    # until the pointer is flipped below, so nothing is deleted under them.
     with transaction.atomic():
-        # Reuse (or create) the same Ranking row
-        r, _ = Ranking.objects.get_or_create(
-            slug=SLUG,
-            defaults={"name": "Quality + Value", "definition_json": DEF},
-        )
-        # keep definition up to date
-        r.definition_json = DEF
-        r.save(update_fields=["definition_json"])
-
-        # Replace previous results
-        RankingResult.objects.filter(ranking=r).delete()
-
-        for i, (tic, row) in enumerate(df.iterrows(), 1):
-            drivers = {k: float(row[f"z_{k}"]) for k in DEF["weights"]}
-            RankingResult.objects.create(
-                ranking=r,
-                company=Company.objects.get(ticker=tic),
-                score=float(row["score"]),
-                rank=i,
-                snapshot_json=drivers,
-            )
+        run = RankingRun.objects.create(ranking=r, definition_json=r.definition_json,
+                                        definition_hash=definition_hash(r.definition_json),
+                                        n_results=len(results))
+        for res in results:
+            res.ranking = r
+            res.run = run
+        RankingResult.objects.bulk_create(results, batch_size=1000)
+
+    # publish: single-row pointer swap, pruning under the same row lock so a
+    # concurrent publish can't have its run deleted before it becomes current
+    with transaction.atomic():
+        Ranking.objects.select_for_update().only("pk").get(pk=r.pk)
+        Ranking.objects.filter(pk=r.pk).update(current_run=run, run_at=timezone.now())
+        r.current_run = run
+        prune_runs(r)
     return r
+
+def prune_runs(ranking, keep=None):
+    """Delete runs older than the newest `keep` (RANKING_RUNS_KEEP); never the current one."""
+    keep = getattr(settings, "RANKING_RUNS_KEEP", 30) if keep is None else keep
+    with transaction.atomic():
+        # re-read the pointer under the row lock: another publish may have moved it
+        current = (Ranking.objects.select_for_update().filter(pk=ranking.pk)
+                   .values_list("current_run_id", flat=True).first())
+        old = list(RankingRun.objects.filter(ranking=ranking).order_by("-created_at", "-id")
+                   .values_list("id", flat=True)[max(1, keep):])
+        if current in old:
+            old.remove(current)
+        if old:
+            RankingRun.objects.filter(id__in=old).delete()
+    return len(old)
+
+def diff_runs(old_run_id, new_run_id):
+    """
+    Rank changes between two runs: [{company_id, old_rank, new_rank, delta}],
+    delta > 0 = moved up; None ranks mean the company entered/left the ranking.
+    """
+    old = dict(RankingResult.objects.filter(run_id=old_run_id).values_list("company_id", "rank"))
+    new = dict(RankingResult.objects.filter(run_id=new_run_id).values_list("company_id", "rank"))
+    out = []
+    for cid in sorted(old.keys() | new.keys()):
+        o, n = old.get(cid), new.get(cid)
+        if o != n:
+            out.append({"company_id": cid, "old_rank": o, "new_rank": n,
+                        "delta": (o - n) if o is not None and n is not None else None})
+    return out
@@ -0,0 +1,75 @@
+import datetime as dt
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from rankings.backtest import REPORTING_LAG_DAYS, default_window, run_backtests
+from rankings.engine import registered_rankings, validate_definition
+
+class Command(BaseCommand):
+    help = "Point-in-time backtest of ranking definitions (IC, quantile spreads, turnover)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", nargs="*", help="Registered rankings to test (default: all)")
+        parser.add_argument("--definition", action="append", default=[],
+                            help='Extra parameter set as JSON, e.g. \'{"weights": {"PE_TTM": 1}, '
+                                 '"direction": {"PE_TTM": "lower"}}\' (repeatable)')
+        parser.add_argument("--start", type=dt.date.fromisoformat, help="First rebalance window date (default: 10y ago)")
+        parser.add_argument("--end", type=dt.date.fromisoformat, help="Last date (default: today)")
+        parser.add_argument("--freq", default="ME", help="Rebalance frequency (pandas alias, default ME = month end)")
+        parser.add_argument("--quantiles", type=int, default=5)
+        parser.add_argument("--lag-days", type=int, default=REPORTING_LAG_DAYS,
+                            help=f"Days after period_end before a metric counts as known "
+                                 f"(default {REPORTING_LAG_DAYS}, typical 10-Q filing delay)")
+        parser.add_argument("--tickers", nargs="*", help="Limit the universe to these tickers")
+        parser.add_argument("--workers", type=int, default=1, help="Processes for parameter sets (default 1)")
+        parser.add_argument("--output", help="Write full per-period results as JSON to this path")
+
+    def handle(self, *args, **opts):
+        definitions = {}
+        if opts.get("slug") or not opts["definition"]:
+            for r in registered_rankings(opts.get("slug")):
+                definitions[r.slug] = r.definition_json
+        for i, raw in enumerate(opts["definition"], 1):
+            try:
+                d = json.loads(raw)
+                validate_definition(d)
+            except ValueError as e:
+                raise CommandError(f"--definition #{i}: {e}")
+            definitions[d.get("name") or f"custom_{i}"] = d
+        bad = []
+        for name, d in definitions.items():
+            try:
+                validate_definition(d)
+            except ValueError as e:
+                bad.append(name)
+                self.stdout.write(self.style.WARNING(f"{name}: skipped ({e})"))
+        for name in bad:
+            definitions.pop(name)
+        if not definitions:
+            raise CommandError("Nothing to backtest")
+
+        start, end = default_window()
+        start, end = opts.get("start") or start, opts.get("end") or end
+        ids = None
+        if opts.get("tickers"):
+            ids = list(Company.objects.filter(ticker__in=[t.upper() for t in opts["tickers"]])
+                       .values_list("id", flat=True))
+
+        results = run_backtests(definitions, start, end, freq=opts["freq"], quantiles=opts["quantiles"],
+                                company_ids=ids, lag_days=opts["lag_days"], workers=opts["workers"])
+
+        q = opts["quantiles"]
+        self.stdout.write(f"{'definition':<20} {'periods':>7} {'IC':>7} {'IC IR':>7} {'hit':>5} "
+                          f"{'Q1':>7} {f'Q{q}':>7} {'spread':>7} {'spr/yr':>7} {'turn':>5}")
+        for name, res in results.items():
+            s = res["summary"]
+            self.stdout.write(
+                f"{name:<20} {s['periods']:>7} {s['ic_mean']:>7.3f} {s['ic_ir']:>7.2f} {s['ic_hit_rate']:>5.2f} "
+                f"{s['quantile_mean'][0]:>7.2%} {s['quantile_mean'][-1]:>7.2%} {s['spread_mean']:>7.2%} "
+                f"{s['spread_ann']:>7.2%} {s['turnover_mean']:>5.2f}")
+        if opts.get("output"):
+            with open(opts["output"], "w", encoding="utf-8") as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {opts['output']}"))
@@ -1,12 +1,23 @@
 from django.core.management.base import BaseCommand
-from rankings.engine import run_ranking
+from core.parallel import add_parallel_arguments
+from rankings.engine import run_rankings
 
 class Command(BaseCommand):
-    help = "Run the Quality + Value ranking"
+    help = "Run every registered ranking (Ranking.definition_json) in one pass"
 
-    def handle(self, *args, **kwargs):
-        r = run_ranking()
-        if r:
-            self.stdout.write(self.style.SUCCESS(f"Ranking '{r.slug}' created"))
-        else:
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", nargs="*", help="Only these ranking slugs")
+        # kept so existing cron lines keep working; scoring loads everything in one query
+        add_parallel_arguments(parser, shard=False)
+
+    def handle(self, *args, **opts):
+        if opts["workers"] > 1:
+            self.stdout.write(self.style.WARNING("--workers is ignored: rankings load in a single query"))
+        published, errors = run_rankings(opts.get("slug"))
+        for r in published:
+            self.stdout.write(self.style.SUCCESS(
+                f"Ranking '{r.slug}' created (run {r.current_run_id}, {r.current_run.n_results} companies)"))
+        for slug, err in errors.items():
+            self.stdout.write(self.style.WARNING(f"Ranking '{slug}' skipped: {err}"))
+        if not published and not errors:
             self.stdout.write(self.style.WARNING("No data to rank"))
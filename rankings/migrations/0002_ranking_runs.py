@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0002_tickercik'),
+        ('rankings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('definition_json', models.JSONField()),
+                ('definition_hash', models.CharField(db_index=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('n_results', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='rankingresult',
+            name='rankings_ra_ranking_9db274_idx',
+        ),
+        migrations.AddField(
+            model_name='rankingrun',
+            name='ranking',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='rankings.ranking'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rankingresult',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='ranking',
+            name='current_run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rankings.rankingrun'),
+        ),
+        migrations.AddField(
+            model_name='rankingresult',
+            name='run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='rankings.rankingrun'),
+        ),
+        migrations.AddIndex(
+            model_name='rankingrun',
+            index=models.Index(fields=['ranking', '-created_at'], name='rankings_ra_ranking_3f0dfe_idx'),
+        ),
+    ]
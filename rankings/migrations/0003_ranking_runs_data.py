@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:53
+
+import hashlib
+import json
+
+from django.db import migrations
+
+
+def results_to_runs(apps, schema_editor):
+    """Los resultados existentes de cada ranking pasan a ser su primera corrida (la vigente)."""
+    Ranking = apps.get_model("rankings", "Ranking")
+    RankingRun = apps.get_model("rankings", "RankingRun")
+    RankingResult = apps.get_model("rankings", "RankingResult")
+    for r in Ranking.objects.all():
+        results = RankingResult.objects.filter(ranking=r)
+        n = results.count()
+        if not n:
+            continue
+        digest = hashlib.sha256(json.dumps(r.definition_json, sort_keys=True).encode("utf-8")).hexdigest()
+        run = RankingRun.objects.create(ranking=r, definition_json=r.definition_json,
+                                        definition_hash=digest, n_results=n)
+        RankingRun.objects.filter(pk=run.pk).update(created_at=r.run_at)
+        results.update(run=run)
+        r.current_run = run
+        r.save(update_fields=["current_run"])
+
+
+# Sólo datos: los constraints de RankingResult van en 0004 (en Postgres no se
+# puede alterar la tabla con triggers de FK diferidos pendientes en la misma
+# transacción).
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rankings', '0002_ranking_runs'),
+    ]
+
+    operations = [
+        migrations.RunPython(results_to_runs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rankings', '0003_ranking_runs_data'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='rankingresult',
+            unique_together={('run', 'company')},
+        ),
+        migrations.AddIndex(
+            model_name='rankingresult',
+            index=models.Index(fields=['run', 'rank'], name='rankings_ra_run_id_61f212_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from companies.models import Company
 
@@ -6,17 +7,42 @@ class Ranking(models.Model):
     name = models.CharField(max_length=120)
     definition_json = models.JSONField()
     run_at = models.DateTimeField(auto_now_add=True)
+    # corrida publicada; se cambia de un golpe al terminar una nueva (rankings/engine.py)
+    current_run = models.ForeignKey("RankingRun", null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name="+")
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        from rankings.engine import validate_definition
+        try:
+            validate_definition(self.definition_json)
+        except ValueError as e:
+            raise ValidationError({"definition_json": str(e)})
+
+class RankingRun(models.Model):
+    """Una ejecución inmutable de un ranking: su definición (y hash) y sus resultados."""
+    ranking = models.ForeignKey(Ranking, on_delete=models.CASCADE, related_name="runs")
+    definition_json = models.JSONField()
+    definition_hash = models.CharField(max_length=64, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    n_results = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["ranking", "-created_at"])]
+
+    def __str__(self):
+        return f"{self.ranking_id}#{self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
+
 class RankingResult(models.Model):
     ranking = models.ForeignKey(Ranking, on_delete=models.CASCADE, related_name="results")
+    run = models.ForeignKey(RankingRun, on_delete=models.CASCADE, related_name="results", null=True)
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     score = models.FloatField()
     rank = models.IntegerField()
     snapshot_json = models.JSONField()
 
     class Meta:
-        unique_together = ("ranking", "company")
-        indexes = [models.Index(fields=["ranking", "rank"])]
+        unique_together = ("run", "company")
+        indexes = [models.Index(fields=["run", "rank"])]
@@ -1,3 +1,221 @@
-from django.test import TestCase
+import datetime as dt
+import io
+import tempfile
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from companies.models import Company
+from fundamentals.models import LatestMetric, Metric
+from fundamentals.services import MetricWriter
+from marketdata.models import PriceBar
+from rankings.backtest import REPORTING_LAG_DAYS, rebalance_dates, run_backtests
+from rankings.engine import DEF, SLUG, diff_runs, prune_runs, run_rankings, validate_definition
+from rankings.models import Ranking, RankingResult, RankingRun
+
+GOOD = {"weights": {"PE_TTM": 1.0}, "direction": {"PE_TTM": "lower"}}
+
+
+class ValidateDefinitionTests(SimpleTestCase):
+    def test_accepts_schema(self):
+        validate_definition(GOOD)
+        validate_definition({"weights": {"A": 1, "B": -0.5}, "normalization": "rank",
+                             "filters": {"min": {"A": 0}, "max": {"B": 1e9}, "sectors": ["Tech"]}})
+
+    def test_rejects_bad_types(self):
+        bad = [
+            None, [], "x",
+            {"weights": {}},
+            {"weights": {"A": "1"}},
+            {"weights": {"A": True}},
+            {"weights": {"A": float("nan")}},
+            {"weights": {"A": 1}, "direction": ["A"]},
+            {"weights": {"A": 1}, "normalization": "log"},
+            {"weights": {"A": 1}, "filters": ["min"]},
+            {"weights": {"A": 1}, "filters": {"avg": {}}},
+            {"weights": {"A": 1}, "filters": {"min": {"A": "10"}}},
+            {"weights": {"A": 1}, "filters": {"max": [1]}},
+            {"weights": {"A": 1}, "filters": {"sectors": "Tech"}},
+            {"weights": {"A": 1}, "filters": {"sectors": ["Tech", 3]}},
+        ]
+        for d in bad:
+            with self.subTest(definition=d), self.assertRaises(ValueError):
+                validate_definition(d)
+
+
+class RunRankingsTests(TestCase):
+    def setUp(self):
+        self.a = Company.objects.create(ticker="AAA", name="A", sector="Tech")
+        self.b = Company.objects.create(ticker="BBB", name="B", sector="Energy")
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", dt.date(2024, 3, 31), "TTM", 10.0)
+            w.add(self.b.id, "PE_TTM", dt.date(2024, 3, 31), "TTM", 20.0)
+
+    def test_bad_admin_row_does_not_abort_others(self):
+        Ranking.objects.create(slug="cheap", name="Cheap", definition_json=GOOD)
+        Ranking.objects.create(slug="bad_filters", name="Bad", definition_json={"weights": {"PE_TTM": 1.0},
+                                                                                 "filters": "Tech"})
+        Ranking.objects.create(slug="bad_sectors", name="Bad", definition_json={
+            "weights": {"PE_TTM": 1.0}, "filters": {"sectors": "Tech"}})
+        published, errors = run_rankings(["cheap", "bad_filters", "bad_sectors"])
+        self.assertEqual([r.slug for r in published], ["cheap"])
+        self.assertEqual(set(errors), {"bad_filters", "bad_sectors"})
+        top = Ranking.objects.get(slug="cheap").current_run.results.order_by("rank").first()
+        self.assertEqual(top.company_id, self.a.id)
+
+    def test_sector_filter(self):
+        Ranking.objects.create(slug="energy", name="Energy", definition_json={
+            "weights": {"PE_TTM": 1.0}, "filters": {"sectors": ["energy"]}})
+        published, errors = run_rankings(["energy"])
+        self.assertEqual(errors, {})
+        self.assertEqual(list(published[0].current_run.results.values_list("company_id", flat=True)), [self.b.id])
+
+    def test_command_still_accepts_workers(self):
+        Ranking.objects.create(slug="cheap", name="Cheap", definition_json=GOOD)
+        out = io.StringIO()
+        call_command("run_ranking", "--slug", "cheap", "--workers", "4", stdout=out)
+        self.assertIn("--workers is ignored", out.getvalue())
+        self.assertIn("Ranking 'cheap' created", out.getvalue())
+
+
+def _legacy_ranking():
+    """Motor anterior, compañía por compañía: z-score ddof=0 y sólo filas completas."""
+    rows = []
+    for c in Company.objects.order_by("id"):
+        m = {x.key: float(x.value) for x in Metric.objects.filter(company=c)}
+        if all(k in m for k in DEF["weights"]):
+            rows.append({"id": c.id, **m})
+    df = pd.DataFrame(rows).set_index("id")
+    for k in DEF["weights"]:
+        df[f"z_{k}"] = (df[k] - df[k].mean()) / (df[k].std(ddof=0) or 1.0)
+    df["score"] = sum(w * df[f"z_{k}"] for k, w in DEF["weights"].items())
+    return df.sort_values("score", ascending=False, kind="stable")  # empates: id menor primero
+
+
+class LegacyEquivalenceTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        cs = Company.objects.bulk_create([Company(ticker=f"T{i}", name=f"N{i}") for i in range(40)])
+        with MetricWriter() as w:
+            for c in cs:
+                for k in DEF["weights"]:
+                    if rng.random() < 0.15:  # métrica faltante: la compañía queda fuera
+                        continue
+                    w.add(c.id, k, dt.date(2024, 3, 31), "TTM", float(rng.integers(0, 4)))  # muchos empates
+
+    def test_matches_previous_engine(self):
+        expected = _legacy_ranking()
+        published, errors = run_rankings([SLUG])
+        self.assertEqual(errors, {})
+        got = list(published[0].current_run.results.order_by("rank")
+                   .values_list("company_id", "score", "snapshot_json"))
+        self.assertEqual([cid for cid, _, _ in got], expected.index.tolist())
+        for (cid, score, snap), (_, row) in zip(got, expected.iterrows()):
+            self.assertAlmostEqual(score, row["score"], places=9)
+            for k in DEF["weights"]:
+                self.assertAlmostEqual(snap[k], row[f"z_{k}"], places=9)
+
+    def test_zscore_uses_population_std(self):
+        Metric.objects.all().delete()
+        LatestMetric.objects.all().delete()
+        a, b = Company.objects.order_by("id")[:2]
+        with MetricWriter() as w:
+            for c, v in ((a, 1.0), (b, 3.0)):
+                for k in DEF["weights"]:
+                    w.add(c.id, k, dt.date(2024, 3, 31), "TTM", v)
+        published, _ = run_rankings([SLUG])
+        snaps = [r.snapshot_json for r in published[0].current_run.results.order_by("rank")]
+        self.assertEqual([s["Revenue_YoY"] for s in snaps], [1.0, -1.0])  # ddof=1 daría ±0.707
+
+
+class PublishTests(TestCase):
+    def setUp(self):
+        self.a = Company.objects.create(ticker="AAA", name="A")
+        self.b = Company.objects.create(ticker="BBB", name="B")
+        with MetricWriter() as w:
+            w.add(self.a.id, "PE_TTM", dt.date(2024, 3, 31), "TTM", 10.0)
+            w.add(self.b.id, "PE_TTM", dt.date(2024, 3, 31), "TTM", 20.0)
+        self.r = Ranking.objects.create(slug="cheap", name="Cheap", definition_json=GOOD)
+
+    def _run(self):
+        run_rankings(["cheap"])
+        return Ranking.objects.get(pk=self.r.pk).current_run_id
+
+    def test_publish_swaps_pointer_and_keeps_previous_run(self):
+        first = self._run()
+        second = self._run()
+        self.assertNotEqual(first, second)
+        self.assertEqual(RankingResult.objects.filter(run_id=first).count(), 2)  # intacta para lectores
+        self.assertEqual(list(RankingResult.objects.filter(run_id=second).order_by("rank")
+                              .values_list("company_id", flat=True)), [self.a.id, self.b.id])
+
+    @override_settings(RANKING_RUNS_KEEP=2)
+    def test_prune_keeps_newest_runs(self):
+        runs = [self._run() for _ in range(4)]
+        self.assertEqual(sorted(RankingRun.objects.values_list("id", flat=True)), runs[-2:])
+        self.assertEqual(RankingResult.objects.filter(run_id__in=runs[:2]).count(), 0)
+
+    def test_prune_never_deletes_run_made_current_concurrently(self):
+        runs = [self._run() for _ in range(3)]
+        stale = Ranking.objects.get(pk=self.r.pk)  # current_run = runs[-1]
+        # otro proceso publica (aquí: repunta) entre la lectura y la poda
+        Ranking.objects.filter(pk=self.r.pk).update(current_run_id=runs[0])
+        self.assertEqual(prune_runs(stale, keep=1), 1)
+        self.assertEqual(sorted(RankingRun.objects.values_list("id", flat=True)), [runs[0], runs[2]])
+
+    def test_diff_runs(self):
+        old = self._run()
+        c = Company.objects.create(ticker="CCC", name="C")
+        with MetricWriter() as w:
+            w.add(c.id, "PE_TTM", dt.date(2024, 3, 31), "TTM", 5.0)
+        LatestMetric.objects.filter(company=self.b).delete()  # B sale del ranking
+        new = self._run()
+        self.assertEqual(diff_runs(old, new), [
+            {"company_id": self.a.id, "old_rank": 1, "new_rank": 2, "delta": -1},
+            {"company_id": self.b.id, "old_rank": 2, "new_rank": None, "delta": None},
+            {"company_id": c.id, "old_rank": None, "new_rank": 1, "delta": None},
+        ])
+        self.assertEqual(diff_runs(new, new), [])
+
+
+@override_settings(PRICE_PANEL_DIR=tempfile.mkdtemp())  # sin panel: precios desde PriceBar
+class BacktestLookAheadTests(TestCase):
+    """El retorno del período siguiente sólo puntúa si se publicó antes de la fecha de rebalanceo."""
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.start, self.end = dt.date(2018, 1, 1), dt.date(2022, 12, 31)
+        dates = rebalance_dates(self.start, self.end).astype("O")
+        cs = Company.objects.bulk_create([Company(ticker=f"T{i}", name=f"N{i}") for i in range(60)])
+        P = 100 * np.exp(np.cumsum(rng.normal(0, 0.08, (len(dates), len(cs))), axis=0))
+        PriceBar.objects.bulk_create([PriceBar(company=c, date=d, close=float(P[t, j]))
+                                      for j, c in enumerate(cs) for t, d in enumerate(dates)])
+        ms = []
+        for j, c in enumerate(cs):
+            for t in range(len(dates) - 1):
+                fwd = float(P[t + 1, j] / P[t, j] - 1)
+                # Known: fechado en el rebalanceo t (si fuera público ahí, sería oro)
+                ms.append(Metric(company=c, key="Known", period_end=dates[t], period_type="Q", value=fwd))
+                # Future: el mismo retorno, fechado cuando de verdad se conoce (t+1)
+                ms.append(Metric(company=c, key="Future", period_end=dates[t + 1], period_type="Q", value=fwd))
+        Metric.objects.bulk_create(ms)
+
+    def _ic(self, lag_days=0):
+        defs = {"known": {"weights": {"Known": 1}}, "future": {"weights": {"Future": 1}}}
+        res = run_backtests(defs, self.start, self.end, lag_days=lag_days)
+        return {name: r["summary"]["ic_mean"] for name, r in res.items()}
+
+    def test_future_values_are_not_visible(self):
+        ic = self._ic()
+        self.assertGreater(ic["known"], 0.99)
+        self.assertLess(abs(ic["future"]), 0.1)  # sólo ve el retorno ya realizado
+
+    def test_lag_days_delays_publication(self):
+        self.assertLess(abs(self._ic(lag_days=1)["known"]), 0.1)
+
+    def test_default_lag_is_reporting_delay(self):
+        res = run_backtests({"known": {"weights": {"Known": 1}}}, self.start, self.end)
+        self.assertEqual(REPORTING_LAG_DAYS, 45)
+        self.assertLess(abs(res["known"]["summary"]["ic_mean"]), 0.1)  # fechado en t, visible ~t+2